@@ -8,10 +8,21 @@ class TheoryOfMindAgent(ABC):
     '''
     Base Theory of Mind Agent abstract 
     class for type hinting.
+
+    Agents explore with probability `eps` and learn
+    at `learning_speed`, the module defaults unless
+    set per agent (e.g. by a simulation backend).
+
+    Beliefs left out are drawn for each agent. Agents
+    use __slots__, so they carry no attribute dict.
     '''
-    def __init__(self, beliefs = generate_beliefs(), intentions = generate_beliefs()) -> None:
-        self.beliefs = beliefs
-        self.intentions = intentions
+    __slots__ = ('beliefs', 'intentions', 'eps', 'learning_speed')
+
+    def __init__(self, beliefs = None, intentions = None) -> None:
+        self.beliefs = beliefs if beliefs is not None else generate_beliefs()
+        self.intentions = intentions if intentions is not None else generate_beliefs()
+        self.eps = EPS
+        self.learning_speed = LEARNING_SPEED
 
     @abstractmethod
     def decide(self, **kwargs) -> int:
@@ -26,9 +37,11 @@ class SignalingAgent(TheoryOfMindAgent):
     Base Theory of Mind Signaling Agent 
     abstract class for type hinting.
     '''
-    def __init__(self, beliefs=generate_2d_beliefs(), intentions=generate_beliefs()) -> None:
+    __slots__ = ('chosen_signal',)
+
+    def __init__(self, beliefs=None, intentions=None) -> None:
         self.chosen_signal = 0
-        super().__init__(beliefs, intentions)
+        super().__init__(beliefs if beliefs is not None else generate_2d_beliefs(), intentions)
 
     @abstractmethod
     def signal(self, **kwargs) -> int:
@@ -39,14 +52,16 @@ class ReceivingAgent(TheoryOfMindAgent):
     Base Theory of Mind Receiving Agent 
     abstract class for type hinting.
     '''
+    __slots__ = ('connected_beliefs',)
+
     def __init__(
         self, 
-        beliefs=generate_beliefs(), 
-        intentions=generate_beliefs(), 
-        connected_beliefs=generate_2d_beliefs()
+        beliefs=None, 
+        intentions=None, 
+        connected_beliefs=None
     ) -> None:
         super().__init__(beliefs, intentions)
-        self.connected_beliefs = connected_beliefs
+        self.connected_beliefs = connected_beliefs if connected_beliefs is not None else generate_2d_beliefs()
 
     @abstractmethod
     def process_signal(self, signal: int, **kwargs) -> None:
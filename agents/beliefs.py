@@ -0,0 +1,372 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List
+
+import numpy as np
+
+# Lazy scale factors are folded back into the values outside this range
+MIN_SCALE = 1e-100
+MAX_SCALE = 1e100
+
+@dataclass(frozen=True)
+class BeliefPrecision:
+    '''
+    Storage format of the raw values of BeliefMatrix
+    and JointBeliefMatrix. Rows are renormalized to a
+    scale of `unit` as soon as their scale leaves
+    [min_scale, max_scale], before they are reinforced,
+    so raw values stay within range of the dtype.
+    Row sums, scales and argmaxes stay float64 / int64.
+    '''
+    name: str
+    dtype: np.dtype
+    unit: float = 1.0
+    min_scale: float = MIN_SCALE
+    max_scale: float = MAX_SCALE
+
+    def quantize(self, values: np.ndarray) -> np.ndarray:
+        ''' Rounds raw values to the storage dtype. '''
+        if np.issubdtype(self.dtype, np.integer):
+            return np.rint(values).astype(self.dtype)
+        return np.asarray(values, dtype=self.dtype)
+
+    def to_raw(self, values: np.ndarray) -> np.ndarray:
+        ''' Stores actual values at a scale of `unit`. '''
+        return self.quantize(values / self.unit if self.unit != 1.0 else values)
+
+# Beliefs sum to about 1, so raw values stay below 1 / min_scale (in units of `unit`)
+PRECISIONS: Dict[str, BeliefPrecision] = {
+    precision.name: precision
+    for precision in (
+        BeliefPrecision('float64', np.dtype(np.float64)),
+        BeliefPrecision('float32', np.dtype(np.float32), min_scale=1e-30, max_scale=1e30),
+        BeliefPrecision('float16', np.dtype(np.float16), min_scale=2.0 ** -15, max_scale=2.0 ** 15),
+        # Fixed point: 1.0 is stored as 2 ** 15, one belief is at most 65000
+        BeliefPrecision('uint16', np.dtype(np.uint16), unit=2.0 ** -15, min_scale=1.0 / 65000, max_scale=1.0),
+    )
+}
+PRECISION_BY_DTYPE = {precision.dtype: precision for precision in PRECISIONS.values()}
+
+def get_precision(name: str) -> BeliefPrecision:
+    if name not in PRECISIONS:
+        raise ValueError(f"Unknown belief precision {name!r}, expected one of {tuple(PRECISIONS)}.")
+    return PRECISIONS[name]
+
+def precision_of(values: np.ndarray) -> BeliefPrecision:
+    ''' The precision raw values are stored in. '''
+    return PRECISION_BY_DTYPE[values.dtype]
+
+class BeliefVector:
+    '''
+    List-like container of beliefs that keeps the
+    index of its largest element up to date as single
+    elements change, so decisions need no linear scan.
+    Ties resolve to the lowest index, like the scans
+    in the agents' decide methods.
+
+    Beliefs are stored as raw values times a shared
+    scale factor, so rescaling the whole vector is
+    O(1). The scale factor is only folded back into
+    the values when it risks underflow or overflow.
+    '''
+    __slots__ = ('values', 'scale_factor', 'total', 'argmax')
+
+    def __init__(self, values: Iterable[float]) -> None:
+        self.values = list(values)
+        self.scale_factor: float = 1.0
+        self.total: float = sum(self.values)
+        self.argmax: int = self._scan()
+
+    def _scan(self) -> int:
+        # index finds the first occurrence, so ties go to the lowest index
+        return self.values.index(max(self.values))
+
+    def _raise(self, index: int, raw_value: float) -> None:
+        ''' Sets a raw value that is not lower than the current one. '''
+        self.values[index] = raw_value
+        highest_value = self.values[self.argmax]
+
+        if raw_value > highest_value or (raw_value == highest_value and index < self.argmax):
+            self.argmax = index
+
+    def _renormalize(self) -> None:
+        scale_factor = self.scale_factor
+        self.values = [value * scale_factor for value in self.values]
+        self.scale_factor = 1.0
+        self.total = sum(self.values)
+
+    def __getitem__(self, index: int) -> float:
+        return self.values[index] * self.scale_factor
+
+    def __setitem__(self, index: int, value: float) -> None:
+        old_value = self.values[index] * self.scale_factor
+        self.total += value - old_value
+
+        if value >= old_value:
+            self._raise(index, value / self.scale_factor)
+        else:
+            self.values[index] = value / self.scale_factor
+            if index == self.argmax:
+                # Only a drop of the current maximum needs a rescan
+                self.argmax = self._scan()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self) -> Iterator[float]:
+        scale_factor = self.scale_factor
+        return (value * scale_factor for value in self.values)
+
+    def __repr__(self) -> str:
+        return f"BeliefVector({list(self)!r})"
+
+    def scale(self, factor: float) -> None:
+        ''' Multiplies every belief by a positive factor, which keeps the argmax. '''
+        self.scale_factor *= factor
+        self.total *= factor
+
+        if not MIN_SCALE < self.scale_factor < MAX_SCALE:
+            self._renormalize()
+
+    def reinforce(self, index: int, learning_speed: float) -> None:
+        '''
+        Rescales the beliefs to sum to (1 - learning_speed)
+        and then adds learning_speed to one of them, in O(1).
+        '''
+        self.scale((1.0 - learning_speed) / self.total)
+        self._raise(index, self.values[index] + learning_speed / self.scale_factor)
+        self.total += learning_speed
+
+def flat_indices(matrix: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    '''
+    Indices into matrix.ravel() of one column per row,
+    cheaper than take/put_along_axis on contiguous arrays.
+    '''
+    number_of_columns = matrix.shape[-1]
+    row_starts = np.arange(0, columns.size * number_of_columns, number_of_columns).reshape(columns.shape)
+    return row_starts + columns
+
+@dataclass
+class BeliefMatrix:
+    '''
+    Rows of beliefs for a whole population, stored
+    like BeliefVector: row i holds values[i] times
+    scale[i], with the row sums and argmaxes kept
+    up to date, so reinforcing one belief per row
+    costs O(1) per row. Arrays may carry leading
+    replicate axes.
+    '''
+    values: np.ndarray  # (..., rows, C) raw values, in a BeliefPrecision dtype
+    scale: np.ndarray   # (..., rows) scale factor of every row
+    total: np.ndarray   # (..., rows) sum of every (scaled) row
+    best: np.ndarray    # (..., rows) argmax of every row
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, precision: str = 'float64') -> 'BeliefMatrix':
+        ''' Stores float64 beliefs in the given precision. '''
+        belief_precision = get_precision(precision)
+        raw_values = belief_precision.to_raw(values)
+        return cls(
+            values=raw_values,
+            scale=np.full(values.shape[:-1], belief_precision.unit),
+            total=values.sum(axis=-1),
+            best=np.argmax(raw_values, axis=-1),
+        )
+
+    @classmethod
+    def from_state(cls, name: str, state: Dict[str, np.ndarray]) -> 'BeliefMatrix':
+        ''' Rebuilds the matrix stored under name by get_state. '''
+        return cls(
+            values=state[f"{name}_values"],
+            scale=state[f"{name}_scale"],
+            total=state[f"{name}_total"],
+            best=state[f"{name}_best"],
+        )
+
+    @classmethod
+    def from_vectors(cls, vectors: List[BeliefVector], number_of_choices: int) -> 'BeliefMatrix':
+        ''' Stacks BeliefVectors, keeping their raw values, scale factors and argmaxes. '''
+        return cls(
+            values=np.array([vector.values for vector in vectors], dtype=float).reshape(-1, number_of_choices),
+            scale=np.array([vector.scale_factor for vector in vectors], dtype=float),
+            total=np.array([vector.total for vector in vectors], dtype=float),
+            best=np.array([vector.argmax for vector in vectors], dtype=np.int64),
+        )
+
+    def get_state(self, name: str) -> Dict[str, np.ndarray]:
+        ''' Returns the arrays of the matrix, named after it. '''
+        return {
+            f"{name}_values": self.values,
+            f"{name}_scale": self.scale,
+            f"{name}_total": self.total,
+            f"{name}_best": self.best,
+        }
+
+    def to_vectors(self, vectors: List[BeliefVector]) -> None:
+        ''' Copies every row back into a BeliefVector, the inverse of from_vectors. '''
+        for vector, values, scale, total, best in zip(
+                vectors, self.values.tolist(), self.scale.tolist(), self.total.tolist(), self.best.tolist()
+            ):
+            vector.values = values
+            vector.scale_factor = scale
+            vector.total = total
+            vector.argmax = best
+
+    @property
+    def rows(self) -> int:
+        return self.values.shape[-2]
+
+    @property
+    def number_of_choices(self) -> int:
+        return self.values.shape[-1]
+
+    @property
+    def precision(self) -> BeliefPrecision:
+        return precision_of(self.values)
+
+    def scaled(self) -> np.ndarray:
+        ''' Returns the actual beliefs, with the scale factors applied. '''
+        return self.values * self.scale[..., np.newaxis]
+
+    def renormalize(self, rows) -> None:
+        ''' Folds the scale factors of some rows (a mask or indices) back into their values. '''
+        precision = self.precision
+        scaled = self.values[rows] * self.scale[rows][..., np.newaxis]
+        self.values[rows] = precision.to_raw(scaled)
+        self.scale[rows] = precision.unit
+        self.total[rows] = scaled.sum(axis=-1)
+
+    def reinforce(self, columns: np.ndarray, learning_speed: float) -> None:
+        '''
+        Rescales every row to sum to (1 - learning_speed)
+        and then adds learning_speed to one belief per row,
+        in place. Only the reinforced belief grows relative
+        to the others, so the argmax is updated without a scan.
+        '''
+        precision = self.precision
+        factor = (1.0 - learning_speed) / self.total
+        self.scale *= factor
+        # In place, as the arrays may be views of shared memory
+        self.total *= factor
+
+        # Like BeliefVector, fold the scale back in before the raw values grow
+        out_of_range = (self.scale < precision.min_scale) | (self.scale > precision.max_scale)
+        if out_of_range.any():
+            self.renormalize(out_of_range)
+        self.total += learning_speed
+
+        flat_values = self.values.reshape(-1)
+        reinforced_indices = flat_indices(self.values, columns)
+        reinforced = precision.quantize(flat_values[reinforced_indices] + learning_speed / self.scale)
+        flat_values[reinforced_indices] = reinforced
+
+        # Ties resolve to the lowest index, like np.argmax
+        highest = flat_values[flat_indices(self.values, self.best)]
+        new_best = (reinforced > highest) | ((reinforced == highest) & (columns < self.best))
+        np.copyto(self.best, columns, where=new_best)
+
+    def reinforce_rows(self, rows: np.ndarray, columns: np.ndarray, learning_speed: float) -> None:
+        '''
+        Like reinforce, for some rows of a 2D matrix
+        only: rows are distinct row indices and columns
+        the belief reinforced in each of them.
+        '''
+        precision = self.precision
+        factor = (1.0 - learning_speed) / self.total[rows]
+        scale = self.scale[rows] * factor
+        self.scale[rows] = scale
+        self.total[rows] = self.total[rows] * factor
+
+        out_of_range = rows[(scale < precision.min_scale) | (scale > precision.max_scale)]
+        if out_of_range.shape[0] > 0:
+            self.renormalize(out_of_range)
+            scale = self.scale[rows]
+        self.total[rows] += learning_speed
+
+        reinforced = precision.quantize(self.values[rows, columns] + learning_speed / scale)
+        self.values[rows, columns] = reinforced
+
+        best = self.best[rows]
+        highest = self.values[rows, best]
+        new_best = (reinforced > highest) | ((reinforced == highest) & (columns < best))
+        self.best[rows] = np.where(new_best, columns, best)
+
+@dataclass
+class JointBeliefMatrix:
+    '''
+    One joint belief table per agent (e.g. signal x
+    action), stored like BeliefMatrix: table i holds
+    values[i] times scale[i]. The row sums of every
+    table and the argmaxes of the row sums and of
+    every row are kept up to date, so reinforcing
+    one cell per agent costs O(1) per agent.
+    '''
+    values: np.ndarray       # (N, rows, C) raw values, in a BeliefPrecision dtype
+    scale: np.ndarray        # (N,) scale factor of every table
+    total: np.ndarray        # (N,) sum of every (scaled) table
+    row_totals: np.ndarray   # (N, rows) raw row sums
+    best_row: np.ndarray     # (N,) argmax of the row sums
+    best_column: np.ndarray  # (N, rows) argmax of every row
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, precision: str = 'float64') -> 'JointBeliefMatrix':
+        ''' Stores float64 beliefs in the given precision. '''
+        belief_precision = get_precision(precision)
+        raw_values = belief_precision.to_raw(values)
+        row_totals = raw_values.sum(axis=-1, dtype=np.float64)
+        return cls(
+            values=raw_values,
+            scale=np.full(values.shape[0], belief_precision.unit),
+            total=row_totals.sum(axis=-1) * belief_precision.unit,
+            row_totals=row_totals,
+            best_row=np.argmax(row_totals, axis=-1),
+            best_column=np.argmax(raw_values, axis=-1),
+        )
+
+    @classmethod
+    def from_state(cls, name: str, state: Dict[str, np.ndarray]) -> 'JointBeliefMatrix':
+        ''' Rebuilds the matrix stored under name by get_state. '''
+        return cls(**{field: state[f"{name}_{field}"] for field in cls.__dataclass_fields__})
+
+    def get_state(self, name: str) -> Dict[str, np.ndarray]:
+        ''' Returns the arrays of the matrix, named after it. '''
+        return {f"{name}_{field}": getattr(self, field) for field in self.__dataclass_fields__}
+
+    def reinforce(self, agents: np.ndarray, rows: np.ndarray, columns: np.ndarray, learning_speed: float) -> None:
+        '''
+        Rescales the tables of the given (distinct)
+        agents to sum to (1 - learning_speed) and then
+        adds learning_speed to one cell of each.
+        '''
+        precision = precision_of(self.values)
+        factor = (1.0 - learning_speed) / self.total[agents]
+        scale = self.scale[agents] * factor
+        self.scale[agents] = scale
+        self.total[agents] = self.total[agents] * factor
+
+        out_of_range = agents[(scale < precision.min_scale) | (scale > precision.max_scale)]
+        if out_of_range.shape[0] > 0:
+            scaled = self.values[out_of_range] * self.scale[out_of_range][:, np.newaxis, np.newaxis]
+            raw_values = precision.to_raw(scaled)
+            self.values[out_of_range] = raw_values
+            self.row_totals[out_of_range] = raw_values.sum(axis=-1, dtype=np.float64)
+            self.total[out_of_range] = self.row_totals[out_of_range].sum(axis=-1) * precision.unit
+            self.scale[out_of_range] = precision.unit
+            scale = self.scale[agents]
+        self.total[agents] += learning_speed
+
+        increment = learning_speed / scale
+        reinforced = precision.quantize(self.values[agents, rows, columns] + increment)
+        self.values[agents, rows, columns] = reinforced
+        reinforced_total = self.row_totals[agents, rows] + increment
+        self.row_totals[agents, rows] = reinforced_total
+
+        # Only the reinforced cell and row sum grow relative to the others
+        best_column = self.best_column[agents, rows]
+        highest = self.values[agents, rows, best_column]
+        new_best = (reinforced > highest) | ((reinforced == highest) & (columns < best_column))
+        self.best_column[agents, rows] = np.where(new_best, columns, best_column)
+
+        best_row = self.best_row[agents]
+        highest_total = self.row_totals[agents, best_row]
+        new_best = (reinforced_total > highest_total) | ((reinforced_total == highest_total) & (rows < best_row))
+        self.best_row[agents] = np.where(new_best, rows, best_row)
@@ -0,0 +1,195 @@
+from typing import List, Optional
+
+from utilities import NUM_OF_CHOICES, generate_beliefs, check_epsilon, count_nested_model_calls, make_random_choice
+from agents.agent import TheoryOfMindAgent, EPS, LEARNING_SPEED
+from agents.beliefs import BeliefVector
+
+def reinforce_prediction(
+        order_beliefs: BeliefVector,
+        predictions: List[int],
+        action: int,
+        learning_speed: float = LEARNING_SPEED,
+        number_of_choices: int = NUM_OF_CHOICES
+    ) -> None:
+    '''
+    Reinforces the belief in the lowest order
+    model whose decision the action was one above,
+    if any, like SecondOrderTheoryOfMindAgent.update.
+    '''
+    for order, prediction in enumerate(predictions):
+        if action == (prediction + 1) % number_of_choices:
+            order_beliefs.reinforce(order, learning_speed)
+            return
+
+class ModelChain:
+    '''
+    The nested models of orders 0 to
+    number_of_models - 1 of an order-k agent.
+
+    Models share their lower orders: the order-j
+    model predicts with the chain's own models of
+    orders below j, so the chain holds one set of
+    zero-order beliefs plus the order beliefs of each
+    model from order 2 on. Every model's decision is
+    computed at most once per round and reused, so a
+    round costs O(k) instead of compounding nested calls.
+
+    A chain may be shared by several agents. It then
+    models all of them: it learns from every sharer's
+    action, once all of them have reported theirs for
+    the round.
+
+    Its models explore with probability `eps` and
+    learn at `learning_speed`, the module defaults
+    unless set (e.g. by a simulation backend). The
+    number of choices is that of the beliefs.
+    Beliefs left out are drawn for the chain, and
+    order_beliefs, if given, holds those of every
+    model from order 2 on.
+    '''
+    __slots__ = ('beliefs', 'order_beliefs', 'sharers', 'decisions', 'observed_actions', 'eps', 'learning_speed')
+
+    def __init__(
+        self,
+        number_of_models: int,
+        beliefs: Optional[List[float]] = None,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED,
+        order_beliefs: Optional[List[List[float]]] = None
+    ) -> None:
+        self.beliefs = BeliefVector(beliefs if beliefs is not None else generate_beliefs())
+        self.eps = eps
+        self.learning_speed = learning_speed
+        if order_beliefs is None:
+            order_beliefs = [generate_beliefs(order) for order in range(2, number_of_models)]
+        self.order_beliefs: List[Optional[BeliefVector]] = [None] * min(number_of_models, 2) + [
+            BeliefVector(model_beliefs) for model_beliefs in order_beliefs
+        ]
+        if len(self.order_beliefs) != number_of_models:
+            raise ValueError(f"A chain of {number_of_models} models needs {max(number_of_models - 2, 0)} order beliefs.")
+        self.sharers: int = 0
+
+        # Decisions of every model this round and the actions observed so far
+        self.decisions: List[Optional[int]] = [None] * number_of_models
+        self.observed_actions: List[int] = []
+
+    @property
+    def number_of_models(self) -> int:
+        return len(self.decisions)
+
+    @property
+    def number_of_choices(self) -> int:
+        return len(self.beliefs)
+
+    def decision(self, order: int) -> int:
+        ''' Returns the decision of the order-`order` model this round. '''
+        decision = self.decisions[order]
+        if decision is not None:
+            return decision
+
+        count_nested_model_calls()
+        number_of_choices = self.number_of_choices
+        if order == 0:
+            # Make random choice through epsilon probability
+            if check_epsilon(self.eps):
+                decision = make_random_choice(number_of_choices)
+            else:
+                decision = (self.beliefs.argmax + 1) % number_of_choices
+        elif order == 1:
+            decision = (self.decision(0) + 1) % number_of_choices
+        else:
+            # Follow the lower order model believed to predict best, with epsilon exploration
+            if check_epsilon(self.eps):
+                modelled_order = make_random_choice(order)
+            else:
+                modelled_order = self.order_beliefs[order].argmax
+            decision = (self.decision(modelled_order) + 1) % number_of_choices
+
+        self.decisions[order] = decision
+        return decision
+
+    def predictions(self, number_of_models: int) -> List[int]:
+        ''' Returns the decisions of the models of orders below number_of_models. '''
+        return [self.decision(order) for order in range(number_of_models)]
+
+    def observe(self, action: int) -> None:
+        '''
+        Records a sharer's action. Once every sharer
+        has reported, the models learn from the actions
+        and their decisions are cleared for the next round.
+        '''
+        self.observed_actions.append(action)
+        if len(self.observed_actions) < self.sharers:
+            return
+
+        # Every model's decision before any of them learns
+        predictions = self.predictions(self.number_of_models)
+
+        for observed_action in self.observed_actions:
+            for order in range(2, self.number_of_models):
+                reinforce_prediction(
+                    self.order_beliefs[order], predictions[:order], observed_action,
+                    self.learning_speed, self.number_of_choices
+                )
+            self.beliefs.reinforce(observed_action, self.learning_speed)
+
+        self.observed_actions = []
+        self.decisions = [None] * self.number_of_models
+
+class KthOrderTheoryOfMindAgent(TheoryOfMindAgent):
+    '''
+    Theory of Mind agent of any order k >= 1. It
+    plays one above the decision of the lower order
+    model (0 to k - 1) it believes predicts the
+    population best, like the first and second-order
+    agents, with its models kept in a ModelChain.
+
+    Args:
+        order: int == ToM order of the agent
+        model_chain: Optional[ModelChain] == Models of orders 0 to order - 1,
+            pass the same chain to several agents to share it
+        order_beliefs: Optional[List[float]] == Beliefs in each model (order >= 2)
+    '''
+    __slots__ = ('order', 'model_chain', 'order_beliefs')
+
+    def __init__(
+        self,
+        order: int,
+        model_chain: Optional[ModelChain] = None,
+        order_beliefs: Optional[List[float]] = None
+    ) -> None:
+        if order < 1:
+            raise ValueError(f"Order-{order} agents have no models, use ZeroOrderTheoryOfMindAgent.")
+
+        self.order = order
+        self.eps = EPS
+        self.learning_speed = LEARNING_SPEED
+        self.model_chain = model_chain if model_chain is not None else ModelChain(order)
+        if self.model_chain.number_of_models != order:
+            raise ValueError(f"An order-{order} agent needs {order} models, not {self.model_chain.number_of_models}.")
+        self.model_chain.sharers += 1
+
+        self.order_beliefs: Optional[BeliefVector] = None
+        if order >= 2:
+            self.order_beliefs = BeliefVector(order_beliefs if order_beliefs is not None else generate_beliefs(order))
+
+    def decide(self):
+        if self.order == 1:
+            modelled_order: int = 0
+        elif check_epsilon(self.eps): # Epsilon for stochasticity
+            modelled_order = make_random_choice(self.order)
+        else:
+            modelled_order = self.order_beliefs.argmax
+
+        return (self.model_chain.decision(modelled_order) + 1) % self.model_chain.number_of_choices
+
+    def update(self, action: int):
+        # Update the beliefs in each model, with the models' decisions before they learn
+        if self.order_beliefs is not None:
+            reinforce_prediction(
+                self.order_beliefs, self.model_chain.predictions(self.order), action,
+                self.learning_speed, self.model_chain.number_of_choices
+            )
+
+        # Let the models learn from the action
+        self.model_chain.observe(action)
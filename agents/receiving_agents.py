@@ -1,43 +1,54 @@
-from agents.agent import ReceivingAgent, EPS, LEARNING_SPEED
-from utilities import generate_beliefs, generate_2d_beliefs, check_epsilon, make_random_choice
+from agents.agent import ReceivingAgent
+from agents.beliefs import BeliefVector
+from utilities import NUM_OF_CHOICES, generate_beliefs, check_epsilon, make_random_choice
 
 class ZeroOrderReceivingAgent(ReceivingAgent):
+    '''
+    Receiver of the signaling mod game. Its
+    connected beliefs hold, for every signal, its
+    beliefs of the action the signaler then plays,
+    and its intentions those beliefs over all signals.
+    '''
+    __slots__ = ('heard_signal',)
+
     def __init__(
         self, 
-        beliefs=generate_beliefs(), 
-        intentions=generate_beliefs(), 
-        connected_beliefs= generate_2d_beliefs()
+        beliefs=None, 
+        intentions=None, 
+        connected_beliefs=None
         ) -> None:
+        # Intentions track their own argmax, so predicting needs no scan
+        intentions = BeliefVector(intentions if intentions is not None else generate_beliefs())
         super().__init__(beliefs, intentions, connected_beliefs)
+        self.heard_signal = 0
 
     def decide(self):
         pass
 
-    def process_signal(self):
-        highest_intention: int = 0
-        highest_index: int = 0
+    def process_signal(self, signal: int):
+        self.heard_signal = signal
 
-        for i, intention in enumerate(self.intentions):
-            if intention > highest_intention:
-                highest_intention = intention
-                highest_index = i
-        
         # Make random choice through epsilon probability
-        if check_epsilon(EPS):
+        if check_epsilon(self.eps):
             return make_random_choice()
 
-        return highest_index
-
-    def update(self, action: int):
-        # Update beliefs
-
-        # Update intentions
-        acc: float = sum(self.intentions)
-        acc = (1.0 - LEARNING_SPEED) / acc
-
-        for intention in self.intentions:
-            intention = intention * acc
+        highest_belief: float = self.connected_beliefs[signal][0]
+        highest_index: int = 0
 
-        self.intentions[action] = self.intentions[action] + LEARNING_SPEED
+        for i, belief in enumerate(self.connected_beliefs[signal]):
+            if belief > highest_belief:
+                highest_belief = belief
+                highest_index = i
 
+        # Play one above the predicted action of the signaler
+        return (highest_index + 1) % NUM_OF_CHOICES
 
+    def update(self, action: int):
+        # Update the beliefs of the signaler's action after the heard signal
+        signal_beliefs = self.connected_beliefs[self.heard_signal]
+        acc: float = (1.0 - self.learning_speed) / sum(signal_beliefs)
+        self.connected_beliefs[self.heard_signal] = [belief * acc for belief in signal_beliefs]
+        self.connected_beliefs[self.heard_signal][action] += self.learning_speed
+
+        # Update intentions: rescale to sum to (1 - learning_speed) and reinforce the action, lazily
+        self.intentions.reinforce(action, self.learning_speed)
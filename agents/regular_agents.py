@@ -1,93 +1,124 @@
-from utilities import generate_beliefs, check_epsilon, make_random_choice
+from typing import List, Optional
+
+from utilities import generate_beliefs, check_epsilon, count_nested_model_calls, make_random_choice
 from agents.agent import TheoryOfMindAgent, EPS, LEARNING_SPEED
+from agents.beliefs import BeliefVector
 
 class ZeroOrderTheoryOfMindAgent(TheoryOfMindAgent):
-    def __init__(self, beliefs = generate_beliefs(), intentions = generate_beliefs()) -> None:
-        super().__init__(beliefs, intentions)
+    __slots__ = ()
+
+    def __init__(self, beliefs = None, intentions = None) -> None:
+        # Beliefs track their own argmax, so deciding needs no scan
+        super().__init__(BeliefVector(beliefs if beliefs is not None else generate_beliefs()), intentions)
+
+    @property
+    def number_of_choices(self) -> int:
+        return len(self.beliefs)
 
     def decide(self):
-        highest_belief: int = 0
-        highest_index: int = 0
-
-        for i, belief in enumerate(self.beliefs):
-            if belief > highest_belief:
-                highest_belief = belief
-                highest_index = i
-        
         # Make random choice through epsilon probability
-        if check_epsilon(EPS):
-            return make_random_choice()
+        if check_epsilon(self.eps):
+            return make_random_choice(self.number_of_choices)
 
-        return (highest_index + 1) % 23
+        return (self.beliefs.argmax + 1) % self.number_of_choices
     
     def update(self, action: int):
-        acc: float = sum(self.beliefs)
-        acc = (1.0 - LEARNING_SPEED) / acc
+        # Rescale the beliefs to sum to (1 - learning_speed) and reinforce the action, lazily
+        self.beliefs.reinforce(action, self.learning_speed)
 
-        for belief in self.beliefs:
-            belief = belief * acc
 
-        self.beliefs[action] = self.beliefs[action] + LEARNING_SPEED
+class FirstOrderTheoryOfMindAgent(TheoryOfMindAgent):
+    __slots__ = ('zero_order_agent',)
 
+    def __init__(self, lower_order_agent: Optional[TheoryOfMindAgent] = None) -> None:
+        self.zero_order_agent = lower_order_agent if lower_order_agent is not None else ZeroOrderTheoryOfMindAgent()
+        self.eps = EPS
+        self.learning_speed = LEARNING_SPEED
 
-class FirstOrderTheoryOfMindAgent(TheoryOfMindAgent):
-    def __init__(self, lower_order_agent: TheoryOfMindAgent = ZeroOrderTheoryOfMindAgent()) -> None:
-        self.zero_order_agent = lower_order_agent
+    @property
+    def number_of_choices(self) -> int:
+        return self.zero_order_agent.number_of_choices
 
     def decide(self):
         # Model the decision-making process of the zero-order agent
+        count_nested_model_calls()
         zero_order_decision = self.zero_order_agent.decide()
 
         # Make a decision based on the zero-order decision
-        return (zero_order_decision + 1) % 23
+        return (zero_order_decision + 1) % self.number_of_choices
     
     def update(self, action: int):
         # Update the beliefs of the zero-order agent
         self.zero_order_agent.update(action)
 
 class SecondOrderTheoryOfMindAgent(TheoryOfMindAgent):
+    __slots__ = (
+        'order_beliefs', 'zero_order_agent', 'first_order_agent', 'zero_order_decision', 'first_order_decision'
+    )
+
     def __init__(
         self, 
-        zero_order_agent: ZeroOrderTheoryOfMindAgent = ZeroOrderTheoryOfMindAgent(),
-        first_order_agent: FirstOrderTheoryOfMindAgent = FirstOrderTheoryOfMindAgent()
+        zero_order_agent: Optional[ZeroOrderTheoryOfMindAgent] = None,
+        first_order_agent: Optional[FirstOrderTheoryOfMindAgent] = None,
+        order_beliefs: Optional[List[float]] = None
         ) -> None:
-        self.order_beliefs = generate_beliefs(2)
-        self.zero_order_agent = zero_order_agent
-        self.first_order_agent = first_order_agent
+        self.zero_order_agent = zero_order_agent if zero_order_agent is not None else ZeroOrderTheoryOfMindAgent()
+        self.first_order_agent = first_order_agent if first_order_agent is not None else FirstOrderTheoryOfMindAgent()
+        self.order_beliefs = BeliefVector(order_beliefs if order_beliefs is not None else generate_beliefs(2))
+        self.eps = EPS
+        self.learning_speed = LEARNING_SPEED
+
+        # Decisions of the nested models, cached until they learn
+        self.zero_order_decision: Optional[int] = None
+        self.first_order_decision: Optional[int] = None
+
+    @property
+    def number_of_choices(self) -> int:
+        return self.zero_order_agent.number_of_choices
+
+    def model_decision(self, order: int) -> int:
+        '''
+        Returns the decision of the zero (0) or
+        first-order (1) model, computing it at
+        most once per round.
+        '''
+        if order == 0:
+            if self.zero_order_decision is None:
+                count_nested_model_calls()
+                self.zero_order_decision = self.zero_order_agent.decide()
+            return self.zero_order_decision
+
+        if self.first_order_decision is None:
+            count_nested_model_calls()
+            self.first_order_decision = self.first_order_agent.decide()
+        return self.first_order_decision
 
     def decide(self):
-        if check_epsilon(EPS): # Epsilon for stochasticity 
+        if check_epsilon(self.eps): # Epsilon for stochasticity 
             order: int = make_random_choice(2)
-            if order == 0:
-                return (self.zero_order_agent.decide() + 1) % 23  
-            else:
-                return (self.first_order_agent.decide() + 1) % 23
         else:
-            if self.order_beliefs[0] > self.order_beliefs[1]: # More zero order agents
-                return (self.zero_order_agent.decide() + 1) % 23
-            else: # More first order agents
-                return (self.first_order_agent.decide() + 1) % 23
+            # More zero order agents (0) or more first order agents (1)
+            order: int = 0 if self.order_beliefs[0] > self.order_beliefs[1] else 1
+
+        return (self.model_decision(order) + 1) % self.number_of_choices
 
     def update(self, action: int):
         # Get each lower level agent's decision and the respective higher order decision
-        zero_order_decision: int = self.zero_order_agent.decide()
-        first_order_decision: int = self.first_order_agent.decide()
-        zero_order_higher_decision: int = (zero_order_decision + 1) % 23
-        first_order_higher_decision: int = (first_order_decision + 1) % 23
+        zero_order_decision: int = self.model_decision(0)
+        first_order_decision: int = self.model_decision(1)
+        number_of_choices = self.number_of_choices
+        zero_order_higher_decision: int = (zero_order_decision + 1) % number_of_choices
+        first_order_higher_decision: int = (first_order_decision + 1) % number_of_choices
 
         # Update the beliefs of the zero and first-order agents
         self.zero_order_agent.update(action)
         self.first_order_agent.update(action)
+        self.zero_order_decision = None
+        self.first_order_decision = None
 
         # Update order beliefs
         if action == zero_order_higher_decision or action == first_order_higher_decision:
-            acc: float = sum(self.order_beliefs)
-            acc = (1.0 - LEARNING_SPEED) / acc
-
-            for belief in self.order_beliefs:
-                belief = belief * acc
-
             if action == zero_order_higher_decision:
-                self.order_beliefs[0] = self.order_beliefs[0] + LEARNING_SPEED
+                self.order_beliefs.reinforce(0, self.learning_speed)
             else:
-                self.order_beliefs[1] = self.order_beliefs[1] + LEARNING_SPEED
\ No newline at end of file
+                self.order_beliefs.reinforce(1, self.learning_speed)
\ No newline at end of file
@@ -1,30 +1,43 @@
-from agents.agent import SignalingAgent, EPS, LEARNING_SPEED
-from agents.regular_agents import ZeroOrderTheoryOfMindAgent
-from utilities import generate_beliefs, generate_2d_beliefs, check_epsilon, make_random_choice
+from agents.agent import SignalingAgent
+from utilities import NUM_OF_CHOICES, check_epsilon, make_random_choice
 
 class ZeroOrderSignalingAgent(SignalingAgent):
-    def __init__(self, beliefs=generate_2d_beliefs(), intentions=generate_beliefs()) -> None:
+    '''
+    Signaler of the signaling mod game. Its beliefs
+    are a joint table over (signal, action): it sends
+    the signal with the highest row sum and then plays
+    the most believed action for that signal.
+    '''
+    __slots__ = ('chosen_action',)
+
+    def __init__(self, beliefs=None, intentions=None) -> None:
         super().__init__(beliefs, intentions)
+        self.chosen_action = 0
 
     def signal(self):
-        highest_signal: int = 0
+        # Make random choice through epsilon probability
+        if check_epsilon(self.eps):
+            self.chosen_signal = make_random_choice()
+            return self.chosen_signal
+
+        highest_signal: float = sum(self.beliefs[0])
         highest_index: int = 0
 
         for i, signals in enumerate(self.beliefs):
             if sum(signals) > highest_signal:
-                highest_signal = signals
+                highest_signal = sum(signals)
                 highest_index = i
-        
-        # Make random choice through epsilon probability
-        if check_epsilon(EPS):
-            choice: int = make_random_choice()
-            self.chosen_signal = choice
-            return choice
 
+        self.chosen_signal = highest_index
         return highest_index
 
     def decide(self, **kwargs) -> int:
-        highest_decision: int = 0
+        # Make random choice through epsilon probability
+        if check_epsilon(self.eps):
+            self.chosen_action = make_random_choice()
+            return self.chosen_action
+
+        highest_decision: float = self.beliefs[self.chosen_signal][0]
         highest_index: int = 0
 
         for i, action in enumerate(self.beliefs[self.chosen_signal]):
@@ -32,27 +45,15 @@ class ZeroOrderSignalingAgent(SignalingAgent):
                 highest_decision = action
                 highest_index = i
 
-        # Make random choice through epsilon probability
-        if check_epsilon(EPS):
-            choice: int = make_random_choice()
-            self.chosen_signal = choice
-            return choice
-
+        self.chosen_action = highest_index
         return highest_index
 
     def update(self, action: int):
-        # Update beliefs
-        chosen_action: int = self.decide()
-
-        if chosen_action == (action + 1) % 23:
-            # Update beliefs
-            for sig_index, signal in enumerate(self.beliefs):
-                acc: float = sum(signal)
-                acc = (1.0 - LEARNING_SPEED) / acc
-
-                for decision in signal:
-                    decision = decision * acc
-
-                    self.beliefs[sig_index][chosen_action] = self.beliefs[sig_index][chosen_action] + LEARNING_SPEED
-
-
+        # Reinforce the signal and action played if they beat the receiver's action
+        if self.chosen_action == (action + 1) % NUM_OF_CHOICES:
+            # Rescale the whole table to sum to (1 - learning_speed), once per cell
+            acc: float = sum(sum(signal) for signal in self.beliefs)
+            acc = (1.0 - self.learning_speed) / acc
+            self.beliefs = [[decision * acc for decision in signal] for signal in self.beliefs]
+
+            self.beliefs[self.chosen_signal][self.chosen_action] += self.learning_speed
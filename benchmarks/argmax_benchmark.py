@@ -0,0 +1,94 @@
+'''
+Benchmarks incremental argmax maintenance against
+the linear scans it replaces, for single belief
+vectors and for the vectorized population engine.
+
+Run from the repository root with:
+    python -m benchmarks.argmax_benchmark
+'''
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from agents.agent import LEARNING_SPEED
+from agents.beliefs import BeliefVector, flat_indices
+from utilities import NUM_OF_CHOICES, generate_beliefs
+
+def scan_argmax(beliefs: List[float]) -> int:
+    ''' The linear scan the agents' decide methods used to run. '''
+    highest_belief: int = 0
+    highest_index: int = 0
+
+    for i, belief in enumerate(beliefs):
+        if belief > highest_belief:
+            highest_belief = belief
+            highest_index = i
+
+    return highest_index
+
+def time_it(function: Callable[[], None], repeats: int) -> float:
+    ''' Returns the seconds per call of function. '''
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+def benchmark_belief_vector(number_of_choices: int, rounds: int = 20000) -> None:
+    '''
+    One decide and one update per round, as a
+    second-order agent's nested model does it.
+    '''
+    actions = np.random.randint(number_of_choices, size=rounds).tolist()
+    initial_beliefs = generate_beliefs(number_of_choices)
+
+    beliefs = list(initial_beliefs)
+    def scan_round():
+        for action in actions:
+            scan_argmax(beliefs)
+            beliefs[action] = beliefs[action] + LEARNING_SPEED
+
+    belief_vector = BeliefVector(initial_beliefs)
+    def incremental_round():
+        for action in actions:
+            belief_vector.argmax
+            belief_vector[action] = belief_vector[action] + LEARNING_SPEED
+
+    scan_time = time_it(scan_round, 1) / rounds
+    incremental_time = time_it(incremental_round, 1) / rounds
+    print(
+        f"BeliefVector, {number_of_choices} choices: scan {scan_time * 1e6:.2f} us, "
+        f"incremental {incremental_time * 1e6:.2f} us, speedup {scan_time / incremental_time:.1f}x"
+    )
+
+def benchmark_population(number_of_agents: int, number_of_choices: int, repeats: int = 20) -> None:
+    ''' Whole-population argmax per round, rescanned vs maintained. '''
+    beliefs = np.random.rand(number_of_agents, number_of_choices)
+    best = np.argmax(beliefs, axis=-1)
+    actions = np.random.randint(number_of_choices, size=number_of_agents)
+    flat_beliefs = beliefs.reshape(-1)
+
+    def scan_round():
+        np.argmax(beliefs, axis=-1)
+
+    def incremental_round():
+        reinforced = flat_beliefs[flat_indices(beliefs, actions)]
+        highest = flat_beliefs[flat_indices(beliefs, best)]
+        np.copyto(best, actions, where=reinforced > highest)
+
+    scan_time = time_it(scan_round, repeats)
+    incremental_time = time_it(incremental_round, repeats)
+    print(
+        f"Population of {number_of_agents}, {number_of_choices} choices: scan {scan_time * 1e3:.2f} ms, "
+        f"incremental {incremental_time * 1e3:.2f} ms, speedup {scan_time / incremental_time:.1f}x"
+    )
+
+def main():
+    np.random.seed(0)
+    for number_of_choices in (NUM_OF_CHOICES, 230, 2300):
+        benchmark_belief_vector(number_of_choices)
+    for number_of_choices in (NUM_OF_CHOICES, 230):
+        benchmark_population(100000, number_of_choices)
+
+if __name__ == '__main__':
+    main()
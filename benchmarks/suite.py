@@ -0,0 +1,360 @@
+'''
+Benchmark suite of the simulation engines, the
+agents' decide/update for every ToM order and
+main.aggregate_results, swept over population size,
+number of choices and epoch count.
+
+Each case reports rounds/sec, agent-updates/sec and
+peak traced memory. Results are written to a JSON
+file and, given a baseline file from an earlier run,
+compared against it: a case whose rounds/sec dropped
+by more than the threshold is a regression, and the
+suite exits with status 1.
+
+Run from the repository root with:
+    python -m benchmarks.suite --preset quick --output results.json
+    python -m benchmarks.suite --baseline baseline.json --output results.json
+    python -m benchmarks.suite --baseline baseline.json --update-baseline
+'''
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from main import aggregate_results
+from simulations.regular_simulation import RegularSimulation, create_agents
+from simulations.interaction_graph import InteractionGraph
+from simulations.signaling_simulation import SignalingSimulation
+from simulations.vectorized_simulation import VectorizedRegularSimulation, BatchedRegularSimulation
+from utilities import AgentsConfiguration, RandomStream, RegularSimulationResults, NUM_OF_CHOICES, using_random_stream
+
+PRESETS: Dict[str, Dict[str, Any]] = {
+    'quick': {'sizes': [10, 1000], 'choices': [NUM_OF_CHOICES], 'epochs': [10]},
+    'default': {'sizes': [10, 1000, 100000], 'choices': [NUM_OF_CHOICES, 230], 'epochs': [10, 100]},
+    'full': {'sizes': [10, 1000, 100000, 1000000], 'choices': [NUM_OF_CHOICES, 230], 'epochs': [10, 100, 1000]},
+}
+
+# Largest population run with the per-agent Python objects
+OBJECT_SIZE_LIMIT = 10000
+# Largest signaling beliefs run, in bytes: 2 x C x C floats per pair
+SIGNALING_MEMORY_LIMIT = 2 ** 31
+NUMBER_OF_REPLICATES = 10
+# Degree of the random regular interaction graph of the graph cases
+GRAPH_DEGREE = 8
+DEFAULT_THRESHOLD = 0.2
+
+@dataclass
+class BenchmarkCase:
+    '''
+    One benchmarked configuration. setup builds
+    the state and returns the timed function, which
+    advances `rounds` rounds of `agents` agent updates.
+    '''
+    name: str
+    parameters: Dict[str, Any]
+    setup: Callable[[], Callable[[], None]]
+    rounds: int
+    agents: int
+
+    @property
+    def key(self) -> str:
+        ''' Identifies the case across runs. '''
+        return self.name + ''.join(f" {name}={value}" for name, value in sorted(self.parameters.items()))
+
+@dataclass
+class BenchmarkResult:
+    '''
+    Utility dataclass to store the
+    measurements of one BenchmarkCase.
+    '''
+    key: str
+    name: str
+    parameters: Dict[str, Any]
+    calls: int
+    seconds: float
+    rounds_per_second: float
+    agent_updates_per_second: float
+    peak_memory_bytes: int
+    error: Optional[str] = None
+
+def split_population(size: int) -> AgentsConfiguration:
+    ''' Splits a population evenly over the three ToM levels. '''
+    return AgentsConfiguration(size - 2 * (size // 3), size // 3, size // 3)
+
+def simulation_case(name: str, create: Callable[[], Any], size: int, epochs: int, **parameters) -> BenchmarkCase:
+    ''' Times Simulation.run over `epochs` rounds. '''
+    def setup():
+        simulation = create()
+        return lambda: simulation.run(epochs)
+
+    return BenchmarkCase(name, {'agents': size, 'epochs': epochs, **parameters}, setup, epochs, size)
+
+def graph_simulation(agent_config: AgentsConfiguration, size: int, number_of_choices: int) -> VectorizedRegularSimulation:
+    ''' A vectorized simulation scored on a random regular interaction graph. '''
+    with using_random_stream(RandomStream(0)):
+        interaction_graph = InteractionGraph.random_regular(size, min(GRAPH_DEGREE, size - 1 - (size - 1) % 2))
+    return VectorizedRegularSimulation(
+        agent_config, number_of_choices=number_of_choices, seed=0, interaction_graph=interaction_graph
+    )
+
+def agent_case(order: int, size: int) -> BenchmarkCase:
+    ''' Times one decide and one update of `size` agents of one ToM order. '''
+    def setup():
+        random_stream = RandomStream(0)
+        with using_random_stream(random_stream):
+            agents = create_agents(AgentsConfiguration(*[size if level == order else 0 for level in range(3)]))
+
+        def decide_and_update():
+            with using_random_stream(random_stream):
+                for agent in agents:
+                    agent.update(agent.decide())
+        return decide_and_update
+
+    return BenchmarkCase(f"agent_order_{order}", {'agents': size}, setup, 1, size)
+
+def population_case(size: int) -> BenchmarkCase:
+    ''' Times create_agents for `size` agents split over the ToM levels. '''
+    def setup():
+        random_stream = RandomStream(0)
+        agent_config = split_population(size)
+
+        def create():
+            with using_random_stream(random_stream):
+                create_agents(agent_config)
+        return create
+
+    return BenchmarkCase('create_agents', {'agents': size}, setup, 1, size)
+
+def aggregate_case(number_of_results: int) -> BenchmarkCase:
+    ''' Times main.aggregate_results over a list of replicate results. '''
+    def setup():
+        values = np.random.default_rng(0).random((number_of_results, 6))
+        results = [RegularSimulationResults(*row) for row in values.tolist()]
+        return lambda: aggregate_results(results, 1000)
+
+    return BenchmarkCase('aggregate_results', {'results': number_of_results}, setup, 1, number_of_results)
+
+def signaling_belief_bytes(number_of_pairs: int, number_of_choices: int) -> int:
+    ''' Bytes of the signal and connected beliefs of a signaling population, stored as float64. '''
+    return 2 * number_of_pairs * number_of_choices ** 2 * np.dtype(np.float64).itemsize
+
+def build_cases(
+        sizes: List[int],
+        choices: List[int],
+        epochs: List[int],
+        object_size_limit: int = OBJECT_SIZE_LIMIT,
+        signaling_memory_limit: int = SIGNALING_MEMORY_LIMIT
+    ) -> List[BenchmarkCase]:
+    cases = []
+
+    for size in sizes:
+        agent_config = split_population(size)
+        for number_of_epochs in epochs:
+            if size <= object_size_limit:
+                cases.append(simulation_case(
+                    'regular_simulation', lambda config=agent_config: RegularSimulation(config, seed=0),
+                    size, number_of_epochs
+                ))
+
+            cases.append(simulation_case(
+                'numpy_backend_simulation',
+                lambda config=agent_config: RegularSimulation(config, seed=0, backend='numpy'),
+                size, number_of_epochs
+            ))
+
+            for number_of_choices in choices:
+                if signaling_belief_bytes(size // 2, number_of_choices) <= signaling_memory_limit:
+                    # Signalers and receivers come in pairs, one pair per zero-order agent
+                    case = simulation_case(
+                        'signaling_simulation',
+                        lambda pairs=size // 2, c=number_of_choices: SignalingSimulation(
+                            AgentsConfiguration(pairs, 0, 0), number_of_choices=c, seed=0
+                        ),
+                        size, number_of_epochs, choices=number_of_choices
+                    )
+                    case.agents = 2 * (size // 2)
+                    cases.append(case)
+
+                cases.append(simulation_case(
+                    'vectorized_simulation',
+                    lambda config=agent_config, c=number_of_choices: VectorizedRegularSimulation(
+                        config, number_of_choices=c, seed=0
+                    ),
+                    size, number_of_epochs, choices=number_of_choices
+                ))
+
+                cases.append(simulation_case(
+                    'graph_simulation',
+                    lambda config=agent_config, s=size, c=number_of_choices: graph_simulation(config, s, c),
+                    size, number_of_epochs, choices=number_of_choices, degree=GRAPH_DEGREE
+                ))
+
+                if size * NUMBER_OF_REPLICATES <= max(sizes):
+                    case = simulation_case(
+                        'batched_simulation',
+                        lambda config=agent_config, c=number_of_choices: BatchedRegularSimulation(
+                            config, NUMBER_OF_REPLICATES, number_of_choices=c, seed=0
+                        ),
+                        size, number_of_epochs, choices=number_of_choices, replicates=NUMBER_OF_REPLICATES
+                    )
+                    case.agents *= NUMBER_OF_REPLICATES
+                    cases.append(case)
+
+        if size <= object_size_limit:
+            cases.extend(agent_case(order, size) for order in range(3))
+            cases.append(population_case(size))
+
+    cases.extend(aggregate_case(number_of_results) for number_of_results in (10, 1000))
+    return cases
+
+def run_case(case: BenchmarkCase, min_time: float) -> BenchmarkResult:
+    '''
+    Calls the timed function until min_time has
+    passed (at least once, after one warm-up call)
+    and rates it by the median call, which is less
+    sensitive to noise than the mean. Peak memory
+    is then measured on a fresh setup.
+    Tracing slows allocation down, so it is kept
+    out of the timed calls.
+    '''
+    try:
+        function = case.setup()
+        function()
+
+        call_times = []
+        while sum(call_times) < min_time or not call_times:
+            start = time.perf_counter()
+            function()
+            call_times.append(time.perf_counter() - start)
+        del function
+
+        tracemalloc.start()
+        try:
+            case.setup()()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    except Exception as error:
+        return BenchmarkResult(case.key, case.name, case.parameters, 0, 0.0, 0.0, 0.0, 0, repr(error))
+
+    rounds_per_second = case.rounds / float(np.median(call_times))
+    return BenchmarkResult(
+        key=case.key,
+        name=case.name,
+        parameters=case.parameters,
+        calls=len(call_times),
+        seconds=sum(call_times),
+        rounds_per_second=rounds_per_second,
+        agent_updates_per_second=rounds_per_second * case.agents,
+        peak_memory_bytes=peak_memory,
+    )
+
+def compare(results: List[BenchmarkResult], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    '''
+    Returns the keys of the cases whose rounds/sec
+    fell more than threshold (a fraction) below the
+    baseline. Cases missing from the baseline are
+    not compared.
+    '''
+    baseline_rates = {
+        result['key']: result['rounds_per_second']
+        for result in baseline['results'] if result['error'] is None
+    }
+
+    regressions = []
+    for result in results:
+        baseline_rate = baseline_rates.get(result.key)
+        if result.error is not None or baseline_rate is None:
+            continue
+
+        change = result.rounds_per_second / baseline_rate - 1.0
+        print(f"{result.key}: {change:+.1%} vs baseline")
+        if change < -threshold:
+            regressions.append(result.key)
+
+    return regressions
+
+def main(arguments: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='default')
+    parser.add_argument('--sizes', type=int, nargs='+', help="Population sizes, overriding the preset")
+    parser.add_argument('--choices', type=int, nargs='+', help="Numbers of choices, overriding the preset")
+    parser.add_argument('--epochs', type=int, nargs='+', help="Epoch counts, overriding the preset")
+    parser.add_argument('--object-size-limit', type=int, default=OBJECT_SIZE_LIMIT)
+    parser.add_argument('--signaling-memory-limit', type=int, default=SIGNALING_MEMORY_LIMIT,
+                        help="Bytes of beliefs above which signaling cases are skipped")
+    parser.add_argument('--filter', default='', help="Only run cases whose key contains this text")
+    parser.add_argument('--min-time', type=float, default=0.2, help="Seconds each case is timed for")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="Results file of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Fractional rounds/sec drop counted as a regression")
+    parser.add_argument('--update-baseline', action='store_true', help="Also write the results to --baseline")
+    options = parser.parse_args(arguments)
+
+    preset = PRESETS[options.preset]
+    cases = build_cases(
+        options.sizes or preset['sizes'],
+        options.choices or preset['choices'],
+        options.epochs or preset['epochs'],
+        options.object_size_limit,
+        options.signaling_memory_limit,
+    )
+
+    results = []
+    for case in cases:
+        if options.filter not in case.key:
+            continue
+        result = run_case(case, options.min_time)
+        results.append(result)
+
+        if result.error is not None:
+            print(f"{case.key}: failed with {result.error}")
+        else:
+            print(
+                f"{case.key}: {result.rounds_per_second:,.1f} rounds/s, "
+                f"{result.agent_updates_per_second:,.0f} agent updates/s, "
+                f"peak {result.peak_memory_bytes / 2 ** 20:,.1f} MiB"
+            )
+
+    report = {
+        'metadata': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+        },
+        'results': [asdict(result) for result in results],
+    }
+    with open(options.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    if options.baseline is None:
+        return 0
+
+    if options.update_baseline:
+        with open(options.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+        return 0
+
+    with open(options.baseline) as file:
+        baseline = json.load(file)
+
+    regressions = compare(results, baseline, options.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {options.threshold:.0%}:")
+        for key in regressions:
+            print(f"  {key}")
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,40 +1,85 @@
+import argparse
+
+import numpy as np
+
 from simulations.regular_simulation import RegularSimulation
-from utilities import AgentsConfiguration, RegularSimulationResults, get_mean
-from typing import List
+from simulations.convergence import ConvergenceCriterion
+from simulations.replicate_runner import iter_converged_replicates, run_replicates
+from simulations.online_statistics import RunningStatistics
+from utilities import AgentsConfiguration, RegularSimulationResults
+from typing import List, Optional, Tuple
+
+def pool_level(means: List[float], stds: List[float], epochs: int) -> Tuple[float, float]:
+    '''
+    Pools the per replicate mean and std of one
+    ToM level (replicates have equally many agents
+    per level) and normalises them per round.
+    '''
+    pooled = RunningStatistics.from_moments(np.ones(len(means)), means, stds).reduce()
+    return float(pooled.mean) / epochs, float(pooled.std) / epochs
 
 def aggregate_results(
         results: List[RegularSimulationResults],
         epochs: int
     ) -> RegularSimulationResults:
     '''
-    Returns the aggregated mean of a list
+    Returns the aggregated statistics of a list
     of RegularSimulationResults (all statistics
-    provided are per round).
+    provided are per round). Standard deviations
+    are pooled over the replicates, not averaged.
     '''
+    zero_order_mean, zero_order_std = pool_level(
+        [result.zero_order_mean for result in results], [result.zero_order_std for result in results], epochs
+    )
+    first_order_mean, first_order_std = pool_level(
+        [result.first_order_mean for result in results], [result.first_order_std for result in results], epochs
+    )
+    second_order_mean, second_order_std = pool_level(
+        [result.second_order_mean for result in results], [result.second_order_std for result in results], epochs
+    )
+
     return RegularSimulationResults (
-        zero_order_mean=get_mean([result.zero_order_mean for result in results]) / epochs,
-        zero_order_std=get_mean([result.zero_order_std for result in results]) / epochs,
-        first_order_mean=get_mean([result.first_order_mean for result in results]) / epochs,
-        first_order_std=get_mean([result.first_order_std for result in results]) / epochs,
-        second_order_mean=get_mean([result.second_order_mean for result in results]) / epochs,
-        second_order_std=get_mean([result.second_order_std for result in results]) / epochs,
+        zero_order_mean=zero_order_mean,
+        zero_order_std=zero_order_std,
+        first_order_mean=first_order_mean,
+        first_order_std=first_order_std,
+        second_order_mean=second_order_mean,
+        second_order_std=second_order_std,
     )
 
-def main():
+def main(convergence: Optional[ConvergenceCriterion] = None):
+    '''
+    Runs 10 replicates of the experiment over a process
+    pool, for 1000 epochs each or, given a convergence
+    criterion, until their per-level score rates settle,
+    and displays the aggregate results.
+    '''
     # Define population configuration
     agent_config: AgentsConfiguration = AgentsConfiguration(120, 90, 90)
-    results: List[RegularSimulationResults] = []
+    number_of_replicates: int = 10
     epochs: int = 1000
 
-    # Run it 10 times to aggregate results
-    for _ in range(10):
-        regular_simulation = RegularSimulation(agent_config=agent_config)
-        regular_simulation.run(number_of_epochs=epochs)
-        results.append(regular_simulation.get_results())
+    if convergence is None:
+        # Run it 10 times over a process pool to aggregate results
+        results = run_replicates(agent_config, number_of_replicates, epochs, master_seed=0)
+        RegularSimulation.display_results(results=aggregate_results(results, epochs))
+        return
+
+    # Replicates stop at different epochs, so results come back per round
+    results: List[Optional[RegularSimulationResults]] = [None] * number_of_replicates
+    for finished, (index, result, report) in enumerate(
+        iter_converged_replicates(agent_config, number_of_replicates, convergence, master_seed=0), start=1
+    ):
+        results[index] = result
+        status = f"converged at epoch {report.epoch}" if report.converged else f"stopped at {report.epochs_run} epochs"
+        print(f"Replicate {index} {status} ({finished}/{number_of_replicates})")
 
-    # Display aggregate results
-    regular_simulation.display_results(results=aggregate_results(results, epochs))
+    RegularSimulation.display_results(results=aggregate_results(results, epochs=1))
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Runs the regular mod game experiment and displays its aggregate results.")
+    parser.add_argument('--converge', action='store_true', help="Stop each replicate once its per-level score rates settle")
+    parser.add_argument('--max-epochs', type=int, default=5000, help="Epochs a replicate runs at most with --converge")
+    arguments = parser.parse_args()
+    main(ConvergenceCriterion(max_epochs=arguments.max_epochs) if arguments.converge else None)
@@ -0,0 +1,166 @@
+import os
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from utilities import NUM_OF_CHOICES
+
+# Rounds kept in memory by default when every round is spilled to a file
+SPILLED_WINDOW = 16
+
+class ActionHistory:
+    '''
+    Compact store of every agent's action per round.
+
+    Actions are kept as the smallest unsigned integer
+    type that fits the number of choices (uint8 for
+    the 23-choice mod game), one row per round. The
+    last `window` rounds are kept in memory in a ring
+    buffer and, when a path is given, every round is
+    also appended to a file that can be read back as
+    a memory map. A window of None keeps all rounds in
+    memory, or only the last SPILLED_WINDOW when they
+    are spilled to a file.
+
+    Args:
+        agent_shape: Union[int, Tuple[int, ...]] == Shape of one round of actions
+        window: Optional[int] == Rounds kept in memory, see above for None
+        path: Optional[str] == File the full history is spilled to
+        number_of_choices: int == Number of choices in the mod game
+    '''
+    def __init__(
+        self,
+        agent_shape: Union[int, Tuple[int, ...]],
+        window: Optional[int] = None,
+        path: Optional[str] = None,
+        number_of_choices: int = NUM_OF_CHOICES
+    ) -> None:
+        self.agent_shape: Tuple[int, ...] = (agent_shape,) if isinstance(agent_shape, int) else tuple(agent_shape)
+        self.dtype = np.min_scalar_type(max(number_of_choices - 1, 0))
+        # The file keeps the full history, so memory only needs recent rounds
+        if window is None and path is not None:
+            window = SPILLED_WINDOW
+        self.window = window
+        self.path = path
+        self.number_of_rounds: int = 0
+        # Actions of the last recorded round, whatever the window
+        self.last_round: Optional[np.ndarray] = None
+
+        capacity = 16 if window is None else window
+        self._buffer = np.zeros((capacity,) + self.agent_shape, dtype=self.dtype)
+        # The spill file is opened on the first recorded round, so
+        # a history restored with set_state can append to its file
+        self._file = None
+
+    def record(self, actions) -> None:
+        ''' Stores a round of actions. '''
+        actions = np.asarray(actions, dtype=self.dtype)
+        self.last_round = actions
+
+        if self.window is None:
+            if self.number_of_rounds == self._buffer.shape[0]:
+                self._buffer = np.concatenate([self._buffer, np.zeros_like(self._buffer)])
+            self._buffer[self.number_of_rounds] = actions
+        elif self.window > 0:
+            self._buffer[self.number_of_rounds % self.window] = actions
+
+        if self.path is not None:
+            if self._file is None:
+                self._open_file()
+            self._file.write(actions.tobytes())
+
+        self.number_of_rounds += 1
+
+    def _open_file(self) -> None:
+        if self.number_of_rounds == 0:
+            self._file = open(self.path, 'wb')
+            return
+
+        # Continue a restored history, dropping rounds written after its checkpoint
+        round_size = int(np.prod(self.agent_shape)) * self.dtype.itemsize
+        size = self.number_of_rounds * round_size
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < size:
+            raise ValueError(
+                f"{self.path} does not hold the {self.number_of_rounds} rounds of the restored history."
+            )
+        self._file = open(self.path, 'r+b')
+        self._file.truncate(size)
+        self._file.seek(size)
+
+    def recent(self) -> np.ndarray:
+        '''
+        Returns the rounds held in memory in
+        chronological order, as a (rounds, ...) array.
+        '''
+        if self.window is None:
+            return self._buffer[:self.number_of_rounds]
+
+        if self.number_of_rounds <= self.window:
+            return self._buffer[:self.number_of_rounds]
+
+        start = self.number_of_rounds % self.window
+        return np.concatenate([self._buffer[start:], self._buffer[:start]])
+
+    def full(self) -> np.ndarray:
+        '''
+        Returns every recorded round, memory-mapped
+        from the spill file when there is one.
+        '''
+        if self.path is not None:
+            if self._file is not None:
+                self._file.flush()
+            if self.number_of_rounds == 0:
+                return np.zeros((0,) + self.agent_shape, dtype=self.dtype)
+            return np.memmap(
+                self.path, dtype=self.dtype, mode='r',
+                shape=(self.number_of_rounds,) + self.agent_shape
+            )
+
+        if self.window is not None and self.number_of_rounds > self.window:
+            raise ValueError(
+                f"Only the last {self.window} rounds are kept, pass a path to keep the full history."
+            )
+
+        return self.recent()
+
+    def agent_history(self, index) -> np.ndarray:
+        ''' Returns the actions of one agent over every recorded round. '''
+        return self.full()[(slice(None),) + np.index_exp[index]]
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        '''
+        Returns the rounds held in memory and the round
+        counter, flushing the spill file so it holds
+        every round of the state.
+        '''
+        if self._file is not None:
+            self._file.flush()
+        return {
+            'history_recent': self.recent(),
+            'history_rounds': np.array(self.number_of_rounds),
+        }
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        '''
+        Restores a state returned by get_state. A spill
+        file, if any, must still hold the restored rounds
+        and is appended to from there on.
+        '''
+        self.close()
+        recent = np.asarray(state['history_recent'], dtype=self.dtype)
+        self.number_of_rounds = int(state['history_rounds'])
+
+        if self.window is None:
+            capacity = max(16, recent.shape[0])
+            self._buffer = np.zeros((capacity,) + self.agent_shape, dtype=self.dtype)
+            self._buffer[:recent.shape[0]] = recent
+        elif self.window > 0:
+            self._buffer = np.zeros((self.window,) + self.agent_shape, dtype=self.dtype)
+            first_round = self.number_of_rounds - recent.shape[0]
+            self._buffer[np.arange(first_round, self.number_of_rounds) % self.window] = recent
+
+    def close(self) -> None:
+        ''' Closes the spill file, if any. '''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,344 @@
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from agents.agent import LEARNING_SPEED
+from agents.beliefs import BeliefMatrix
+from utilities import (
+    AgentsConfiguration,
+    SignalingSimulationResults,
+    NUM_OF_CHOICES,
+    get_mean,
+    get_std,
+    score_actions
+)
+from simulations.backends import backend_names
+from simulations.regular_simulation import RegularSimulation
+from simulations.signaling_simulation import SignalingSimulation, create_signaling_agents
+from simulations.precision_validation import result_divergences, result_values
+from simulations.replicate_runner import derive_seeds
+
+# Largest relative difference of a final belief between exactly matching engines
+BELIEF_TOLERANCE = 1e-9
+# Seeds every backend plays when compared within tolerance
+DEFAULT_NUMBER_OF_SEEDS = 20
+# Largest difference of a seed-averaged result from the reference's,
+# in standard errors of that difference
+DEFAULT_TOLERANCE = 4.0
+
+@dataclass
+class BackendReport:
+    '''
+    Utility dataclass to store how a backend
+    played compared to the reference backend
+    from the same starting populations.
+    '''
+    backend: str
+    exact: bool  # Whether choices and scores were required to match every round
+    matches: bool = False
+    first_mismatch_epoch: Optional[int] = None  # First epoch a choice or score differed, over all seeds
+    choice_agreement: float = 1.0  # Fraction of choices identical to the reference
+    max_score_difference: int = 0  # Largest difference of an agent's total score
+    max_divergence: float = 0.0  # Largest relative difference of a (seed-averaged) per-level result
+    divergences: Dict[str, float] = field(default_factory=dict)  # Per result field
+    max_standard_errors: float = 0.0  # Largest of standard_errors
+    standard_errors: Dict[str, float] = field(default_factory=dict)  # Per result field, within tolerance only
+    max_belief_difference: float = 0.0  # Largest relative difference of a final belief, exact only
+
+def copy_state(state: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    ''' Copies state arrays, so two simulations never share them. '''
+    return {name: np.array(array) for name, array in state.items()}
+
+def state_beliefs(state: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    '''
+    The actual beliefs of a population state, with
+    the scale factors applied. The python backend
+    keeps scale factors for its order beliefs,
+    of second-order agents only, the numpy backend
+    none.
+    '''
+    beliefs = {name: BeliefMatrix.from_state(name, state).scaled() for name in ('beliefs', 'nested_beliefs')}
+    order_beliefs = np.array(state['order_beliefs'], dtype=float)
+    if 'order_beliefs_scale' in state:
+        scale = state['order_beliefs_scale']
+        order_beliefs[order_beliefs.shape[0] - scale.shape[0]:] *= scale[:, np.newaxis]
+    beliefs['order_beliefs'] = order_beliefs
+    return beliefs
+
+def belief_difference(belief_pairs: Iterable[Tuple[np.ndarray, np.ndarray]]) -> float:
+    ''' Largest relative difference of a belief from the reference's, over (beliefs, reference) pairs. '''
+    return max(
+        (
+            float(np.max(np.abs(np.asarray(beliefs) - reference) / np.abs(reference), initial=0.0))
+            for beliefs, reference in belief_pairs
+        ),
+        default=0.0
+    )
+
+def welch_statistics(
+        reference_samples: Dict[str, np.ndarray],
+        samples: Dict[str, np.ndarray]
+    ) -> Dict[str, float]:
+    '''
+    Difference of the mean of every result over
+    seeds from the reference's, in standard errors
+    of that difference (Welch's t statistic), 0
+    where both are nan.
+    '''
+    statistics = {}
+    for name, reference_values in reference_samples.items():
+        values = samples[name]
+        # Empty levels have nan results for every backend
+        if np.all(np.isnan(reference_values)) and np.all(np.isnan(values)):
+            statistics[name] = 0.0
+            continue
+
+        difference = abs(values.mean() - reference_values.mean())
+        standard_error = np.sqrt(
+            values.var(ddof=1) / values.shape[0] + reference_values.var(ddof=1) / reference_values.shape[0]
+        )
+        if standard_error > 0:
+            statistics[name] = float(difference / standard_error)
+        else:
+            statistics[name] = 0.0 if difference == 0 else np.inf
+    return statistics
+
+def compare_backends(
+        agent_config: AgentsConfiguration = AgentsConfiguration(20, 20, 20),
+        number_of_epochs: int = 200,
+        seed: int = 0,
+        backends: Optional[Sequence[str]] = None,
+        reference: str = 'python',
+        eps: float = 0.0,
+        learning_speed: float = LEARNING_SPEED,
+        exact: bool = True,
+        number_of_seeds: int = DEFAULT_NUMBER_OF_SEEDS,
+        tolerance: float = DEFAULT_TOLERANCE,
+        **simulation_kwargs
+    ) -> List[BackendReport]:
+    '''
+    Runs the same seeded configuration on every
+    registered backend next to the reference one.
+    Each starts from a copy of the reference
+    population, as backends draw their initial
+    beliefs differently.
+
+    With exact, choices and scores must match every
+    round, results must be equal and the final beliefs
+    equal up to rounding (BELIEF_TOLERANCE). Backends consume
+    random numbers differently, so this only holds
+    without exploration (eps=0). Otherwise single runs
+    cannot be compared, as results (score spreads
+    above all) vary widely from seed to seed even on
+    one backend. Every backend then plays
+    number_of_seeds seeds derived from seed, and the
+    mean of every result over the seeds must lie
+    within `tolerance` standard errors of the
+    reference's. More seeds detect smaller differences.
+
+    Args:
+        agent_config: AgentsConfiguration == The Agent Population Config
+        number_of_epochs: int == Rounds to run
+        seed: int == Seed of the run, or master seed of the runs within tolerance
+        backends: Optional[Sequence[str]] == Backends to check, every registered one if None
+        reference: str == Backend the others are compared to
+        eps: float == Exploration probability of every decision
+        learning_speed: float == Learning speed of every belief update
+        exact: bool == Whether to require identical choices, scores and results
+        number_of_seeds: int == Seeds every backend plays within tolerance
+        tolerance: float == Largest difference of a matching backend's mean results, in standard errors
+        simulation_kwargs: Any == Other arguments of RegularSimulation
+    '''
+    if backends is None:
+        backends = [name for name in backend_names() if name != reference]
+    if not exact and number_of_seeds < 2:
+        raise ValueError("Comparing backends within tolerance needs at least 2 seeds.")
+    seeds = [seed] if exact else derive_seeds(seed, number_of_seeds)
+
+    reports = {backend: BackendReport(backend, exact) for backend in backends}
+    matching_choices = {backend: 0 for backend in backends}
+    reference_samples: List[Dict[str, float]] = []
+    samples: Dict[str, List[Dict[str, float]]] = {backend: [] for backend in backends}
+
+    for run_seed in seeds:
+        def create_simulation(backend: str) -> RegularSimulation:
+            return RegularSimulation(
+                agent_config, history_window=1, seed=run_seed, backend=backend,
+                eps=eps, learning_speed=learning_speed, **simulation_kwargs
+            )
+
+        reference_simulation = create_simulation(reference)
+        simulations = {backend: create_simulation(backend) for backend in backends}
+
+        initial_state = reference_simulation.get_state()
+        for simulation in simulations.values():
+            simulation.set_state(copy_state(initial_state))
+
+        for _ in range(number_of_epochs):
+            reference_simulation.run(1)
+            reference_actions = reference_simulation.agent_actions.recent()[-1]
+
+            for backend, simulation in simulations.items():
+                simulation.run(1)
+                report = reports[backend]
+                matches = np.count_nonzero(simulation.agent_actions.recent()[-1] == reference_actions)
+                matching_choices[backend] += matches
+                mismatch = (
+                    matches < reference_actions.size
+                    or np.any(simulation.agent_scores != reference_simulation.agent_scores)
+                )
+                # Seeds run in turn, so a later seed may mismatch earlier in its run
+                if mismatch and (
+                        report.first_mismatch_epoch is None or reference_simulation.epoch < report.first_mismatch_epoch
+                    ):
+                    report.first_mismatch_epoch = reference_simulation.epoch
+
+        reference_samples.append(result_values(reference_simulation.get_results()))
+        for backend, simulation in simulations.items():
+            report = reports[backend]
+            samples[backend].append(result_values(simulation.get_results()))
+            if exact:
+                beliefs = state_beliefs(simulation.get_state())
+                reference_beliefs = state_beliefs(reference_simulation.get_state())
+                report.max_belief_difference = belief_difference(
+                    (beliefs[name], reference_beliefs[name]) for name in reference_beliefs
+                )
+            report.max_score_difference = max(report.max_score_difference, int(np.max(
+                np.abs(simulation.agent_scores - reference_simulation.agent_scores), initial=0
+            )))
+
+    def stack(run_values: List[Dict[str, float]]) -> Dict[str, np.ndarray]:
+        return {name: np.array([values[name] for values in run_values]) for name in run_values[0]}
+
+    reference_arrays = stack(reference_samples)
+    reference_means = {name: values.mean() for name, values in reference_arrays.items()}
+    number_of_choices = max(len(seeds) * number_of_epochs * reference_simulation.agent_scores.shape[0], 1)
+    for backend, report in reports.items():
+        report.choice_agreement = matching_choices[backend] / number_of_choices
+        arrays = stack(samples[backend])
+        report.divergences = result_divergences(
+            reference_means, {name: values.mean() for name, values in arrays.items()}
+        )
+        report.max_divergence = max(report.divergences.values(), default=0.0)
+        if exact:
+            report.matches = (
+                report.first_mismatch_epoch is None
+                and report.max_divergence == 0.0
+                and report.max_belief_difference <= BELIEF_TOLERANCE
+            )
+        else:
+            report.standard_errors = welch_statistics(reference_arrays, arrays)
+            report.max_standard_errors = max(report.standard_errors.values(), default=0.0)
+            report.matches = report.max_standard_errors <= tolerance
+
+    return list(reports.values())
+
+def compare_signaling_engines(
+        number_of_pairs: int = 20,
+        number_of_epochs: int = 300,
+        seed: int = 0,
+        learning_speed: float = LEARNING_SPEED
+    ) -> BackendReport:
+    '''
+    Plays the per-agent signalers and receivers of
+    signaling_simulation.create_signaling_agents next
+    to a SignalingSimulation, from the same starting
+    beliefs. Without exploration both are
+    deterministic, so choices, scores and results
+    must match every round, and the final beliefs
+    up to rounding (BELIEF_TOLERANCE). Signalers only
+    reinforce what they already play, so their
+    updates show in their beliefs, not their choices.
+
+    Args:
+        number_of_pairs: int == Signalers, each paired with a receiver
+        number_of_epochs: int == Rounds to run
+        seed: int == Seed of the simulation
+        learning_speed: float == Learning speed of every belief update
+    '''
+    simulation = SignalingSimulation(
+        AgentsConfiguration(number_of_pairs, 0, 0), history_window=1, seed=seed,
+        eps=0.0, learning_speed=learning_speed
+    )
+    signaling_agents, receiving_agents = create_signaling_agents(simulation.population)
+    for agent in signaling_agents + receiving_agents:
+        agent.eps = 0.0
+        agent.learning_speed = learning_speed
+
+    report = BackendReport('objects', exact=True)
+    agent_scores = np.zeros(2 * number_of_pairs, dtype=np.int64)
+    reference_scores = np.zeros_like(agent_scores)
+    matching_choices = 0
+
+    for _ in range(number_of_epochs):
+        simulation.run(1)
+
+        signals = [agent.signal() for agent in signaling_agents]
+        receiver_actions = [agent.process_signal(signal) for agent, signal in zip(receiving_agents, signals)]
+        signaler_actions = [agent.decide() for agent in signaling_agents]
+        actions = np.array(signaler_actions + receiver_actions)
+        agent_scores += score_actions(actions, NUM_OF_CHOICES)
+        for signaling_agent, receiving_agent, signaler_action, receiver_action in zip(
+                signaling_agents, receiving_agents, signaler_actions, receiver_actions
+            ):
+            signaling_agent.update(receiver_action)
+            receiving_agent.update(signaler_action)
+
+        reference_scores = np.concatenate([simulation.signaling_agent_scores, simulation.receiving_agent_scores])
+        matches = np.count_nonzero(actions == simulation.agent_actions.recent()[-1])
+        matching_choices += matches
+        if report.first_mismatch_epoch is None and (
+                matches < actions.size or np.any(agent_scores != reference_scores)
+            ):
+            report.first_mismatch_epoch = simulation.epoch
+
+    results = SignalingSimulationResults(
+        signaling_mean=get_mean(agent_scores[:number_of_pairs]),
+        signaling_std=get_std(agent_scores[:number_of_pairs]),
+        receiving_mean=get_mean(agent_scores[number_of_pairs:]),
+        receiving_std=get_std(agent_scores[number_of_pairs:]),
+    )
+    report.choice_agreement = matching_choices / max(number_of_epochs * agent_scores.shape[0], 1)
+    report.max_score_difference = int(np.max(np.abs(agent_scores - reference_scores), initial=0))
+    report.divergences = result_divergences(simulation.get_results(), results)
+    report.max_divergence = max(report.divergences.values(), default=0.0)
+
+    # The engines rescale beliefs at different times, so they only agree up to rounding
+    population = simulation.population
+    signal_beliefs = population.signal_beliefs
+    belief_pairs = [
+        (
+            [agent.beliefs for agent in signaling_agents],
+            signal_beliefs.values * signal_beliefs.scale[:, np.newaxis, np.newaxis],
+        ),
+        (
+            [agent.connected_beliefs for agent in receiving_agents],
+            population.connected_beliefs.scaled().reshape(signal_beliefs.values.shape),
+        ),
+        ([list(agent.intentions) for agent in receiving_agents], population.intentions.scaled()),
+    ]
+    report.max_belief_difference = belief_difference(belief_pairs)
+
+    report.matches = (
+        report.first_mismatch_epoch is None
+        and report.max_divergence == 0.0
+        and report.max_belief_difference <= BELIEF_TOLERANCE
+    )
+    return report
+
+def display_backend_reports(reports: List[BackendReport]) -> None:
+    print("Printing backend equivalence ...")
+    for report in reports:
+        print(
+            f"{report.backend}: {'matches' if report.matches else 'differs'} "
+            f"({'exact' if report.exact else 'within tolerance'}), "
+            f"choice agreement {report.choice_agreement:.2%}, "
+            f"first mismatch epoch {report.first_mismatch_epoch}, "
+            f"max score difference {report.max_score_difference}, "
+            f"max divergence {report.max_divergence:.2%}"
+            + (
+                f", max belief difference {report.max_belief_difference:.2e}" if report.exact
+                else f", max {report.max_standard_errors:.2f} standard errors"
+            )
+        )
@@ -0,0 +1,118 @@
+import importlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple, Type
+
+import numpy as np
+
+from agents.agent import EPS, LEARNING_SPEED
+from utilities import AgentsConfiguration, RegularSimulationResults, NUM_OF_CHOICES
+from simulations.interaction_graph import score_round
+
+# Modules defining the built-in backends, imported on first lookup
+BUILTIN_BACKEND_MODULES = ('simulations.regular_simulation', 'simulations.vectorized_simulation')
+
+class SimulationBackend(ABC):
+    '''
+    One engine of the regular mod game under
+    RegularSimulation: it creates a population from
+    an AgentsConfiguration (drawing from the current
+    RandomStream) and plays rounds as decide, score
+    and update. The simulation owns everything else
+    (scores, history, statistics, checkpoints).
+
+    Backends share the state layout of
+    vectorized_simulation.population_state, so a
+    population can be moved from one backend to
+    another, e.g. to check that they play alike.
+
+    Args:
+        agent_config: AgentsConfiguration == The Agent Population Config
+        number_of_choices: int == Number of choices in the mod game
+        eps: float == Exploration probability of every decision
+        learning_speed: float == Learning speed of every belief update
+    '''
+    name: str = ''
+
+    def __init__(
+        self,
+        agent_config: AgentsConfiguration,
+        number_of_choices: int = NUM_OF_CHOICES,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED
+    ) -> None:
+        self.agent_config = agent_config
+        self.number_of_choices = number_of_choices
+        self.eps = eps
+        self.learning_speed = learning_speed
+
+    @property
+    def kinds(self) -> np.ndarray:
+        ''' ToM order of each agent. '''
+        agent_config = self.agent_config
+        return np.repeat(np.arange(3, dtype=np.int8), [
+            agent_config.zero_order_agent_number,
+            agent_config.first_order_agent_number,
+            agent_config.second_order_agent_number,
+        ])
+
+    @property
+    def batch_shape(self) -> Tuple[int, ...]:
+        ''' Leading replicate axes of the population, () for a single one. '''
+        return ()
+
+    @abstractmethod
+    def decide(self) -> np.ndarray:
+        ''' Returns every agent's action this round. '''
+        pass
+
+    def score(self, actions: np.ndarray, interaction_graph=None) -> np.ndarray:
+        ''' Returns every agent's score for a round of actions. '''
+        return score_round(actions, self.number_of_choices, interaction_graph)
+
+    @abstractmethod
+    def update(self, actions: np.ndarray) -> None:
+        ''' Lets every agent learn from its own action. '''
+        pass
+
+    def get_results(self, agent_scores: np.ndarray) -> RegularSimulationResults:
+        ''' Per ToM level statistics of the agents' total scores. '''
+        # Imported here, as the vectorized simulation imports the backends
+        from simulations.vectorized_simulation import results_from_scores
+        return results_from_scores(self.kinds, np.asarray(agent_scores))
+
+    @abstractmethod
+    def belief_distribution(self) -> np.ndarray:
+        ''' Normalized zero-order beliefs, one row per agent. '''
+        pass
+
+    @abstractmethod
+    def get_state(self) -> Dict[str, np.ndarray]:
+        ''' Returns the population in the layout of vectorized_simulation.population_state. '''
+        pass
+
+    @abstractmethod
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        ''' Restores a population returned by get_state of any backend. '''
+        pass
+
+BACKENDS: Dict[str, Type[SimulationBackend]] = {}
+
+def register_backend(backend_class: Type[SimulationBackend]) -> Type[SimulationBackend]:
+    ''' Class decorator adding a backend to the registry under its name. '''
+    if not backend_class.name:
+        raise ValueError(f"{backend_class.__name__} needs a name to be registered.")
+    BACKENDS[backend_class.name] = backend_class
+    return backend_class
+
+def get_backend(name: str) -> Type[SimulationBackend]:
+    for module in BUILTIN_BACKEND_MODULES:
+        importlib.import_module(module)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {tuple(BACKENDS)}.")
+    return BACKENDS[name]
+
+def backend_names() -> List[str]:
+    ''' Names of every registered backend, built-in ones first. '''
+    for module in BUILTIN_BACKEND_MODULES:
+        importlib.import_module(module)
+    return list(BACKENDS)
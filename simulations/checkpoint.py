@@ -0,0 +1,53 @@
+import json
+import os
+import shutil
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+METADATA_FILE = 'metadata.json'
+
+def write_checkpoint(path: str, arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]) -> None:
+    '''
+    Writes a checkpoint directory: one uncompressed .npy
+    file per state array, which can be memory-mapped back,
+    and a JSON file with the scalar metadata. The directory
+    is written next to its destination and swapped in at
+    the end, so an interrupted write never replaces a
+    complete checkpoint.
+    '''
+    temporary_path = f"{path}.tmp"
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    os.makedirs(temporary_path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary_path, f"{name}.npy"), np.asarray(array), allow_pickle=False)
+
+    with open(os.path.join(temporary_path, METADATA_FILE), 'w') as file:
+        json.dump(metadata, file)
+
+    previous_path = f"{path}.old"
+    shutil.rmtree(previous_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, previous_path)
+    os.replace(temporary_path, path)
+    shutil.rmtree(previous_path, ignore_errors=True)
+
+def read_checkpoint(path: str, mmap_mode: str = 'c') -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    '''
+    Reads a checkpoint directory written by write_checkpoint.
+    Arrays are memory-mapped copy-on-write by default, so
+    loading is near-instant whatever the population size and
+    several simulations can branch off the same checkpoint.
+    '''
+    with open(os.path.join(path, METADATA_FILE)) as file:
+        metadata = json.load(file)
+
+    arrays = {}
+    for file_name in os.listdir(path):
+        if file_name.endswith('.npy'):
+            array = np.load(os.path.join(path, file_name), mmap_mode=mmap_mode, allow_pickle=False)
+            # Plain ndarray views of the map, so results of operations are not memmaps
+            arrays[file_name[:-len('.npy')]] = np.asarray(array)
+
+    return arrays, metadata
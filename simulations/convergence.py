@@ -0,0 +1,97 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+@dataclass
+class ConvergenceCriterion:
+    '''
+    Utility dataclass to store when a run
+    counts as converged, see Simulation.run.
+
+    Per-level score rates are averaged over windows
+    of `window` rounds. A run converges once the
+    largest relative change between consecutive
+    window rates stays within `tolerance` for
+    `patience` windows in a row, after at least
+    `min_epochs` rounds. Runs that do not converge
+    stop after `max_epochs` rounds.
+
+    Belief drift, the mean absolute change per round
+    of the normalised beliefs over a window, is always
+    tracked, but only required to fall below
+    `drift_tolerance` if one is given: with a constant
+    learning speed mod game beliefs keep cycling, so
+    drift need not vanish once score rates are stable.
+    '''
+    window: int = 50
+    tolerance: float = 0.01
+    patience: int = 2
+    min_epochs: int = 100
+    max_epochs: int = 5000
+    drift_tolerance: Optional[float] = None
+
+@dataclass
+class ConvergenceReport:
+    '''
+    Utility dataclass to store the
+    outcome of a convergence run.
+    '''
+    converged: bool = False
+    epoch: Optional[int] = None  # Epoch the run converged at, None if it hit max_epochs
+    epochs_run: int = 0
+    level_rates: List = field(default_factory=list)  # Rates of the last window, per level
+    belief_drift: Optional[float] = None             # Drift over the last window
+
+class ConvergenceMonitor:
+    '''
+    Tracks the windowed score rates and belief
+    drift of a running simulation, which must
+    derive from SupportsConvergence.
+    '''
+    def __init__(self, criterion: ConvergenceCriterion, simulation) -> None:
+        self.criterion = criterion
+        self.report = ConvergenceReport()
+        self.stable_windows: int = 0
+
+        self._window_sum: Optional[np.ndarray] = None
+        self._rounds_in_window: int = 0
+        self._previous_rates: Optional[np.ndarray] = None
+        self._previous_beliefs = np.array(simulation.belief_distribution())
+
+    def after_round(self, simulation) -> bool:
+        ''' Adds the round just played, returns whether the run has converged. '''
+        self.report.epochs_run += 1
+        rates = np.asarray(simulation.level_rates(), dtype=float)
+        self._window_sum = rates if self._window_sum is None else self._window_sum + rates
+        self._rounds_in_window += 1
+
+        if self._rounds_in_window < self.criterion.window:
+            return False
+
+        window_rates = self._window_sum / self._rounds_in_window
+        self._window_sum = None
+        self._rounds_in_window = 0
+
+        beliefs = np.array(simulation.belief_distribution())
+        drift = float(np.mean(np.abs(beliefs - self._previous_beliefs))) / self.criterion.window
+        self._previous_beliefs = beliefs
+        self.report.level_rates = window_rates.tolist()
+        self.report.belief_drift = drift
+
+        if self._previous_rates is not None:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                change = np.abs(window_rates - self._previous_rates) / np.abs(self._previous_rates)
+            # Empty levels have no rate and never block convergence
+            change = np.nan_to_num(change, nan=0.0, posinf=np.inf)
+            stable = float(np.max(change, initial=0.0)) <= self.criterion.tolerance
+            if self.criterion.drift_tolerance is not None:
+                stable = stable and drift <= self.criterion.drift_tolerance
+            self.stable_windows = self.stable_windows + 1 if stable else 0
+        self._previous_rates = window_rates
+
+        if self.stable_windows >= self.criterion.patience and self.report.epochs_run >= self.criterion.min_epochs:
+            self.report.converged = True
+            self.report.epoch = simulation.epoch
+            return True
+        return False
@@ -0,0 +1,504 @@
+'''
+Runs replicates and sweep cells on workers across
+machines. A Coordinator serves jobs over TCP; workers
+started anywhere with
+
+    python -m simulations.distributed HOST PORT
+
+lease batches of jobs, run them and send back their
+results. Messages are length-prefixed JSON, so only
+configurations, seeds and result numbers cross the
+network. There is no authentication: bind the
+coordinator to a trusted network only.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Type
+
+import numpy as np
+
+from simulations.simulation import Simulation
+from simulations.online_statistics import RunningStatistics
+from simulations.parameter_sweep import ResultCache, SweepCell, pending_replicates
+from simulations.regular_simulation import RegularSimulation
+from simulations.replicate_runner import derive_seeds
+from simulations.serialization import (
+    decode_payload,
+    encode_payload,
+    json_default,
+    resolve_simulation,
+    simulation_path
+)
+from simulations.vectorized_simulation import VectorizedRegularSimulation
+from utilities import AgentsConfiguration, RegularSimulationResults
+
+HEARTBEAT_INTERVAL = 2.0  # Seconds between a busy worker's heartbeats
+HEARTBEAT_TIMEOUT = 10.0  # Seconds of silence after which a worker's jobs are requeued
+DEFAULT_LEASE = 4         # Jobs a worker asks for at once
+MAX_LEASE = 64
+WAIT_DELAY = 0.5          # Seconds an idle worker waits before asking again
+CONNECT_TIMEOUT = 30.0    # Seconds a worker keeps retrying to reach the coordinator
+MAX_MESSAGE_BYTES = 1 << 26
+
+@dataclass
+class Job:
+    '''
+    Utility dataclass to store one simulation
+    run: the simulation (by import path) is
+    created with agent_config, seed and
+    simulation_kwargs and run for epochs rounds.
+    With statistics, the job returns the per
+    level streaming score accumulators instead
+    of the results.
+    '''
+    job_id: int
+    simulation: str  # e.g. 'simulations.regular_simulation.RegularSimulation'
+    agent_config: Any
+    epochs: int
+    seed: int
+    simulation_kwargs: Dict[str, Any] = field(default_factory=dict)  # JSON values only
+    statistics: bool = False
+
+def send_message(connection: socket.socket, message: Dict[str, Any]) -> None:
+    data = json.dumps(message, default=json_default).encode()
+    connection.sendall(struct.pack('>I', len(data)) + data)
+
+def receive_exactly(connection: socket.socket, size: int) -> Optional[bytes]:
+    ''' Reads size bytes, or None if the peer closed the connection first. '''
+    chunks = []
+    while size > 0:
+        chunk = connection.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def receive_message(connection: socket.socket) -> Optional[Dict[str, Any]]:
+    ''' Reads one message, or None once the peer is gone. '''
+    header = receive_exactly(connection, 4)
+    if header is None:
+        return None
+    size, = struct.unpack('>I', header)
+    if size > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Message of {size} bytes, over the {MAX_MESSAGE_BYTES} byte limit.")
+    data = receive_exactly(connection, size)
+    return None if data is None else json.loads(data)
+
+def encode_job(job: Job) -> Dict[str, Any]:
+    return {**asdict(job), 'agent_config': encode_payload(job.agent_config)}
+
+def decode_job(message: Dict[str, Any]) -> Job:
+    return Job(**{**message, 'agent_config': decode_payload(message['agent_config'])})
+
+def run_job(job: Job) -> Dict[str, Any]:
+    ''' Runs a job and returns its result payload. '''
+    simulation = resolve_simulation(job.simulation)(
+        agent_config=job.agent_config, seed=job.seed, **job.simulation_kwargs
+    )
+    simulation.run(number_of_epochs=job.epochs)
+
+    if not job.statistics:
+        return {'job_id': job.job_id, 'results': encode_payload(simulation.get_results())}
+
+    levels = simulation.statistics.levels
+    return {
+        'job_id': job.job_id,
+        'statistics': {
+            'count': [level.count for level in levels],
+            'mean': [level.mean for level in levels],
+            'm2': [level.m2 for level in levels],
+        },
+    }
+
+def decode_result(payload: Dict[str, Any]) -> Any:
+    ''' The results of a job payload, or its per level RunningStatistics. '''
+    if 'results' in payload:
+        return decode_payload(payload['results'])
+
+    levels = []
+    for count, mean, m2 in zip(*(payload['statistics'][name] for name in ('count', 'mean', 'm2'))):
+        statistics = RunningStatistics(np.shape(mean))
+        statistics.count = np.array(count, dtype=float)
+        statistics.mean = np.array(mean, dtype=float)
+        statistics.m2 = np.array(m2, dtype=float)
+        levels.append(statistics)
+    return levels
+
+class CoordinatorHandler(socketserver.BaseRequestHandler):
+    ''' Answers the messages of one worker connection. '''
+    def handle(self) -> None:
+        coordinator: 'Coordinator' = self.server.coordinator
+        worker = None
+        try:
+            while True:
+                message = receive_message(self.request)
+                if message is None:
+                    break
+                worker = message['worker']
+                send_message(self.request, coordinator.handle_message(message))
+        except (OSError, ValueError):
+            pass
+        finally:
+            # A closed connection means a dead worker, so its jobs go to others right away
+            if worker is not None:
+                coordinator.release_worker(worker)
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class Coordinator:
+    '''
+    Serves jobs to workers over TCP, one thread per
+    worker connection. Workers lease up to max_lease
+    jobs at a time and return their results together,
+    so the per job overhead is one message either way.
+    Jobs leased to a worker that disconnects, or that
+    sends nothing (not even a heartbeat) for
+    heartbeat_timeout seconds, are handed out again;
+    when both copies finish, the first result is kept.
+    Job seeds are fixed, so results do not depend on
+    which worker ran them.
+
+    Args:
+        jobs: Sequence[Job] == Jobs to run, with distinct ids
+        host: str == Interface to listen on, localhost by default
+        port: int == Port to listen on, a free one if 0
+        heartbeat_timeout: float == Seconds of silence before a worker counts as dead
+        max_lease: int == Most jobs leased to a worker at once
+    '''
+    def __init__(
+        self,
+        jobs: Sequence[Job],
+        host: str = '127.0.0.1',
+        port: int = 0,
+        heartbeat_timeout: float = HEARTBEAT_TIMEOUT,
+        max_lease: int = MAX_LEASE
+    ) -> None:
+        self.jobs: Dict[int, Job] = {job.job_id: job for job in jobs}
+        if len(self.jobs) != len(jobs):
+            raise ValueError("Job ids must be distinct.")
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_lease = max_lease
+
+        self._lock = threading.Lock()
+        self._pending = deque(self.jobs)
+        self._leases: Dict[str, Set[int]] = {}
+        self._last_seen: Dict[str, float] = {}
+        self._finished: Set[int] = set()
+        self._results: 'queue.Queue[Tuple[int, Dict[str, Any]]]' = queue.Queue()
+        self._closed = threading.Event()
+
+        self.server = CoordinatorServer((host, port), CoordinatorHandler)
+        self.server.coordinator = self
+        self._threads = [
+            threading.Thread(target=self.server.serve_forever, daemon=True),
+            threading.Thread(target=self._reap_workers, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.server.server_address[:2]
+
+    def handle_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        worker = message['worker']
+        with self._lock:
+            self._last_seen[worker] = time.monotonic()
+
+            if message['type'] == 'lease':
+                leased = []
+                while self._pending and len(leased) < min(message['max_jobs'], self.max_lease):
+                    job_id = self._pending.popleft()
+                    # Requeued jobs may have finished on their first worker meanwhile
+                    if job_id not in self._finished:
+                        leased.append(job_id)
+                if leased:
+                    self._leases.setdefault(worker, set()).update(leased)
+                    return {'type': 'jobs', 'jobs': [encode_job(self.jobs[job_id]) for job_id in leased]}
+                if len(self._finished) == len(self.jobs):
+                    return {'type': 'done'}
+                return {'type': 'wait', 'delay': WAIT_DELAY}
+
+            if message['type'] == 'results':
+                lease = self._leases.get(worker, set())
+                for payload in message['results']:
+                    job_id = payload['job_id']
+                    lease.discard(job_id)
+                    if job_id in self.jobs and job_id not in self._finished:
+                        self._finished.add(job_id)
+                        self._results.put((job_id, payload))
+
+            return {'type': 'ok'}
+
+    def release_worker(self, worker: str) -> None:
+        ''' Puts the jobs leased to a worker back at the front of the queue. '''
+        with self._lock:
+            self._last_seen.pop(worker, None)
+            self._pending.extendleft(sorted(self._leases.pop(worker, ()), reverse=True))
+
+    def _reap_workers(self) -> None:
+        while not self._closed.wait(self.heartbeat_timeout / 4):
+            now = time.monotonic()
+            with self._lock:
+                silent = [worker for worker, seen in self._last_seen.items() if now - seen > self.heartbeat_timeout]
+            for worker in silent:
+                self.release_worker(worker)
+
+    def iter_results(self, timeout: Optional[float] = None) -> Iterator[Tuple[int, Any]]:
+        '''
+        Yields (job id, result) pairs as jobs finish,
+        until every job has. Raises RuntimeError for a
+        job that failed on its worker, and TimeoutError
+        if no job finishes for timeout seconds.
+        '''
+        for _ in range(len(self.jobs)):
+            try:
+                job_id, payload = self._results.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No job finished in {timeout} seconds.") from None
+            if 'error' in payload:
+                raise RuntimeError(f"Job {job_id} failed: {payload['error']}")
+            yield job_id, decode_result(payload)
+
+    def close(self) -> None:
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'Coordinator':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+def connect(host: str, port: int, connect_timeout: float = CONNECT_TIMEOUT) -> socket.socket:
+    ''' Connects to a coordinator, retrying until it is up or connect_timeout passes. '''
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            return socket.create_connection((host, port))
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(WAIT_DELAY)
+
+def run_worker(
+        host: str,
+        port: int,
+        max_jobs: int = DEFAULT_LEASE,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL,
+        connect_timeout: float = CONNECT_TIMEOUT
+    ) -> int:
+    '''
+    Leases jobs from a coordinator, runs them and
+    returns their results until the coordinator has
+    no jobs left or goes away. A background thread
+    sends heartbeats while jobs run. Returns the
+    number of jobs this worker ran.
+
+    Args:
+        host: str == Host of the coordinator
+        port: int == Port of the coordinator
+        max_jobs: int == Jobs leased at once
+        heartbeat_interval: float == Seconds between heartbeats,
+            well below the coordinator's heartbeat_timeout
+        connect_timeout: float == Seconds to keep retrying to connect
+    '''
+    connection = connect(host, port, connect_timeout)
+    worker = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    lock = threading.Lock()
+    stopped = threading.Event()
+
+    def request(message: Dict[str, Any]) -> Dict[str, Any]:
+        with lock:
+            send_message(connection, {**message, 'worker': worker})
+            reply = receive_message(connection)
+        if reply is None:
+            raise ConnectionError("The coordinator closed the connection.")
+        return reply
+
+    def send_heartbeats() -> None:
+        while not stopped.wait(heartbeat_interval):
+            try:
+                request({'type': 'heartbeat'})
+            except (OSError, ValueError):
+                return
+
+    heartbeats = threading.Thread(target=send_heartbeats, daemon=True)
+    heartbeats.start()
+    number_of_jobs = 0
+    try:
+        while True:
+            reply = request({'type': 'lease', 'max_jobs': max_jobs})
+            if reply['type'] == 'done':
+                break
+            if reply['type'] == 'wait':
+                time.sleep(reply['delay'])
+                continue
+
+            payloads = []
+            for message in reply['jobs']:
+                try:
+                    payloads.append(run_job(decode_job(message)))
+                except Exception as error:
+                    payloads.append({'job_id': message['job_id'], 'error': repr(error)})
+            request({'type': 'results', 'results': payloads})
+            number_of_jobs += len(payloads)
+    except (OSError, ValueError):
+        # The coordinator is gone, nothing is left to report to
+        pass
+    finally:
+        stopped.set()
+        connection.close()
+        heartbeats.join()
+
+    return number_of_jobs
+
+def start_local_workers(
+        address: Tuple[str, int],
+        number_of_workers: int,
+        max_jobs: int = DEFAULT_LEASE
+    ) -> List[multiprocessing.Process]:
+    ''' Starts worker processes on this machine, e.g. to test a coordinator on localhost. '''
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(*address, max_jobs), daemon=True)
+        for _ in range(number_of_workers)
+    ]
+    for process in processes:
+        process.start()
+    return processes
+
+def run_jobs(
+        jobs: Sequence[Job],
+        host: str = '127.0.0.1',
+        port: int = 0,
+        local_workers: int = 0,
+        timeout: Optional[float] = None,
+        on_result=None
+    ) -> Dict[int, Any]:
+    '''
+    Serves jobs until every one has finished and
+    returns their results by job id. Workers on
+    other machines connect to (host, port); with
+    local_workers, that many also start here.
+    on_result(job_id, result) is called as each
+    job finishes, e.g. to cache it.
+    '''
+    results: Dict[int, Any] = {}
+    with Coordinator(jobs, host, port) as coordinator:
+        processes = start_local_workers(coordinator.address, local_workers)
+        try:
+            for job_id, result in coordinator.iter_results(timeout):
+                results[job_id] = result
+                if on_result is not None:
+                    on_result(job_id, result)
+        finally:
+            coordinator.close()
+            for process in processes:
+                process.join()
+    return results
+
+def replicate_jobs(
+        agent_config: AgentsConfiguration,
+        number_of_replicates: int = 10,
+        epochs: int = 1000,
+        master_seed: int = 0,
+        simulation_class: Type[Simulation] = RegularSimulation,
+        simulation_kwargs: Optional[Dict[str, Any]] = None,
+        statistics: bool = False
+    ) -> List[Job]:
+    '''
+    One job per replicate, seeded like
+    replicate_runner.run_replicates, so results
+    match a local run. Job ids are replicate indices.
+    '''
+    return [
+        Job(index, simulation_path(simulation_class), agent_config, epochs, seed, simulation_kwargs or {}, statistics)
+        for index, seed in enumerate(derive_seeds(master_seed, number_of_replicates))
+    ]
+
+def run_distributed_replicates(
+        agent_config: AgentsConfiguration,
+        number_of_replicates: int = 10,
+        epochs: int = 1000,
+        master_seed: int = 0,
+        simulation_class: Type[Simulation] = RegularSimulation,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        local_workers: int = 0
+    ) -> List[Any]:
+    '''
+    Distributed replicate_runner.run_replicates:
+    returns the results in replicate order.
+    '''
+    results = run_jobs(
+        replicate_jobs(agent_config, number_of_replicates, epochs, master_seed, simulation_class),
+        host, port, local_workers
+    )
+    return [results[index] for index in range(number_of_replicates)]
+
+def run_distributed_sweep(
+        cells: Sequence[SweepCell],
+        epochs: int = 1000,
+        number_of_replicates: int = 10,
+        master_seed: int = 0,
+        cache_directory: str = 'sweep_cache',
+        simulation_class: Type[Simulation] = VectorizedRegularSimulation,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        local_workers: int = 0
+    ) -> Dict[SweepCell, List[RegularSimulationResults]]:
+    '''
+    Distributed parameter_sweep.run_sweep, sharing
+    its result cache: replicates already cached are
+    skipped and the others are cached as they arrive.
+    The simulation must accept the
+    SweepCell.simulation_kwargs arguments, as with
+    run_sweep.
+    '''
+    cache = ResultCache(cache_directory)
+    seeds = derive_seeds(master_seed, number_of_replicates)
+    results, pending = pending_replicates(cells, epochs, seeds, simulation_class, cache)
+
+    jobs = [
+        Job(job_id, simulation_path(simulation_class), cell.agent_config, epochs, seed, cell.simulation_kwargs())
+        for job_id, (cell, _, seed, _, _) in enumerate(pending)
+    ]
+
+    def store(job_id: int, replicate_results: RegularSimulationResults) -> None:
+        cell, index, _, key, description = pending[job_id]
+        cache.put(key, replicate_results, description)
+        results[cell][index] = replicate_results
+
+    if jobs:
+        run_jobs(jobs, host, port, local_workers, on_result=store)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs a worker for a simulations.distributed Coordinator.")
+    parser.add_argument('host')
+    parser.add_argument('port', type=int)
+    parser.add_argument('--max-jobs', type=int, default=DEFAULT_LEASE, help="Jobs leased at once")
+    parser.add_argument('--heartbeat-interval', type=float, default=HEARTBEAT_INTERVAL)
+    parser.add_argument('--connect-timeout', type=float, default=CONNECT_TIMEOUT)
+    arguments = parser.parse_args()
+    number_of_jobs = run_worker(
+        arguments.host, arguments.port, arguments.max_jobs, arguments.heartbeat_interval, arguments.connect_timeout
+    )
+    print(f"Ran {number_of_jobs} jobs.")
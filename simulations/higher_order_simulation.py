@@ -0,0 +1,344 @@
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from agents.agent import EPS, LEARNING_SPEED, TheoryOfMindAgent
+from agents.beliefs import BeliefMatrix
+from agents.higher_order_agents import KthOrderTheoryOfMindAgent, ModelChain
+from simulations.regular_simulation import configure_agent, create_zero_order_agents
+from utilities import (
+    HigherOrderConfiguration,
+    HigherOrderSimulationResults,
+    NUM_OF_CHOICES,
+    get_mean,
+    get_std,
+    get_random_stream,
+    check_epsilons,
+    count_nested_model_calls,
+    generate_agent_beliefs,
+    make_random_choices,
+    using_random_stream
+)
+from simulations.simulation import Simulation, SupportsCheckpoints, SupportsConvergence
+from simulations.action_history import ActionHistory
+from simulations.interaction_graph import InteractionGraph, score_round
+from simulations.online_statistics import ScoreStatistics
+from simulations.vectorized_simulation import zero_order_decide, zero_order_update
+
+def create_higher_order_agents(
+        agent_config: HigherOrderConfiguration = HigherOrderConfiguration((10, 10, 10, 10)),
+        share_models: bool = False,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED,
+        number_of_choices: int = NUM_OF_CHOICES
+    ) -> List[TheoryOfMindAgent]:
+    '''
+    Creates a population of per-agent objects of
+    every order in a HigherOrderConfiguration,
+    ordered from order 0 up.
+
+    The initial beliefs of every order are drawn at
+    once, laid out as if each agent (and shared chain)
+    drew its own in turn, like regular_simulation.create_agents.
+
+    Args:
+        agent_config: HigherOrderConfiguration == The Agent Population Config
+        share_models: bool == Whether agents of the same order share one ModelChain
+        eps: float == Exploration probability of every agent and model
+        learning_speed: float == Learning speed of every agent and model
+        number_of_choices: int == Number of choices in the mod game
+    '''
+    choices = (number_of_choices,)
+    agents: List[TheoryOfMindAgent] = []
+
+    for order, number in enumerate(agent_config.agent_numbers):
+        if order == 0:
+            agents.extend(create_zero_order_agents(*generate_agent_beliefs(number, [choices, choices])))
+            continue
+
+        # Beliefs of the chain's models from order 2 on, then the agent's own beliefs in its models
+        chain_shapes = [choices] + [(model_order,) for model_order in range(2, order)]
+        agent_shapes = [(order,)] if order >= 2 else []
+
+        if share_models and number > 0:
+            chain_beliefs = [values[0].tolist() for values in generate_agent_beliefs(1, chain_shapes)]
+            shared_chain = ModelChain(order, chain_beliefs[0], order_beliefs=chain_beliefs[1:])
+            agent_beliefs = generate_agent_beliefs(number, agent_shapes)
+            chains = [shared_chain] * number
+        else:
+            beliefs = generate_agent_beliefs(number, chain_shapes + agent_shapes)
+            chain_beliefs, agent_beliefs = beliefs[:len(chain_shapes)], beliefs[len(chain_shapes):]
+            chains = [
+                ModelChain(order, model_beliefs[0], order_beliefs=model_beliefs[1:])
+                for model_beliefs in zip(*(values.tolist() for values in chain_beliefs))
+            ]
+
+        order_beliefs = agent_beliefs[0].tolist() if agent_beliefs else [None] * number
+        agents.extend(
+            KthOrderTheoryOfMindAgent(order, model_chain=chain, order_beliefs=agent_order_beliefs)
+            for chain, agent_order_beliefs in zip(chains, order_beliefs)
+        )
+
+    # Agents start with the module defaults
+    if (eps, learning_speed) != (EPS, LEARNING_SPEED):
+        for agent in agents:
+            configure_agent(agent, eps, learning_speed)
+
+    return agents
+
+@dataclass
+class HigherOrderPopulation:
+    '''
+    Struct-of-arrays storage of a population of
+    Theory of Mind agents of any order, sorted by
+    order. An order-k agent is stored as the levels
+    0 to k of a ModelChain plus its own top level:
+    zero-order beliefs in `beliefs` and, for every
+    level j >= 2, its beliefs in the j lower levels
+    in order_beliefs[j], one row per agent of order
+    at least j. Level 1 needs no beliefs.
+    '''
+    orders: np.ndarray               # (N,) ToM order of each agent, ascending
+    beliefs: BeliefMatrix            # (N, C) zero-order beliefs
+    order_beliefs: List[Optional[np.ndarray]]  # order_beliefs[j]: (N_j, j) for j >= 2
+    decisions: Optional[np.ndarray] = None     # (K + 1, N) level decisions cached this round
+
+    @property
+    def size(self) -> int:
+        return self.orders.shape[0]
+
+    @property
+    def max_order(self) -> int:
+        return len(self.order_beliefs) - 1
+
+    @property
+    def number_of_choices(self) -> int:
+        return self.beliefs.number_of_choices
+
+    def level_rows(self, level: int) -> slice:
+        ''' Rows of the agents with a model (or top level) of order `level`, which come last. '''
+        return slice(self.size - self.order_beliefs[level].shape[0], self.size)
+
+def create_higher_order_population(
+        agent_config: HigherOrderConfiguration = HigherOrderConfiguration((10, 10, 10, 10)),
+        number_of_choices: int = NUM_OF_CHOICES,
+        precision: str = 'float64'
+    ) -> HigherOrderPopulation:
+    ''' Creates the array storage for a population based on a HigherOrderConfiguration. '''
+    agent_numbers = np.array(agent_config.agent_numbers)
+    orders = np.repeat(np.arange(agent_numbers.shape[0], dtype=np.int8), agent_numbers)
+
+    random_stream = get_random_stream()
+    beliefs = BeliefMatrix.from_values(random_stream.random_array((orders.shape[0], number_of_choices)), precision)
+    order_beliefs = [
+        random_stream.random_array((int(agent_numbers[level:].sum()), level)) if level >= 2 else None
+        for level in range(agent_numbers.shape[0])
+    ]
+
+    return HigherOrderPopulation(orders=orders, beliefs=beliefs, order_beliefs=order_beliefs)
+
+def higher_order_decide(population: HigherOrderPopulation, eps: float = EPS) -> np.ndarray:
+    '''
+    Gets the decision of every agent in the population.
+    Each level is decided once for all agents that have
+    it, from the levels below: level 0 is a zero-order
+    decision, level 1 one above it and level j >= 2 one
+    above the level it believes in most (or a random
+    one with epsilon probability).
+    '''
+    number_of_choices = population.number_of_choices
+    decisions = np.empty((population.max_order + 1, population.size), dtype=np.int64)
+
+    decisions[0] = zero_order_decide(population.beliefs.best, number_of_choices, eps)
+    if population.max_order >= 1:
+        decisions[1] = (decisions[0] + 1) % number_of_choices
+
+    for level in range(2, population.max_order + 1):
+        rows = population.level_rows(level)
+        order_beliefs = population.order_beliefs[level]
+        number_of_rows = order_beliefs.shape[0]
+
+        explore = check_epsilons(eps, (number_of_rows,))
+        random_levels = make_random_choices(level, (number_of_rows,))
+        modelled_levels = np.where(explore, random_levels, np.argmax(order_beliefs, axis=-1))
+        decisions[level, rows] = (decisions[:level, rows][modelled_levels, np.arange(number_of_rows)] + 1) % number_of_choices
+
+    # Levels below an agent's own order are its nested models
+    count_nested_model_calls(int(population.orders.sum()))
+    population.decisions = decisions
+    return decisions[population.orders, np.arange(population.size)]
+
+def higher_order_update(
+        population: HigherOrderPopulation,
+        actions: np.ndarray,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED
+    ) -> None:
+    '''
+    Updates the beliefs of every level of every agent
+    given their own actions, reusing the decisions of
+    the round.
+    '''
+    number_of_choices = population.number_of_choices
+    decisions = population.decisions
+    if decisions is None:
+        higher_order_decide(population, eps)
+        decisions = population.decisions
+
+    # Reinforce, per level, the lowest level below it that predicted the action
+    for level in range(2, population.max_order + 1):
+        rows = population.level_rows(level)
+        hits = (decisions[:level, rows] + 1) % number_of_choices == actions[rows]
+        hit_rows = np.flatnonzero(hits.any(axis=0))
+        first_hits = np.argmax(hits[:, hit_rows], axis=0)
+
+        order_beliefs = population.order_beliefs[level]
+        order_beliefs[hit_rows] *= (1.0 - learning_speed) / order_beliefs[hit_rows].sum(axis=-1, keepdims=True)
+        order_beliefs[hit_rows, first_hits] += learning_speed
+
+    zero_order_update(population.beliefs, actions, learning_speed)
+    population.decisions = None
+
+class HigherOrderSimulation(Simulation, SupportsCheckpoints, SupportsConvergence):
+    '''
+    A Simulation of Theory of Mind agents of
+    any order playing the mod game without
+    signaling, with the whole population stored
+    and advanced as NumPy arrays. Every level
+    of every agent is decided once per round,
+    so a round costs O(k) per order-k agent.
+
+    Args:
+        agent_config: HigherOrderConfiguration == The Agent Population Config
+        number_of_choices: int == Number of choices in the mod game
+        history_window: Optional[int] == Rounds of actions kept in memory,
+            None keeps all of them (only the last SPILLED_WINDOW with a history_path)
+        history_path: Optional[str] == File the full action history is spilled to
+        seed: Optional[int] == Seed of the simulation's random stream
+        eps: float == Exploration probability of every decision
+        learning_speed: float == Learning speed of every belief update
+        interaction_graph: Optional[InteractionGraph] == Neighbours each agent is scored against,
+            None scores every agent against all others
+        precision: str == Storage precision of the beliefs, see agents.beliefs.PRECISIONS
+    '''
+    def __init__(
+        self,
+        agent_config: HigherOrderConfiguration = HigherOrderConfiguration((5, 5, 5, 5)),
+        number_of_choices: int = NUM_OF_CHOICES,
+        history_window: Optional[int] = None,
+        history_path: Optional[str] = None,
+        seed: Optional[int] = None,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED,
+        interaction_graph: Optional[InteractionGraph] = None,
+        precision: str = 'float64'
+    ):
+        super().__init__(agent_config, seed)
+        self.eps = eps
+        self.learning_speed = learning_speed
+        with using_random_stream(self.random_stream):
+            self.population = create_higher_order_population(agent_config, number_of_choices, precision)
+        if interaction_graph is not None:
+            interaction_graph.check_size(self.population.size)
+        self.interaction_graph = interaction_graph
+        self.agent_scores = np.zeros(self.population.size, dtype=np.int64)
+        self.agent_actions = ActionHistory(
+            self.population.size, history_window, history_path, number_of_choices
+        )
+        self.statistics = ScoreStatistics(
+            self.population.orders, number_of_levels=len(agent_config.agent_numbers)
+        )
+
+    def simulate_round(self) -> None:
+        # Have each agent decide on an action
+        with self.phase('decide'):
+            actions = higher_order_decide(self.population, self.eps)
+        with self.phase('record'):
+            self.agent_actions.record(actions)
+
+        # Score each agent by the number of agents (or neighbours) that chose the action below its own
+        with self.phase('score'):
+            round_scores = score_round(actions, self.population.number_of_choices, self.interaction_graph)
+            self.agent_scores += round_scores
+            self.statistics.update(round_scores)
+
+        # Update the beliefs of each agent based on their actions
+        with self.phase('update'):
+            higher_order_update(self.population, actions, self.eps, self.learning_speed)
+
+    def level_rates(self) -> np.ndarray:
+        return self.statistics.last_means
+
+    def belief_distribution(self) -> np.ndarray:
+        beliefs = self.population.beliefs
+        return beliefs.scaled() / beliefs.total[..., np.newaxis]
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return {
+            'orders': self.population.orders,
+            **self.population.beliefs.get_state('beliefs'),
+            **{
+                f"order_beliefs_{level}": order_beliefs
+                for level, order_beliefs in enumerate(self.population.order_beliefs)
+                if order_beliefs is not None
+            },
+            'agent_scores': self.agent_scores,
+            **self.agent_actions.get_state(),
+            **self.statistics.get_state(),
+        }
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        beliefs = BeliefMatrix.from_state('beliefs', state)
+        if beliefs.values.shape != self.population.beliefs.values.shape:
+            raise ValueError(
+                f"Checkpoint beliefs of shape {beliefs.values.shape}, "
+                f"not {self.population.beliefs.values.shape}."
+            )
+        if beliefs.precision != self.population.beliefs.precision:
+            raise ValueError(
+                f"Checkpoint beliefs in {beliefs.precision.name}, "
+                f"not {self.population.beliefs.precision.name}."
+            )
+        if np.any(state['orders'] != self.population.orders):
+            raise ValueError("Checkpoint of a different agent configuration.")
+
+        order_beliefs = []
+        for level, level_beliefs in enumerate(self.population.order_beliefs):
+            if level_beliefs is None:
+                order_beliefs.append(None)
+                continue
+            name = f"order_beliefs_{level}"
+            if name not in state or state[name].shape != level_beliefs.shape:
+                raise ValueError(
+                    f"Checkpoint order beliefs of level {level} of shape "
+                    f"{state[name].shape if name in state else None}, not {level_beliefs.shape}."
+                )
+            order_beliefs.append(state[name])
+
+        self.population = HigherOrderPopulation(
+            orders=state['orders'],
+            beliefs=beliefs,
+            order_beliefs=order_beliefs,
+        )
+        self.agent_scores = state['agent_scores']
+        self.agent_actions.set_state(state)
+        self.statistics.set_state(state)
+
+    def get_results(self) -> HigherOrderSimulationResults:
+        '''
+        Calculates the statistics of every
+        order and returns them as a
+        HigherOrderSimulationResults.
+        '''
+        orders = range(len(self.agent_config.agent_numbers))
+        return HigherOrderSimulationResults(
+            means=[float(get_mean(self.agent_scores[self.population.orders == order])) for order in orders],
+            stds=[float(get_std(self.agent_scores[self.population.orders == order])) for order in orders],
+        )
+
+    @staticmethod
+    def display_results(results: HigherOrderSimulationResults) -> None:
+        print("Printing statistics ...")
+        for order, (mean, std) in enumerate(zip(results.means, results.stds)):
+            print(f"Order {order} Mean Score: {mean:.3f}")
+            print(f"Order {order} Std: {std:.3f}")
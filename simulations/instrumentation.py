@@ -0,0 +1,177 @@
+import cProfile
+import pstats
+import time
+import tracemalloc
+from typing import Any, Dict, Optional, Union
+
+from utilities import RandomStream
+
+PROFILE_KINDS = ('cprofile', 'tracemalloc')
+
+class PhaseTimer:
+    '''
+    Context manager accumulating the time
+    spent in one phase of a round.
+    '''
+    __slots__ = ('seconds', 'calls', '_start')
+
+    def __init__(self) -> None:
+        self.seconds: float = 0.0
+        self.calls: int = 0
+        self._start: float = 0.0
+
+    def __enter__(self) -> 'PhaseTimer':
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.seconds += time.perf_counter() - self._start
+        self.calls += 1
+
+class NullPhase:
+    ''' Phase context used when instrumentation is off, does nothing. '''
+    __slots__ = ()
+
+    def __enter__(self) -> 'NullPhase':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+NULL_PHASE = NullPhase()
+
+class Instrumentation:
+    '''
+    Per-phase timers and counters of a simulation,
+    enabled with Simulation.instrument(). Counters
+    are taken from the simulation's RandomStream
+    relative to when instrumentation started. Nested
+    model calls are the model decisions actually
+    computed, so decisions cached within a round or
+    shared through a ModelChain count once.
+    '''
+    def __init__(self, random_stream: RandomStream) -> None:
+        self.random_stream = random_stream
+        self.phases: Dict[str, PhaseTimer] = {}
+        self.rounds: int = 0
+
+        self._draws_at_start = random_stream.number_of_draws
+        self._explorations_at_start = random_stream.explorations
+        self._nested_model_calls_at_start = random_stream.nested_model_calls
+
+    def phase(self, name: str) -> PhaseTimer:
+        ''' Returns the timer of a phase, to be used as a context manager. '''
+        timer = self.phases.get(name)
+        if timer is None:
+            timer = self.phases[name] = PhaseTimer()
+        return timer
+
+    def end_round(self) -> None:
+        self.rounds += 1
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        return {
+            'random_draws': self.random_stream.number_of_draws - self._draws_at_start,
+            'explorations': self.random_stream.explorations - self._explorations_at_start,
+            'nested_model_calls': self.random_stream.nested_model_calls - self._nested_model_calls_at_start,
+        }
+
+    def report(self) -> Dict[str, Any]:
+        ''' Returns the timers and counters as a dict. '''
+        rounds = max(self.rounds, 1)
+        return {
+            'rounds': self.rounds,
+            'phases': {
+                name: {
+                    'seconds': timer.seconds,
+                    'calls': timer.calls,
+                    'seconds_per_round': timer.seconds / rounds,
+                }
+                for name, timer in self.phases.items()
+            },
+            'counters': self.counters,
+        }
+
+    def display(self) -> None:
+        report = self.report()
+        total_seconds = sum(phase['seconds'] for phase in report['phases'].values())
+
+        print(f"Instrumentation over {report['rounds']} rounds ...")
+        for name, phase in report['phases'].items():
+            share = phase['seconds'] / total_seconds if total_seconds else 0.0
+            print(f"{name}: {phase['seconds']:.3f} s ({share:.1%}), {phase['seconds_per_round'] * 1e3:.3f} ms per round")
+        for name, value in report['counters'].items():
+            print(f"{name}: {value}")
+
+class ProfileWindow:
+    '''
+    Profiles the epochs in [start, stop) of a run
+    with cProfile or tracemalloc. The result (a
+    pstats.Stats or a tracemalloc.Snapshot) is kept
+    in `result` and, if a path is given, dumped there.
+    A run ending before epoch stop finishes the
+    window with the epochs profiled so far. A
+    tracemalloc window inside an already running
+    trace snapshots it and leaves it running.
+
+    Args:
+        start: int == First profiled epoch
+        stop: int == Epoch the profile ends before
+        kind: str == 'cprofile' or 'tracemalloc'
+        path: Optional[str] == File the result is dumped to
+    '''
+    def __init__(self, start: int, stop: int, kind: str = 'cprofile', path: Optional[str] = None) -> None:
+        if kind not in PROFILE_KINDS:
+            raise ValueError(f"Unknown profile kind {kind!r}, expected one of {PROFILE_KINDS}.")
+        if stop <= start:
+            raise ValueError(f"Empty epoch range [{start}, {stop}).")
+
+        self.start = start
+        self.stop = stop
+        self.kind = kind
+        self.path = path
+        self.result: Union[pstats.Stats, tracemalloc.Snapshot, None] = None
+        self._profiler: Optional[cProfile.Profile] = None
+        self._active = False
+        self._started_tracing = False
+
+    def before_round(self, epoch: int) -> None:
+        if self._active or self.result is not None or not self.start <= epoch < self.stop:
+            return
+
+        self._active = True
+        if self.kind == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def after_round(self, epoch: int) -> None:
+        if self._active and epoch >= self.stop:
+            self.finish()
+
+    def finish(self) -> None:
+        '''
+        Stops the profiler if it is running and keeps
+        its result, e.g. when the run ends before the
+        stop epoch.
+        '''
+        if not self._active:
+            return
+
+        self._active = False
+        if self.kind == 'cprofile':
+            self._profiler.disable()
+            self.result = pstats.Stats(self._profiler)
+            if self.path is not None:
+                self._profiler.dump_stats(self.path)
+            self._profiler = None
+        else:
+            self.result = tracemalloc.take_snapshot()
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+            if self.path is not None:
+                self.result.dump(self.path)
@@ -0,0 +1,268 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from utilities import NUM_OF_CHOICES, get_random_stream, score_actions
+
+MAX_REPAIR_ROUNDS = 1000
+
+def index_dtype(number_of_agents: int) -> type:
+    ''' Smallest integer type that can index number_of_agents agents. '''
+    return np.int32 if number_of_agents < np.iinfo(np.int32).max else np.int64
+
+def edge_keys(sources: np.ndarray, targets: np.ndarray, number_of_agents: int) -> np.ndarray:
+    ''' One integer per undirected edge, the same for (u, v) and (v, u). '''
+    return np.minimum(sources, targets).astype(np.int64) * number_of_agents + np.maximum(sources, targets)
+
+def duplicate_keys(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Marks every edge key that repeats an earlier
+    one (in array order) as True. Also returns
+    the keys sorted, for membership tests.
+    '''
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    duplicates = np.zeros(keys.shape[0], dtype=bool)
+    duplicates[order[1:]] = sorted_keys[1:] == sorted_keys[:-1]
+    return duplicates, sorted_keys
+
+def contains(sorted_keys: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    ''' Whether each key is in sorted_keys, in O(log E) per key. '''
+    positions = np.minimum(np.searchsorted(sorted_keys, keys), sorted_keys.shape[0] - 1)
+    return sorted_keys[positions] == keys
+
+@dataclass
+class InteractionGraph:
+    '''
+    Who plays against whom, as CSR adjacency arrays:
+    the neighbours of agent i are
+    indices[indptr[i]:indptr[i + 1]]. Memory is
+    O(N + E), so million-agent populations with a
+    bounded degree fit on one machine.
+
+    Build one with from_edges or from_csr for a
+    user-supplied graph (scipy.sparse matrices can be
+    passed as from_csr(m.indptr, m.indices)), or with
+    the lattice, random_regular and small_world
+    generators, which draw from the current RandomStream.
+    '''
+    indptr: np.ndarray   # (N + 1,) start of each agent's neighbours in indices
+    indices: np.ndarray  # (E,) neighbours of every agent, one row after the other
+
+    @classmethod
+    def from_csr(cls, indptr, indices) -> 'InteractionGraph':
+        ''' Validates and wraps existing CSR adjacency arrays. '''
+        indptr = np.asarray(indptr, dtype=np.int64)
+        number_of_agents = indptr.shape[0] - 1
+        indices = np.asarray(indices, dtype=index_dtype(number_of_agents))
+
+        if number_of_agents < 0 or indptr[0] != 0 or indptr[-1] != indices.shape[0] or np.any(np.diff(indptr) < 0):
+            raise ValueError("indptr must start at 0, never decrease and end at the number of edges.")
+        if indices.size and (indices.min() < 0 or indices.max() >= number_of_agents):
+            raise ValueError(f"Neighbour indices must lie in [0, {number_of_agents}).")
+
+        return cls(indptr=indptr, indices=indices)
+
+    @classmethod
+    def from_edges(cls, number_of_agents: int, sources, targets, directed: bool = False) -> 'InteractionGraph':
+        '''
+        Builds a graph from edge lists. Undirected edges
+        make both ends neighbours of each other. Self-loops
+        and repeated edges are dropped.
+
+        Args:
+            number_of_agents: int == Number of agents (nodes)
+            sources: array-like == First end of every edge
+            targets: array-like == Second end of every edge
+            directed: bool == Whether an edge only makes targets neighbours of sources
+        '''
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        if sources.shape != targets.shape:
+            raise ValueError(f"Got {sources.shape[0]} sources but {targets.shape[0]} targets.")
+        if sources.size and (min(sources.min(), targets.min()) < 0 or max(sources.max(), targets.max()) >= number_of_agents):
+            raise ValueError(f"Edge ends must lie in [0, {number_of_agents}).")
+
+        if not directed:
+            sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+
+        # Sorting the edge keys orders them row by row, as CSR needs, and finds repeats
+        keys = np.sort(sources[sources != targets] * number_of_agents + targets[sources != targets])
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+        indptr = np.zeros(number_of_agents + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // number_of_agents, minlength=number_of_agents), out=indptr[1:])
+
+        return cls(indptr=indptr, indices=(keys % number_of_agents).astype(index_dtype(number_of_agents)))
+
+    @classmethod
+    def lattice(cls, shape: Sequence[int], periodic: bool = True) -> 'InteractionGraph':
+        '''
+        A d-dimensional square lattice in which every
+        agent neighbours the agents one step away along
+        each axis (2d neighbours when periodic). Agents
+        are numbered in row-major order.
+
+        Args:
+            shape: Sequence[int] == Number of agents along each axis
+            periodic: bool == Whether the lattice wraps around its edges
+        '''
+        agents = np.arange(int(np.prod(shape))).reshape(shape)
+        sources = []
+        targets = []
+
+        for axis in range(agents.ndim):
+            if periodic:
+                sources.append(agents.ravel())
+                targets.append(np.roll(agents, -1, axis=axis).ravel())
+            else:
+                lower = [slice(None)] * agents.ndim
+                upper = [slice(None)] * agents.ndim
+                lower[axis] = slice(None, -1)
+                upper[axis] = slice(1, None)
+                sources.append(agents[tuple(lower)].ravel())
+                targets.append(agents[tuple(upper)].ravel())
+
+        return cls.from_edges(agents.size, np.concatenate(sources), np.concatenate(targets))
+
+    @classmethod
+    def ring(cls, number_of_agents: int, degree: int) -> 'InteractionGraph':
+        ''' A ring in which every agent neighbours the degree // 2 nearest agents on each side. '''
+        sources, targets = ring_edges(number_of_agents, degree)
+        return cls.from_edges(number_of_agents, sources, targets)
+
+    @classmethod
+    def random_regular(cls, number_of_agents: int, degree: int) -> 'InteractionGraph':
+        '''
+        A uniformly wired graph in which every agent has
+        exactly `degree` neighbours. Stubs are paired at
+        random (the configuration model), then self-loops
+        and repeated edges are removed by switching them
+        with random other edges, which keeps every degree.
+        '''
+        if degree >= number_of_agents or number_of_agents * degree % 2:
+            raise ValueError(f"No {degree}-regular graph on {number_of_agents} agents.")
+
+        random_stream = get_random_stream()
+        stubs = np.repeat(np.arange(number_of_agents, dtype=np.int64), degree)
+        stubs = stubs[np.argsort(random_stream.random_array(stubs.shape[0]))]
+        sources, targets = stubs[0::2], stubs[1::2]
+
+        for _ in range(MAX_REPAIR_ROUNDS):
+            duplicates, sorted_keys = duplicate_keys(edge_keys(sources, targets, number_of_agents))
+            bad = (sources == targets) | duplicates
+            bad_edges = np.flatnonzero(bad)
+            if bad_edges.shape[0] == 0:
+                return cls.from_edges(number_of_agents, sources, targets)
+
+            # Pair each bad edge (u, v) with a distinct good edge (x, y), taken in a random direction
+            partners = random_stream.integers_array(sources.shape[0], bad_edges.shape[0])
+            partners, first = np.unique(partners, return_index=True)
+            usable = ~bad[partners]
+            bad_edges, partners = bad_edges[first][usable], partners[usable]
+            flip = random_stream.random_array(partners.shape[0]) < 0.5
+            x = np.where(flip, targets[partners], sources[partners])
+            y = np.where(flip, sources[partners], targets[partners])
+            u, v = sources[bad_edges], targets[bad_edges]
+
+            # Switch them to (u, x), (v, y) only where both are simple edges not in the graph yet
+            first_keys = edge_keys(u, x, number_of_agents)
+            second_keys = edge_keys(v, y, number_of_agents)
+            switch = (u != x) & (v != y) & (first_keys != second_keys)
+            switch &= ~contains(sorted_keys, first_keys) & ~contains(sorted_keys, second_keys)
+
+            # Nor may two switches add the same edge
+            number_of_switches = int(switch.sum())
+            repeated, _ = duplicate_keys(np.concatenate([first_keys[switch], second_keys[switch]]))
+            switch[switch] = ~(repeated[:number_of_switches] | repeated[number_of_switches:])
+
+            targets[bad_edges[switch]] = x[switch]
+            sources[partners[switch]] = v[switch]
+            targets[partners[switch]] = y[switch]
+
+        raise ValueError(f"Could not wire a simple {degree}-regular graph on {number_of_agents} agents.")
+
+    @classmethod
+    def small_world(cls, number_of_agents: int, degree: int, rewiring_probability: float) -> 'InteractionGraph':
+        '''
+        A Watts-Strogatz small-world graph: a ring of the
+        given degree in which every edge has its far end
+        rewired to a random agent with rewiring_probability.
+        Rewired ends that would make a self-loop or repeat
+        an edge are redrawn.
+        '''
+        sources, targets = ring_edges(number_of_agents, degree)
+        random_stream = get_random_stream()
+        rewired = random_stream.random_array(sources.shape[0]) < rewiring_probability
+        redraw = rewired
+
+        for _ in range(MAX_REPAIR_ROUNDS):
+            targets[redraw] = random_stream.integers_array(number_of_agents, int(redraw.sum()))
+
+            # Ring edges come first, so a repeat always marks the rewired edge
+            order = np.argsort(rewired, kind='stable')
+            redraw = np.zeros_like(rewired)
+            redraw[order] = duplicate_keys(edge_keys(sources[order], targets[order], number_of_agents))[0]
+            redraw |= sources == targets
+            if not redraw.any():
+                break
+
+        return cls.from_edges(number_of_agents, sources[~redraw], targets[~redraw])
+
+    @property
+    def number_of_agents(self) -> int:
+        return self.indptr.shape[0] - 1
+
+    @property
+    def number_of_edges(self) -> int:
+        ''' Number of (directed) neighbour entries, twice the undirected edges. '''
+        return self.indices.shape[0]
+
+    @property
+    def degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def neighbours(self, agent: int) -> np.ndarray:
+        return self.indices[self.indptr[agent]:self.indptr[agent + 1]]
+
+    def check_size(self, number_of_agents: int) -> None:
+        if self.number_of_agents != number_of_agents:
+            raise ValueError(f"Interaction graph of {self.number_of_agents} agents, not {number_of_agents}.")
+
+def ring_edges(number_of_agents: int, degree: int):
+    ''' Edges (i, i + j) of a ring, for j up to degree // 2. '''
+    if degree % 2 or degree >= number_of_agents:
+        raise ValueError(f"A ring of {number_of_agents} agents needs an even degree below {number_of_agents}.")
+
+    agents = np.arange(number_of_agents, dtype=np.int64)
+    sources = np.tile(agents, degree // 2)
+    targets = (sources + np.repeat(np.arange(1, degree // 2 + 1), number_of_agents)) % number_of_agents
+    return sources, targets
+
+def score_neighbours(graph: InteractionGraph, actions, number_of_choices: int = NUM_OF_CHOICES) -> np.ndarray:
+    '''
+    Scores a round of the mod game on an interaction
+    graph: each agent gets a point for every neighbour
+    that chose the choice right below its own. Works
+    per edge and sums each agent's edges with a prefix
+    sum, so a round costs O(N + E). Leading axes of
+    actions are independent games (replicates).
+    '''
+    actions = np.asarray(actions)
+    lower_choices = np.repeat((actions - 1) % number_of_choices, graph.degrees, axis=-1)
+    hits = actions[..., graph.indices] == lower_choices
+
+    # Segment sums of the hits of each agent's edges
+    hit_counts = np.zeros(actions.shape[:-1] + (graph.number_of_edges + 1,), dtype=np.int64)
+    np.cumsum(hits, axis=-1, out=hit_counts[..., 1:])
+    return hit_counts[..., graph.indptr[1:]] - hit_counts[..., graph.indptr[:-1]]
+
+def score_round(
+        actions,
+        number_of_choices: int = NUM_OF_CHOICES,
+        interaction_graph: Optional[InteractionGraph] = None
+    ) -> np.ndarray:
+    ''' Scores a round against every agent, or only against neighbours given an interaction graph. '''
+    if interaction_graph is None:
+        return score_actions(actions, number_of_choices)
+    return score_neighbours(interaction_graph, actions, number_of_choices)
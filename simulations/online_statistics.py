@@ -0,0 +1,237 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+NUMBER_OF_LEVELS = 3
+
+class RunningStatistics:
+    '''
+    Mergeable running count, mean and sum of squared
+    deviations (Welford updates, combined with Chan's
+    parallel formula). All three are arrays of the same
+    shape, so one instance can track several independent
+    series (e.g. one per replicate) at once.
+    '''
+    def __init__(self, shape: Tuple[int, ...] = ()) -> None:
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    @classmethod
+    def from_moments(cls, count, mean, std) -> 'RunningStatistics':
+        ''' Builds the statistics of a group from its size, mean and (population) std. '''
+        statistics = cls(np.shape(mean))
+        statistics.count = np.asarray(count, dtype=float) + statistics.count
+        statistics.mean = np.asarray(mean, dtype=float) + statistics.mean
+        statistics.m2 = statistics.count * np.square(std)
+        return statistics
+
+    def update(self, values) -> None:
+        '''
+        Adds a batch of samples, laid out along
+        the last axis of values.
+        '''
+        values = np.asarray(values, dtype=float)
+        if values.shape[-1] == 0:
+            return
+
+        batch_mean = values.mean(axis=-1)
+        batch_m2 = np.square(values - batch_mean[..., np.newaxis]).sum(axis=-1)
+        self._combine(values.shape[-1], batch_mean, batch_m2)
+
+    def merge(self, other: 'RunningStatistics') -> 'RunningStatistics':
+        ''' Returns the statistics of both sample sets combined. '''
+        merged = RunningStatistics()
+        merged.count, merged.mean, merged.m2 = self.count, self.mean, self.m2
+        merged._combine(other.count, other.mean, other.m2)
+        return merged
+
+    def reduce(self, axis: int = 0) -> 'RunningStatistics':
+        ''' Combines the independent series along an axis into one. '''
+        reduced = RunningStatistics()
+        reduced.count = self.count.sum(axis=axis)
+        total = np.where(reduced.count > 0, reduced.count, 1.0)
+        reduced.mean = (self.count * self.mean).sum(axis=axis) / total
+        deviation = self.mean - np.expand_dims(reduced.mean, axis)
+        reduced.m2 = self.m2.sum(axis=axis) + (self.count * np.square(deviation)).sum(axis=axis)
+        return reduced
+
+    def _combine(self, count, mean, m2) -> None:
+        total = self.count + count
+        safe_total = np.where(total > 0, total, 1.0)
+        delta = mean - self.mean
+
+        self.mean = self.mean + delta * count / safe_total
+        self.m2 = self.m2 + m2 + np.square(delta) * self.count * count / safe_total
+        self.count = total
+
+    @property
+    def variance(self) -> np.ndarray:
+        ''' Population variance, like utilities.get_std. '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.m2 / self.count
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.variance)
+
+def level_rows(kinds: np.ndarray, number_of_levels: int = NUMBER_OF_LEVELS) -> List[Union[slice, np.ndarray]]:
+    '''
+    Returns, for each ToM level, the rows of its
+    agents: a slice when they are contiguous (the
+    usual layout), an index array otherwise.
+    '''
+    rows = []
+    for level in range(number_of_levels):
+        indices = np.flatnonzero(kinds == level)
+        if indices.shape[0] == 0 or indices[-1] - indices[0] + 1 == indices.shape[0]:
+            start = indices[0] if indices.shape[0] else 0
+            rows.append(slice(start, start + indices.shape[0]))
+        else:
+            rows.append(indices)
+    return rows
+
+def merge_series(a: List[np.ndarray], b: List[np.ndarray]) -> List[np.ndarray]:
+    ''' Adds two per-epoch series element-wise, keeping the tail of the longer one. '''
+    common = min(len(a), len(b))
+    longer = a if len(a) > len(b) else b
+    return [x + y for x, y in zip(a[:common], b[:common])] + longer[common:]
+
+class ScoreStatistics:
+    '''
+    Streaming per ToM level statistics of the
+    score every agent gets in every round, plus
+    the per-epoch mean score of every level.
+
+    Statistics are per agent per round, so they
+    need no division by the number of epochs.
+    Accumulators from different replicates or
+    workers combine exactly with merge().
+
+    Args:
+        kinds: np.ndarray == ToM level of each agent
+        batch_shape: Tuple[int, ...] == Leading replicate axes of the scores
+        track_epochs: bool == Whether to keep the per-epoch mean series
+        number_of_levels: int == Number of ToM levels (kinds 0 to number_of_levels - 1)
+    '''
+    def __init__(
+        self,
+        kinds: np.ndarray,
+        batch_shape: Tuple[int, ...] = (),
+        track_epochs: bool = True,
+        number_of_levels: int = NUMBER_OF_LEVELS
+    ) -> None:
+        kinds = np.asarray(kinds)
+        self.rows = level_rows(kinds, number_of_levels)
+        self.level_sizes = np.array([np.count_nonzero(kinds == level) for level in range(number_of_levels)], dtype=float)
+        self.levels = [RunningStatistics(batch_shape) for _ in range(number_of_levels)]
+        self.track_epochs = track_epochs
+
+        # Scores of every agent and mean score per level of the last round
+        self.last_scores: Optional[np.ndarray] = None
+        self.last_means: Optional[np.ndarray] = None
+
+        # Per-epoch score totals per level, and the (number of epochs, weight)
+        # of every run they sum over. Each run adds weight times level_sizes
+        # agents to the epochs it covers; a length of None covers every epoch.
+        self._epoch_totals: List[np.ndarray] = []
+        self._epoch_runs: List[Tuple[Optional[int], float]] = [(None, 1.0)]
+
+    def update(self, round_scores) -> None:
+        ''' Adds one round of per agent scores. '''
+        round_scores = np.asarray(round_scores)
+        self.last_scores = round_scores
+        totals = []
+
+        for statistics, rows in zip(self.levels, self.rows):
+            level_scores = round_scores[..., rows]
+            statistics.update(level_scores)
+            totals.append(level_scores.sum(axis=-1))
+
+        level_totals = np.stack(totals, axis=-1).astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.last_means = level_totals / self.level_sizes
+
+        if self.track_epochs:
+            self._epoch_totals.append(level_totals)
+
+    def _finished_runs(self) -> List[Tuple[int, float]]:
+        ''' The runs of the epoch series, with open-ended ones cut at the current epoch. '''
+        number_of_epochs = len(self._epoch_totals)
+        return [
+            (number_of_epochs if length is None else length, weight)
+            for length, weight in self._epoch_runs
+        ]
+
+    def epoch_counts(self) -> np.ndarray:
+        ''' Number of agents each epoch's totals sum over, as an (epochs, levels) array. '''
+        runs = np.zeros(len(self._epoch_totals))
+        for length, weight in self._finished_runs():
+            runs[:length] += weight
+        return runs[:, np.newaxis] * self.level_sizes
+
+    def merge(self, other: 'ScoreStatistics') -> 'ScoreStatistics':
+        '''
+        Returns the statistics of both sets of
+        rounds combined. Epoch series are combined
+        epoch by epoch, so runs of different
+        lengths merge over their common epochs
+        and the longer run fills the rest.
+        '''
+        merged = ScoreStatistics.__new__(ScoreStatistics)
+        merged.rows = self.rows
+        merged.level_sizes = self.level_sizes
+        merged.levels = [a.merge(b) for a, b in zip(self.levels, other.levels)]
+        merged.track_epochs = self.track_epochs and other.track_epochs
+        merged._epoch_totals = merge_series(self._epoch_totals, other._epoch_totals)
+        merged._epoch_runs = self._finished_runs() + other._finished_runs()
+        return merged
+
+    def reduce(self, axis: int = 0) -> 'ScoreStatistics':
+        ''' Combines the replicates along a batch axis into one set of statistics. '''
+        reduced = ScoreStatistics.__new__(ScoreStatistics)
+        reduced.rows = self.rows
+        reduced.level_sizes = self.level_sizes
+        reduced.levels = [statistics.reduce(axis) for statistics in self.levels]
+        reduced.track_epochs = self.track_epochs
+        reduced._epoch_totals = [totals.sum(axis=axis) for totals in self._epoch_totals]
+        number_of_replicates = self.levels[0].count.shape[axis]
+        reduced._epoch_runs = [(length, weight * number_of_replicates) for length, weight in self._epoch_runs]
+        return reduced
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        ''' Returns the accumulators as arrays, levels along the first axis. '''
+        batch_shape = self.levels[0].count.shape
+        return {
+            'statistics_count': np.stack([statistics.count for statistics in self.levels]),
+            'statistics_mean': np.stack([statistics.mean for statistics in self.levels]),
+            'statistics_m2': np.stack([statistics.m2 for statistics in self.levels]),
+            'epoch_totals': np.stack(self._epoch_totals) if self._epoch_totals
+                else np.zeros((0,) + batch_shape + (len(self.levels),)),
+            'epoch_run_lengths': np.array([-1 if length is None else length for length, _ in self._epoch_runs]),
+            'epoch_run_weights': np.array([weight for _, weight in self._epoch_runs], dtype=float),
+        }
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        ''' Restores the accumulators from a state returned by get_state. '''
+        for level, statistics in enumerate(self.levels):
+            statistics.count = np.array(state['statistics_count'][level])
+            statistics.mean = np.array(state['statistics_mean'][level])
+            statistics.m2 = np.array(state['statistics_m2'][level])
+        self._epoch_totals = list(np.array(state['epoch_totals']))
+        self._epoch_runs = [
+            (None if length < 0 else int(length), float(weight))
+            for length, weight in zip(state['epoch_run_lengths'], state['epoch_run_weights'])
+        ]
+
+    @property
+    def epoch_means(self) -> np.ndarray:
+        ''' Mean score per level of every epoch, as an (epochs, [R,] levels) array. '''
+        if not self._epoch_totals:
+            return np.zeros((0, len(self.levels)))
+        totals = np.stack(self._epoch_totals)
+        counts = self.epoch_counts()
+        counts = counts.reshape(counts.shape[:1] + (1,) * (totals.ndim - counts.ndim) + counts.shape[1:])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return totals / counts
@@ -0,0 +1,338 @@
+import multiprocessing
+import os
+import weakref
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from agents.agent import EPS, LEARNING_SPEED
+from agents.beliefs import BeliefMatrix
+from utilities import AgentsConfiguration, NUM_OF_CHOICES, RandomStream, using_random_stream
+from simulations.vectorized_simulation import (
+    AgentPopulation,
+    VectorizedRegularSimulation,
+    population_decide,
+    population_state,
+    population_update,
+    restore_population
+)
+
+# Commands the main process hands the workers at the start of each step
+RUN_ROUND = 0
+STOP = 1
+
+# Arrays of population_state, in the order they are laid out in shared memory
+POPULATION_ARRAYS = (
+    'kinds',
+    'beliefs_values', 'beliefs_scale', 'beliefs_total', 'beliefs_best',
+    'nested_beliefs_values', 'nested_beliefs_scale', 'nested_beliefs_total', 'nested_beliefs_best',
+    'order_beliefs',
+)
+
+SharedArraySpec = Dict[str, Tuple[str, Tuple[int, ...], str]]
+
+class SharedArrays:
+    '''
+    Named NumPy arrays backed by multiprocessing
+    shared memory, one block per array. The process
+    that creates them owns (and unlinks) the blocks,
+    other processes attach to them by their spec.
+    '''
+    def __init__(self, spec: SharedArraySpec, blocks: List[shared_memory.SharedMemory], owner: bool) -> None:
+        self.spec = spec
+        self.owner = owner
+        self._blocks = blocks
+        self.arrays: Dict[str, np.ndarray] = {
+            name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            for (name, (_, shape, dtype)), block in zip(spec.items(), blocks)
+        }
+
+    @classmethod
+    def create(cls, arrays: Dict[str, np.ndarray]) -> 'SharedArrays':
+        ''' Allocates shared copies of arrays. '''
+        spec: SharedArraySpec = {}
+        blocks = []
+        for name, array in arrays.items():
+            # Zero-sized blocks are not allowed, so empty arrays get one spare byte
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            spec[name] = (block.name, array.shape, array.dtype.str)
+
+        shared_arrays = cls(spec, blocks, owner=True)
+        for name, array in arrays.items():
+            shared_arrays.arrays[name][...] = array
+        return shared_arrays
+
+    @classmethod
+    def attach(cls, spec: SharedArraySpec) -> 'SharedArrays':
+        ''' Attaches to arrays created in another process. '''
+        return cls(spec, [shared_memory.SharedMemory(name=block_name) for block_name, _, _ in spec.values()], owner=False)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def close(self) -> None:
+        self.arrays = {}
+        for block in self._blocks:
+            if self.owner:
+                block.unlink()
+            try:
+                block.close()
+            except BufferError:
+                # Views still exist, the mapping is released once they are gone
+                pass
+        self._blocks = []
+
+def shard_bounds(size: int, number_of_workers: int) -> List[Tuple[int, int]]:
+    ''' Splits rows [0, size) into number_of_workers contiguous, near-equal shards. '''
+    edges = [size * worker // number_of_workers for worker in range(number_of_workers + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+def shard_population(arrays: SharedArrays, start: int, stop: int) -> AgentPopulation:
+    '''
+    The rows [start, stop) of a population as views
+    of its shared arrays. Second-order agents come
+    last, so the shard's nested rows are the overlap
+    of [start, stop) with the second-order tail.
+    '''
+    size = arrays['kinds'].shape[0]
+    first_second_order = size - arrays['nested_beliefs_values'].shape[0]
+    nested_start = max(start, first_second_order) - first_second_order
+    nested_stop = max(stop, first_second_order) - first_second_order
+
+    def belief_rows(name: str, row_start: int, row_stop: int) -> BeliefMatrix:
+        return BeliefMatrix(
+            values=arrays[f"{name}_values"][row_start:row_stop],
+            scale=arrays[f"{name}_scale"][row_start:row_stop],
+            total=arrays[f"{name}_total"][row_start:row_stop],
+            best=arrays[f"{name}_best"][row_start:row_stop],
+        )
+
+    return AgentPopulation(
+        kinds=arrays['kinds'][start:stop],
+        beliefs=belief_rows('beliefs', start, stop),
+        nested_beliefs=belief_rows('nested_beliefs', nested_start, nested_stop),
+        order_beliefs=arrays['order_beliefs'][start:stop],
+    )
+
+def worker_random_stream(round_seed: int, worker: int) -> RandomStream:
+    '''
+    The random stream of a worker for one round,
+    seeded from a draw of the simulation's own stream,
+    so runs resume from checkpoints without any
+    worker state.
+    '''
+    return RandomStream(np.random.SeedSequence((round_seed, worker)))
+
+def run_worker(
+        spec: SharedArraySpec,
+        barrier,
+        worker: int,
+        start: int,
+        stop: int,
+        eps: float,
+        learning_speed: float
+    ) -> None:
+    '''
+    Worker process loop. Every round is a pipeline of
+    four barriers shared with the main process: start,
+    then the shard's decisions and choice histogram,
+    then its scores against the global histogram, then
+    its update. Nothing but the command is exchanged,
+    all state lives in the shared arrays.
+    '''
+    arrays = SharedArrays.attach(spec)
+    try:
+        population = shard_population(arrays, start, stop)
+        command = arrays['command']
+        counts = arrays['counts']
+        number_of_choices = counts.shape[1]
+        actions = arrays['actions'][start:stop]
+        round_scores = arrays['round_scores'][start:stop]
+        agent_scores = arrays['agent_scores'][start:stop]
+
+        while True:
+            barrier.wait()
+            if command[0] == STOP:
+                return
+
+            # Decide, then count the shard's choices
+            with using_random_stream(worker_random_stream(int(command[1]), worker)):
+                actions[:] = population_decide(population, eps)
+                counts[worker] = np.bincount(actions, minlength=number_of_choices)
+                barrier.wait()
+
+                # Score against every agent's choices
+                histogram = counts.sum(axis=0)
+                round_scores[:] = histogram[(actions - 1) % number_of_choices]
+                agent_scores += round_scores
+                barrier.wait()
+
+                population_update(population, actions, eps, learning_speed)
+                barrier.wait()
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        population = None
+        actions = round_scores = agent_scores = counts = command = None
+        arrays.close()
+
+def stop_workers(arrays: SharedArrays, barrier, processes: List) -> None:
+    ''' Stops the workers and frees the shared memory, at most once. '''
+    if not barrier.broken:
+        arrays['command'][0] = STOP
+        try:
+            barrier.wait()
+        except Exception:
+            pass
+    for process in processes:
+        process.join()
+    arrays.close()
+
+class ParallelRegularSimulation(VectorizedRegularSimulation):
+    '''
+    The vectorized simulation with its agents split
+    into contiguous shards across worker processes.
+    Population, choice and score arrays live in
+    multiprocessing shared memory, so nothing is
+    pickled per round: workers decide, score and
+    update their shard in place, synchronised by
+    barriers, with the global choice histogram
+    summed from per-worker counts. The main process
+    records the history and statistics while the
+    workers update.
+
+    Each worker draws from its own stream per round,
+    seeded from the simulation's random stream,
+    so results are reproducible for a given seed and
+    number_of_workers, but differ across worker counts.
+    Call close() (or use it as a context manager) to
+    stop the workers.
+
+    Args:
+        agent_config: AgentsConfiguration == The Agent Population Config
+        number_of_workers: Optional[int] == Worker processes, one per CPU if None
+        number_of_choices: int == Number of choices in the mod game
+        history_window: Optional[int] == Rounds of actions kept in memory,
+            None keeps all of them (only the last SPILLED_WINDOW with a history_path)
+        history_path: Optional[str] == File the full action history is spilled to
+        seed: Optional[int] == Seed of the simulation's random stream
+        eps: float == Exploration probability of every decision
+        learning_speed: float == Learning speed of every belief update
+        precision: str == Storage precision of the beliefs, see agents.beliefs.PRECISIONS
+        start_method: Optional[str] == multiprocessing start method of the workers
+    '''
+    def __init__(
+        self,
+        agent_config: AgentsConfiguration = AgentsConfiguration(5,5,5),
+        number_of_workers: Optional[int] = None,
+        number_of_choices: int = NUM_OF_CHOICES,
+        history_window: Optional[int] = None,
+        history_path: Optional[str] = None,
+        seed: Optional[int] = None,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED,
+        precision: str = 'float64',
+        start_method: Optional[str] = None
+    ):
+        super().__init__(
+            agent_config, number_of_choices, history_window, history_path, seed, eps, learning_speed,
+            precision=precision
+        )
+        size = self.population.size
+        self.number_of_workers = max(1, min(number_of_workers or os.cpu_count() or 1, size))
+
+        self.shared = SharedArrays.create({
+            **population_state(self.population),
+            'actions': np.zeros(size, dtype=np.int64),
+            'round_scores': np.zeros(size, dtype=np.int64),
+            'agent_scores': self.agent_scores,
+            'counts': np.zeros((self.number_of_workers, number_of_choices), dtype=np.int64),
+            'command': np.zeros(2, dtype=np.int64),
+        })
+        self.population = shard_population(self.shared, 0, size)
+        self.agent_scores = self.shared['agent_scores']
+
+        context = multiprocessing.get_context(start_method)
+        self.barrier = context.Barrier(self.number_of_workers + 1)
+        self.processes = [
+            context.Process(
+                target=run_worker,
+                args=(
+                    self.shared.spec, self.barrier, worker, start, stop, eps, learning_speed
+                ),
+                daemon=True,
+            )
+            for worker, (start, stop) in enumerate(shard_bounds(size, self.number_of_workers))
+        ]
+        for process in self.processes:
+            process.start()
+        self._finalizer = weakref.finalize(self, stop_workers, self.shared, self.barrier, self.processes)
+
+    def check_open(self) -> None:
+        ''' Raises a RuntimeError once the workers are stopped, as waiting on them would hang. '''
+        if not self._finalizer.alive:
+            raise RuntimeError("simulation is closed")
+
+    def simulate_round(self) -> None:
+        self.check_open()
+        command = self.shared['command']
+        command[0] = RUN_ROUND
+        command[1] = self.random_stream.integers_array(np.iinfo(np.int64).max, ())
+
+        # Have each worker decide on its agents' actions and count them
+        with self.phase('decide'):
+            self.barrier.wait()
+            self.barrier.wait()
+
+        # Score each agent by the number of agents that chose the action below its own
+        with self.phase('score'):
+            self.barrier.wait()
+
+        # Record the round while the workers update their agents' beliefs
+        with self.phase('record'):
+            self.agent_actions.record(self.shared['actions'])
+            self.statistics.update(self.shared['round_scores'])
+        with self.phase('update'):
+            self.barrier.wait()
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.check_open()
+        if state['beliefs_values'].shape != self.population.beliefs.values.shape:
+            raise ValueError(
+                f"Checkpoint beliefs of shape {state['beliefs_values'].shape}, "
+                f"not {self.population.beliefs.values.shape}."
+            )
+        if state['beliefs_values'].dtype != self.population.beliefs.values.dtype:
+            raise ValueError(
+                f"Checkpoint beliefs stored as {state['beliefs_values'].dtype}, "
+                f"not {self.population.beliefs.values.dtype}."
+            )
+
+        # Workers hold views of the shared arrays, so restore into them
+        for name in POPULATION_ARRAYS + ('agent_scores',):
+            self.shared[name][...] = state[name]
+        self.agent_actions.set_state(state)
+        self.statistics.set_state(state)
+
+    def close(self) -> None:
+        '''
+        Stops the workers and frees the shared memory,
+        keeping a private copy of the state so results
+        can still be read.
+        '''
+        if not self._finalizer.alive:
+            return
+        self.population = restore_population({
+            name: np.array(array) for name, array in population_state(self.population).items()
+        })
+        self.agent_scores = np.array(self.agent_scores)
+        self._finalizer()
+
+    def __enter__(self) -> 'ParallelRegularSimulation':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
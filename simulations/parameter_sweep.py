@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass
+from itertools import product
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+from agents.agent import EPS, LEARNING_SPEED
+from simulations.simulation import ENGINE_VERSION, Simulation
+from simulations.replicate_runner import derive_seeds, iter_pool, run_replicate
+from simulations.serialization import decode_payload, encode_payload, json_default, simulation_path
+from simulations.vectorized_simulation import VectorizedRegularSimulation
+from utilities import AgentsConfiguration, RegularSimulationResults, NUM_OF_CHOICES
+
+@dataclass(frozen=True)
+class SweepCell:
+    '''
+    Utility dataclass to store one
+    point of a parameter grid.
+    '''
+    agent_numbers: Tuple[int, int, int]
+    learning_speed: float = LEARNING_SPEED
+    eps: float = EPS
+    number_of_choices: int = NUM_OF_CHOICES
+
+    @property
+    def agent_config(self) -> AgentsConfiguration:
+        return AgentsConfiguration(*self.agent_numbers)
+
+    def simulation_kwargs(self) -> Dict[str, Any]:
+        ''' Keyword arguments of the simulation class for this cell. '''
+        return {
+            'learning_speed': self.learning_speed,
+            'eps': self.eps,
+            'number_of_choices': self.number_of_choices,
+        }
+
+def expand_grid(
+        agent_configs: Sequence[AgentsConfiguration],
+        learning_speeds: Sequence[float] = (LEARNING_SPEED,),
+        epsilons: Sequence[float] = (EPS,),
+        numbers_of_choices: Sequence[int] = (NUM_OF_CHOICES,)
+    ) -> List[SweepCell]:
+    ''' Returns every combination of the given parameter values. '''
+    return [
+        SweepCell(
+            agent_numbers=(
+                agent_config.zero_order_agent_number,
+                agent_config.first_order_agent_number,
+                agent_config.second_order_agent_number,
+            ),
+            learning_speed=learning_speed,
+            eps=eps,
+            number_of_choices=number_of_choices,
+        )
+        for agent_config, learning_speed, eps, number_of_choices
+        in product(agent_configs, learning_speeds, epsilons, numbers_of_choices)
+    ]
+
+def replicate_key(
+        cell: SweepCell,
+        epochs: int,
+        seed: int,
+        simulation_class: Type[Simulation]
+    ) -> Tuple[str, Dict[str, Any]]:
+    '''
+    Returns the cache key of one replicate, a hash of
+    everything that determines its results, together
+    with the hashed description itself. The engine
+    version is part of it, so results of older
+    dynamics are never served.
+    '''
+    description = {
+        'engine_version': ENGINE_VERSION,
+        'cell': asdict(cell),
+        'epochs': epochs,
+        'seed': seed,
+        'simulation': simulation_path(simulation_class),
+    }
+    encoded = json.dumps(description, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest(), description
+
+class ResultCache:
+    '''
+    Content-addressed on-disk store of replicate
+    results, one small JSON file per replicate.
+    Results are stored tagged with their dataclass
+    (see serialization.encode_payload), so any
+    simulation's results come back as they were.
+    Files are written atomically, so a crash never
+    leaves a partial entry behind.
+    '''
+    def __init__(self, directory: str = 'sweep_cache') -> None:
+        self.directory = directory
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            with open(self.path(key)) as file:
+                entry = json.load(file)
+        except FileNotFoundError:
+            return None
+
+        # Entries written before results were tagged are recomputed
+        results = decode_payload(entry['results'])
+        return None if isinstance(results, dict) else results
+
+    def put(self, key: str, results: Any, description: Dict[str, Any]) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {
+            'description': description,
+            'results': encode_payload(results),
+        }
+
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(entry, file, default=json_default)
+        os.replace(temporary_path, path)
+
+def pending_replicates(
+        cells: Sequence[SweepCell],
+        epochs: int,
+        seeds: Sequence[int],
+        simulation_class: Type[Simulation],
+        cache: ResultCache
+    ) -> Tuple[Dict[SweepCell, List[Optional[RegularSimulationResults]]], List[Tuple]]:
+    '''
+    Fills in the cached results of a sweep and lists
+    the replicates still to run, as (cell, replicate
+    index, seed, cache key, description) tuples.
+    '''
+    results: Dict[SweepCell, List[Optional[RegularSimulationResults]]] = {
+        cell: [None] * len(seeds) for cell in cells
+    }
+
+    pending = []
+    for cell in cells:
+        for index, seed in enumerate(seeds):
+            key, description = replicate_key(cell, epochs, seed, simulation_class)
+            cached_results = cache.get(key)
+            if cached_results is not None:
+                results[cell][index] = cached_results
+            else:
+                pending.append((cell, index, seed, key, description))
+
+    return results, pending
+
+def run_sweep(
+        cells: Sequence[SweepCell],
+        epochs: int = 1000,
+        number_of_replicates: int = 10,
+        master_seed: int = 0,
+        cache_directory: str = 'sweep_cache',
+        workers: Optional[int] = None,
+        simulation_class: Type[Simulation] = VectorizedRegularSimulation
+    ) -> Dict[SweepCell, List[RegularSimulationResults]]:
+    '''
+    Runs every replicate of every cell over a process
+    pool, skipping replicates already in the cache.
+    Each replicate is cached as soon as it finishes,
+    so rerunning a crashed or extended sweep (more
+    cells or more replicates) only computes what is new.
+
+    Args:
+        cells: Sequence[SweepCell] == Grid points, see expand_grid
+        epochs: int == Number of rounds per replicate
+        number_of_replicates: int == Replicates per cell
+        master_seed: int == Seed all replicate seeds are derived from
+        cache_directory: str == Directory of the result cache
+        workers: Optional[int] == Pool size, defaults to the CPU count.
+            With a single worker replicates run in this process.
+        simulation_class: Type[Simulation] == Simulation accepting the
+            SweepCell.simulation_kwargs arguments
+    '''
+    cache = ResultCache(cache_directory)
+    seeds = derive_seeds(master_seed, number_of_replicates)
+    results, pending = pending_replicates(cells, epochs, seeds, simulation_class, cache)
+
+    if not pending:
+        return results
+
+    arguments = [
+        (cell.agent_config, epochs, seed, simulation_class, cell.simulation_kwargs())
+        for cell, _, seed, _, _ in pending
+    ]
+    for pending_index, replicate_results in iter_pool(run_replicate, arguments, workers):
+        cell, index, _, key, description = pending[pending_index]
+        cache.put(key, replicate_results, description)
+        results[cell][index] = replicate_results
+
+    return results
@@ -0,0 +1,152 @@
+from dataclasses import asdict, dataclass, field, is_dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+import numpy as np
+
+from agents.beliefs import get_precision
+from utilities import AgentsConfiguration
+from simulations.simulation import Simulation
+from simulations.vectorized_simulation import VectorizedRegularSimulation
+
+# Reduced precisions, cheapest first
+REDUCED_PRECISIONS = ('uint16', 'float16', 'float32')
+DEFAULT_TOLERANCE = 0.05
+
+@dataclass
+class PrecisionReport:
+    '''
+    Utility dataclass to store how a run at a
+    reduced belief precision diverged from the
+    same seed at full (float64) precision.
+    '''
+    precision: str
+    valid: bool = False
+    max_divergence: float = 0.0  # Largest relative difference of a per-level result
+    divergences: Dict[str, float] = field(default_factory=dict)  # Per result field
+    first_divergent_epoch: Optional[int] = None  # First epoch an agent acted differently
+    action_agreement: float = 1.0  # Fraction of actions identical to the full precision run
+    state_bytes: int = 0
+    reference_state_bytes: int = 0
+
+def result_values(results: Any, prefix: str = '') -> Dict[str, float]:
+    ''' Flattens (lists of) results dataclasses into named numbers. '''
+    if isinstance(results, (list, tuple)):
+        values = {}
+        for index, item in enumerate(results):
+            values.update(result_values(item, f"{prefix}{index}."))
+        return values
+    if is_dataclass(results):
+        return result_values(asdict(results), prefix)
+    if isinstance(results, dict):
+        values = {}
+        for name, value in results.items():
+            values.update(result_values(value, f"{prefix}{name}."))
+        return values
+    return {prefix.rstrip('.'): float(results)}
+
+def result_divergences(reference_results: Any, results: Any) -> Dict[str, float]:
+    ''' Relative difference of every per-level result, 0 where both are nan. '''
+    reference_values = result_values(reference_results)
+    values = result_values(results)
+    divergences = {}
+    for name, reference_value in reference_values.items():
+        difference = abs(values[name] - reference_value)
+        # Empty levels have nan results in both runs
+        if np.isnan(difference):
+            difference = 0.0 if np.isnan(reference_value) and np.isnan(values[name]) else np.inf
+        divergences[name] = difference / abs(reference_value) if reference_value else difference
+    return divergences
+
+def state_bytes(simulation: Simulation) -> int:
+    ''' Bytes of the arrays making up a simulation's state. '''
+    return sum(np.asarray(array).nbytes for array in simulation.get_state().values())
+
+def close_simulation(simulation: Simulation) -> None:
+    ''' Stops the workers of simulations that have them. '''
+    close = getattr(simulation, 'close', None)
+    if close is not None:
+        close()
+
+def validate_precision(
+        precision: str,
+        simulation_class: Type[Simulation] = VectorizedRegularSimulation,
+        agent_config: Any = AgentsConfiguration(100, 100, 100),
+        number_of_epochs: int = 200,
+        seed: int = 0,
+        tolerance: float = DEFAULT_TOLERANCE,
+        **simulation_kwargs
+    ) -> PrecisionReport:
+    '''
+    Runs the same seed at full and at the given belief
+    precision side by side and reports where they
+    diverge. Both runs draw the same random numbers, so
+    any difference comes from the stored beliefs.
+    The precision is valid if no per-level result
+    differs by more than `tolerance` (relative).
+
+    Args:
+        precision: str == Reduced precision to validate
+        simulation_class: Type[Simulation] == Array simulation taking a precision
+        agent_config: Any == The Agent Population Config
+        number_of_epochs: int == Rounds to run
+        seed: int == Seed of both runs
+        tolerance: float == Largest relative divergence of a valid precision
+        simulation_kwargs: Any == Other arguments of simulation_class
+    '''
+    get_precision(precision)
+    reference = simulation_class(agent_config, seed=seed, history_window=1, **simulation_kwargs)
+    reduced = simulation_class(agent_config, seed=seed, history_window=1, precision=precision, **simulation_kwargs)
+    report = PrecisionReport(precision, state_bytes=state_bytes(reduced), reference_state_bytes=state_bytes(reference))
+
+    try:
+        matching_actions = 0
+        number_of_actions = 0
+        for _ in range(number_of_epochs):
+            reference.run(1)
+            reduced.run(1)
+
+            reference_actions = reference.agent_actions.recent()[-1]
+            matches = np.count_nonzero(reduced.agent_actions.recent()[-1] == reference_actions)
+            if matches < reference_actions.size and report.first_divergent_epoch is None:
+                report.first_divergent_epoch = reference.epoch
+            matching_actions += matches
+            number_of_actions += reference_actions.size
+
+        report.divergences = result_divergences(reference.get_results(), reduced.get_results())
+    finally:
+        close_simulation(reference)
+        close_simulation(reduced)
+
+    report.action_agreement = matching_actions / max(number_of_actions, 1)
+    report.max_divergence = max(report.divergences.values(), default=0.0)
+    report.valid = report.max_divergence <= tolerance
+    return report
+
+def choose_precision(
+        precisions: Sequence[str] = REDUCED_PRECISIONS,
+        **validation_kwargs
+    ) -> Tuple[str, List[PrecisionReport]]:
+    '''
+    Validates precisions from the cheapest up and
+    returns the first valid one (float64 if none
+    is) with the reports of those it validated.
+    Takes the arguments of validate_precision.
+    '''
+    reports = []
+    for precision in precisions:
+        report = validate_precision(precision, **validation_kwargs)
+        reports.append(report)
+        if report.valid:
+            return precision, reports
+    return 'float64', reports
+
+def display_precision_reports(reports: List[PrecisionReport]) -> None:
+    print("Printing precision validation ...")
+    for report in reports:
+        print(
+            f"{report.precision}: {'valid' if report.valid else 'invalid'}, "
+            f"max divergence {report.max_divergence:.2%}, "
+            f"action agreement {report.action_agreement:.2%}, "
+            f"first divergent epoch {report.first_divergent_epoch}, "
+            f"state {report.state_bytes / max(report.reference_state_bytes, 1):.0%} of float64"
+        )
@@ -0,0 +1,328 @@
+'''
+Streams every round of a run to a compressed,
+columnar log and reads it back. A log is a directory
+with one append-only file of zlib-compressed chunks
+per column (choices, scores and level_means) and a
+JSON file describing the run, so
+
+    python -m simulations.recorder LOG [--epoch EPOCH]
+
+can summarise a log and rebuild the simulation at
+any epoch from its seed, checking it against the log.
+'''
+import argparse
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from simulations.simulation import Simulation
+from simulations.serialization import decode_payload, encode_payload, resolve_simulation, simulation_path
+
+LOG_VERSION = 1
+METADATA_FILE = 'log.json'
+CHUNK_HEADER = struct.Struct('<QII')  # First epoch, rounds and compressed bytes of a chunk
+CHUNK_ROUNDS = 256
+QUEUE_CHUNKS = 8
+COMPRESSION_LEVEL = 1
+COLUMNS = ('choices', 'scores', 'level_means')
+
+def column_path(path: str, column: str) -> str:
+    return os.path.join(path, f"{column}.chunks")
+
+class StreamRecorder:
+    '''
+    Records the choices, scores and per-level mean
+    scores of every round of a simulation to a log
+    directory, as an observer of the simulation.
+
+    The simulation loop only copies each round into
+    the current chunk. Full chunks go through a
+    bounded queue to a writer thread that compresses
+    and writes them, so the loop only waits if the
+    writer falls queue_chunks chunks behind. Memory
+    use is bounded by queue_chunks + 1 chunks whatever
+    the run length, so the simulation's own
+    ActionHistory can keep a window of 1.
+
+    Logs can be replayed (see replay) when the
+    simulation was created with a seed and the
+    given JSON simulation_kwargs.
+
+    Args:
+        path: str == Log directory, created if needed
+        simulation: Simulation == Simulation with agent_actions and statistics
+        seed: Optional[int] == Seed the simulation was created with
+        simulation_kwargs: Optional[Dict[str, Any]] == Other arguments it was created with
+        chunk_rounds: int == Rounds per compressed chunk
+        queue_chunks: int == Full chunks that may wait for the writer
+        compression_level: int == zlib compression level
+    '''
+    def __init__(
+        self,
+        path: str,
+        simulation: Simulation,
+        seed: Optional[int] = None,
+        simulation_kwargs: Optional[Dict[str, Any]] = None,
+        chunk_rounds: int = CHUNK_ROUNDS,
+        queue_chunks: int = QUEUE_CHUNKS,
+        compression_level: int = COMPRESSION_LEVEL
+    ) -> None:
+        if not hasattr(simulation, 'agent_actions') or not hasattr(simulation, 'statistics'):
+            raise ValueError(f"{type(simulation).__name__} keeps no action history and score statistics to record.")
+        self.path = path
+        self.simulation = simulation
+        self.chunk_rounds = chunk_rounds
+        self.compression_level = compression_level
+        self.metadata = {
+            'version': LOG_VERSION,
+            'simulation': simulation_path(type(simulation)),
+            'agent_config': encode_payload(simulation.agent_config),
+            'seed': seed,
+            'simulation_kwargs': simulation_kwargs or {},
+            'first_epoch': simulation.epoch,
+            'chunk_rounds': chunk_rounds,
+        }
+
+        os.makedirs(path, exist_ok=True)
+        self._files = {column: open(column_path(path, column), 'wb') for column in COLUMNS}
+        self._buffers: Optional[Dict[str, np.ndarray]] = None
+        self._first_epoch = simulation.epoch
+        self._filled = 0
+        self._error: Optional[BaseException] = None
+        self._queue: 'queue.Queue[Optional[Tuple[int, Dict[str, np.ndarray]]]]' = queue.Queue(queue_chunks)
+        self._writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self._writer.start()
+        simulation.add_observer(self.observe)
+
+    def observe(self, simulation: Simulation) -> None:
+        ''' Copies the round just played into the current chunk. '''
+        if self._error is not None:
+            raise RuntimeError(f"Writing the log at {self.path} failed.") from self._error
+
+        row = {
+            'choices': simulation.agent_actions.last_round,
+            'scores': simulation.statistics.last_scores,
+            'level_means': simulation.statistics.last_means,
+        }
+        if self._buffers is None:
+            self._start_log(row)
+        for column, values in row.items():
+            self._buffers[column][self._filled] = values
+
+        self._filled += 1
+        if self._filled == self.chunk_rounds:
+            self._flush_chunk()
+
+    def _start_log(self, row: Dict[str, np.ndarray]) -> None:
+        ''' Fixes the column types from the first round and writes the log description. '''
+        choices = np.asarray(row['choices'])
+        self.metadata['columns'] = {
+            'choices': {'dtype': choices.dtype.str, 'shape': list(choices.shape)},
+            # A round scores at most one point per other agent
+            'scores': {'dtype': np.min_scalar_type(choices.shape[-1]).str, 'shape': list(np.shape(row['scores']))},
+            'level_means': {'dtype': np.dtype(np.float64).str, 'shape': list(np.shape(row['level_means']))},
+        }
+        with open(os.path.join(self.path, METADATA_FILE), 'w') as file:
+            json.dump(self.metadata, file)
+        self._buffers = self._new_buffers()
+
+    def _new_buffers(self) -> Dict[str, np.ndarray]:
+        return {
+            column: np.empty((self.chunk_rounds,) + tuple(spec['shape']), dtype=np.dtype(spec['dtype']))
+            for column, spec in self.metadata['columns'].items()
+        }
+
+    def _flush_chunk(self) -> None:
+        ''' Hands the filled rounds to the writer and starts a new chunk. '''
+        if self._filled == 0:
+            return
+        chunk = {column: buffer[:self._filled] for column, buffer in self._buffers.items()}
+        self._queue.put((self._first_epoch, chunk))
+        self._first_epoch += self._filled
+        self._filled = 0
+        self._buffers = self._new_buffers()
+
+    def _write_chunks(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            # After a failure keep draining the queue, so the simulation never blocks on it
+            if self._error is not None:
+                continue
+            first_epoch, chunk = item
+            try:
+                for column, values in chunk.items():
+                    data = zlib.compress(values.tobytes(), self.compression_level)
+                    self._files[column].write(CHUNK_HEADER.pack(first_epoch, values.shape[0], len(data)))
+                    self._files[column].write(data)
+            except BaseException as error:
+                self._error = error
+
+    def close(self) -> None:
+        ''' Writes the last partial chunk, stops the writer and stops observing. '''
+        if self._writer.is_alive():
+            if self._buffers is not None:
+                self._flush_chunk()
+            self._queue.put(None)
+            self._writer.join()
+            for file in self._files.values():
+                file.close()
+            self.simulation.observers = [
+                (every, observer) for every, observer in self.simulation.observers if observer != self.observe
+            ]
+        if self._error is not None:
+            raise RuntimeError(f"Writing the log at {self.path} failed.") from self._error
+
+    def __enter__(self) -> 'StreamRecorder':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+class LogReader:
+    '''
+    Lazy reader of a log written by StreamRecorder.
+    Opening a log only reads the chunk headers; reads
+    decompress just the chunks overlapping the epochs
+    asked for. Epochs are numbered like
+    Simulation.epoch before the round was played.
+    A log cut short by a crash reads up to its last
+    complete chunk.
+    '''
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE)) as file:
+            self.metadata = json.load(file)
+        self.columns: Dict[str, Dict[str, Any]] = self.metadata['columns']
+        # Per column (first epoch, rounds, offset, compressed bytes) of every chunk
+        self.chunks: Dict[str, List[Tuple[int, int, int, int]]] = {
+            column: self._scan(column) for column in self.columns
+        }
+        self._cache: Dict[str, Tuple[int, np.ndarray]] = {}
+
+    def _scan(self, column: str) -> List[Tuple[int, int, int, int]]:
+        chunks = []
+        size = os.path.getsize(column_path(self.path, column))
+        with open(column_path(self.path, column), 'rb') as file:
+            offset = 0
+            while offset + CHUNK_HEADER.size <= size:
+                first_epoch, rounds, nbytes = CHUNK_HEADER.unpack(file.read(CHUNK_HEADER.size))
+                offset += CHUNK_HEADER.size
+                if offset + nbytes > size:
+                    break
+                chunks.append((first_epoch, rounds, offset, nbytes))
+                offset += nbytes
+                file.seek(offset)
+        return chunks
+
+    @property
+    def first_epoch(self) -> int:
+        return self.metadata['first_epoch']
+
+    @property
+    def number_of_rounds(self) -> int:
+        ''' Complete rounds of every column. '''
+        return min(sum(chunk[1] for chunk in chunks) for chunks in self.chunks.values())
+
+    @property
+    def agent_config(self) -> Any:
+        return decode_payload(self.metadata['agent_config'])
+
+    def chunk(self, column: str, index: int) -> np.ndarray:
+        ''' Decompresses one chunk of a column, keeping the last one read per column. '''
+        cached_index, values = self._cache.get(column, (None, None))
+        if cached_index != index:
+            _, rounds, offset, nbytes = self.chunks[column][index]
+            with open(column_path(self.path, column), 'rb') as file:
+                file.seek(offset)
+                data = zlib.decompress(file.read(nbytes))
+            spec = self.columns[column]
+            values = np.frombuffer(data, dtype=np.dtype(spec['dtype'])).reshape((rounds,) + tuple(spec['shape']))
+            self._cache[column] = (index, values)
+        return values
+
+    def read(self, column: str, start: Optional[int] = None, stop: Optional[int] = None) -> np.ndarray:
+        ''' Rounds [start, stop) of a column, all of them by default. '''
+        last_epoch = self.first_epoch + self.number_of_rounds
+        start = self.first_epoch if start is None else max(start, self.first_epoch)
+        stop = last_epoch if stop is None else min(stop, last_epoch)
+
+        parts = []
+        for index, (first_epoch, rounds, _, _) in enumerate(self.chunks[column]):
+            if first_epoch < stop and first_epoch + rounds > start:
+                values = self.chunk(column, index)
+                parts.append(values[max(start - first_epoch, 0):stop - first_epoch])
+
+        spec = self.columns[column]
+        if not parts:
+            return np.zeros((0,) + tuple(spec['shape']), dtype=np.dtype(spec['dtype']))
+        return np.concatenate(parts)
+
+    def iter_rounds(self, column: str) -> Iterator[Tuple[int, np.ndarray]]:
+        ''' Yields (epoch, values) for every round, one chunk in memory at a time. '''
+        for index, (first_epoch, rounds, _, _) in enumerate(self.chunks[column]):
+            values = self.chunk(column, index)
+            for offset in range(min(rounds, self.first_epoch + self.number_of_rounds - first_epoch)):
+                yield first_epoch + offset, values[offset]
+
+def replay(path: str, epoch: Optional[int] = None, checkpoint_path: Optional[str] = None) -> Simulation:
+    '''
+    Rebuilds the simulation of a log at the start of
+    epoch (the end of the log by default) by running
+    it again from its seed, or from a checkpoint saved
+    at the log's first epoch, and checks every round
+    against the logged choices and scores.
+    '''
+    log = LogReader(path)
+    metadata = log.metadata
+    last_epoch = log.first_epoch + log.number_of_rounds
+    epoch = last_epoch if epoch is None else epoch
+    if not log.first_epoch <= epoch <= last_epoch:
+        raise ValueError(f"The log holds epochs {log.first_epoch} to {last_epoch}, not {epoch}.")
+    if metadata['seed'] is None:
+        raise ValueError("The log of an unseeded simulation cannot be replayed.")
+
+    simulation = resolve_simulation(metadata['simulation'])(
+        agent_config=log.agent_config, seed=metadata['seed'], **metadata['simulation_kwargs']
+    )
+    if checkpoint_path is not None:
+        simulation.load_checkpoint(checkpoint_path)
+    if simulation.epoch != log.first_epoch:
+        raise ValueError(
+            f"The log starts at epoch {log.first_epoch}, pass a checkpoint saved at that epoch."
+        )
+
+    for (logged_epoch, choices), (_, scores) in zip(log.iter_rounds('choices'), log.iter_rounds('scores')):
+        if logged_epoch == epoch:
+            break
+        simulation.run(1)
+        if not (np.array_equal(simulation.agent_actions.last_round, choices)
+                and np.array_equal(simulation.statistics.last_scores, scores)):
+            raise ValueError(f"Replay diverged from the log at epoch {logged_epoch}.")
+
+    return simulation
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarises a simulation log and replays it up to an epoch.")
+    parser.add_argument('path')
+    parser.add_argument('--epoch', type=int, help="Epoch to rebuild the simulation at, replaying is skipped if not given")
+    parser.add_argument('--checkpoint', help="Checkpoint saved at the log's first epoch")
+    arguments = parser.parse_args()
+
+    log = LogReader(arguments.path)
+    level_means = log.read('level_means')
+    print(f"{log.metadata['simulation']} {log.agent_config}, seed {log.metadata['seed']}")
+    print(f"Epochs {log.first_epoch} to {log.first_epoch + log.number_of_rounds}")
+    with np.errstate(invalid='ignore'):
+        print(f"Mean score per level and round: {np.nanmean(level_means, axis=0) if level_means.size else []}")
+
+    if arguments.epoch is not None:
+        simulation = replay(arguments.path, arguments.epoch, arguments.checkpoint)
+        print(f"Replayed to epoch {simulation.epoch}, matching the log.")
@@ -1,105 +1,328 @@
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
 
 from agents.regular_agents import (
     ZeroOrderTheoryOfMindAgent, 
     FirstOrderTheoryOfMindAgent, 
     SecondOrderTheoryOfMindAgent
 )
-from agents.agent import TheoryOfMindAgent
-from utilities import AgentsConfiguration, RegularSimulationResults, get_mean, get_std
-from simulations.simulation import Simulation
+from agents.agent import TheoryOfMindAgent, EPS, LEARNING_SPEED
+from agents.beliefs import BeliefMatrix, BeliefVector
+from utilities import (
+    AgentsConfiguration,
+    RegularSimulationResults,
+    NUM_OF_CHOICES,
+    generate_beliefs,
+    generate_agent_beliefs,
+    using_random_stream
+)
+from simulations.simulation import Simulation, SupportsCheckpoints, SupportsConvergence
+from simulations.action_history import ActionHistory
+from simulations.backends import SimulationBackend, get_backend, register_backend
+from simulations.interaction_graph import InteractionGraph
+from simulations.online_statistics import ScoreStatistics
+
+def create_zero_order_agent() -> ZeroOrderTheoryOfMindAgent:
+    '''
+    Creates a single zero-order agent with its own
+    freshly drawn beliefs and intentions. Populations
+    are drawn in bulk with create_zero_order_agents.
+    '''
+    return ZeroOrderTheoryOfMindAgent(beliefs=generate_beliefs(), intentions=generate_beliefs())
         
-def create_agents(agent_config: AgentsConfiguration = AgentsConfiguration(10, 10, 10)) -> List[TheoryOfMindAgent]:
+def create_zero_order_agents(beliefs: np.ndarray, intentions: np.ndarray) -> List[ZeroOrderTheoryOfMindAgent]:
+    '''
+    Creates one zero-order agent per row of beliefs
+    and intentions. Beliefs change every round, so
+    each agent gets its own list of them; intentions
+    never do, so agents share one compact array of
+    them and hold a view of their own row.
+    '''
+    intentions = np.array(intentions)
+    return [
+        ZeroOrderTheoryOfMindAgent(beliefs=agent_beliefs, intentions=agent_intentions)
+        for agent_beliefs, agent_intentions in zip(beliefs.tolist(), intentions)
+    ]
+
+def create_agents(
+        agent_config: AgentsConfiguration = AgentsConfiguration(10, 10, 10),
+        number_of_choices: int = NUM_OF_CHOICES
+    ) -> List[TheoryOfMindAgent]:
     ''' 
     Creates a set population of agents based on 
     an AgentsConfiguration instance.
 
+    The initial beliefs of every agent are drawn at
+    once, laid out as if each agent drew its own in
+    turn, so populations equal those built agent by agent.
+
     Args:
         agent_config: AgentsConfiguration == The Agent Population Config
+        number_of_choices: int == Number of choices in the mod game
     '''
     # Extract agent numbers
     number_0 = agent_config.zero_order_agent_number
     number_1 = agent_config.first_order_agent_number
     number_2 = agent_config.second_order_agent_number
+    choices = (number_of_choices,)
 
-    # Create a list of zero-order agents
-    zero_order_agents = [ZeroOrderTheoryOfMindAgent() for _ in range(number_0)]
+    # Zero-order agents, then the zero-order models of the first-order agents
+    beliefs, intentions = generate_agent_beliefs(number_0 + number_1, [choices, choices])
+    zero_order_agents = create_zero_order_agents(beliefs, intentions)
 
     # Create a list of first-order agents, each with a reference to a zero-order agent
-    first_order_agents = [FirstOrderTheoryOfMindAgent() for _ in range(number_1)]
+    first_order_agents = [
+        FirstOrderTheoryOfMindAgent(lower_order_agent=zero_order_agent)
+        for zero_order_agent in zero_order_agents[number_0:]
+    ]
 
     # Create a list of second-order agents, each with a reference to a zero and first-order agent
-    second_order_agents = [SecondOrderTheoryOfMindAgent() for _ in range(number_2)]
+    zero_beliefs, zero_intentions, first_beliefs, first_intentions, order_beliefs = generate_agent_beliefs(
+        number_2, [choices, choices, choices, choices, (2,)]
+    )
+    second_order_agents = [
+        SecondOrderTheoryOfMindAgent(
+            zero_order_agent=zero_order_agent,
+            first_order_agent=FirstOrderTheoryOfMindAgent(lower_order_agent=first_order_model),
+            order_beliefs=agent_order_beliefs
+        )
+        for zero_order_agent, first_order_model, agent_order_beliefs in zip(
+            create_zero_order_agents(zero_beliefs, zero_intentions),
+            create_zero_order_agents(first_beliefs, first_intentions),
+            order_beliefs.tolist()
+        )
+    ]
 
     # Create a list of all agents
-    return zero_order_agents + first_order_agents + second_order_agents
+    return zero_order_agents[:number_0] + first_order_agents + second_order_agents
+
+def agent_belief_vectors(
+        agents: List[TheoryOfMindAgent]
+    ) -> Tuple[List[BeliefVector], List[BeliefVector], List[BeliefVector]]:
+    '''
+    Returns every BeliefVector of a population, in the
+    layout of vectorized_simulation.AgentPopulation: the
+    zero-order beliefs of each agent (its own or its
+    zero-order model's), then those of the second-order
+    agents' first-order models, and their order beliefs.
+    '''
+    zero_order_beliefs = []
+    nested_beliefs = []
+    order_beliefs = []
+
+    for agent in agents:
+        if isinstance(agent, ZeroOrderTheoryOfMindAgent):
+            zero_order_beliefs.append(agent.beliefs)
+        else:
+            zero_order_beliefs.append(agent.zero_order_agent.beliefs)
+
+        if isinstance(agent, SecondOrderTheoryOfMindAgent):
+            nested_beliefs.append(agent.first_order_agent.zero_order_agent.beliefs)
+            order_beliefs.append(agent.order_beliefs)
+
+    return zero_order_beliefs, nested_beliefs, order_beliefs
 
-def agent_decide_and_save_data(agent_actions: List[List[int]], agent: TheoryOfMindAgent, index: int) -> int:
+def configure_agent(agent: TheoryOfMindAgent, eps: float, learning_speed: float) -> None:
     '''
-    Gets the agent decision, updates the 
-    agent actions and returns the decision.
+    Sets the exploration probability and learning
+    speed of an agent and of its nested models,
+    including the ModelChain of an order-k agent.
     '''
-    # Get agent decision
-    agent_decision: int = agent.decide()
-    agent_actions[index].append(agent_decision)
-    return agent_decision
+    agent.eps = eps
+    agent.learning_speed = learning_speed
+    for model in (
+        getattr(agent, 'zero_order_agent', None),
+        getattr(agent, 'first_order_agent', None),
+        getattr(agent, 'model_chain', None),
+    ):
+        if model is not None:
+            configure_agent(model, eps, learning_speed)
 
-class RegularSimulation(Simulation):
+@register_backend
+class PythonBackend(SimulationBackend):
+    '''
+    The reference backend: one agent object per
+    agent, deciding and learning one at a time.
+    '''
+    name = 'python'
+
+    def __init__(
+        self,
+        agent_config: AgentsConfiguration,
+        number_of_choices: int = NUM_OF_CHOICES,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED
+    ) -> None:
+        super().__init__(agent_config, number_of_choices, eps, learning_speed)
+        self.agents: List[TheoryOfMindAgent] = create_agents(agent_config, number_of_choices)
+
+        # Agents start with the module defaults
+        if (eps, learning_speed) != (EPS, LEARNING_SPEED):
+            for agent in self.agents:
+                configure_agent(agent, eps, learning_speed)
+
+    def decide(self) -> np.ndarray:
+        return np.array([agent.decide() for agent in self.agents], dtype=np.int64)
+
+    def update(self, actions: np.ndarray) -> None:
+        for agent, action in zip(self.agents, actions.tolist()):
+            agent.update(action)
+
+    def belief_distribution(self) -> np.ndarray:
+        beliefs = BeliefMatrix.from_vectors(agent_belief_vectors(self.agents)[0], self.number_of_choices)
+        return beliefs.scaled() / beliefs.total[:, np.newaxis]
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        '''
+        Returns the beliefs in the layout of
+        vectorized_simulation.population_state. Order
+        beliefs are raw values, with their scale
+        factors and totals under extra keys so the
+        agents resume exactly. Their rows for agents
+        that are not second-order are unused.
+        '''
+        zero_order_beliefs, nested_beliefs, order_beliefs = agent_belief_vectors(self.agents)
+        order_belief_matrix = BeliefMatrix.from_vectors(order_beliefs, 2)
+        second_order = slice(len(self.agents) - len(order_beliefs), len(self.agents))
+
+        state = {
+            'kinds': self.kinds,
+            **BeliefMatrix.from_vectors(zero_order_beliefs, self.number_of_choices).get_state('beliefs'),
+            **BeliefMatrix.from_vectors(nested_beliefs, self.number_of_choices).get_state('nested_beliefs'),
+            'order_beliefs': np.full((len(self.agents), 2), 0.5),
+            'order_beliefs_scale': order_belief_matrix.scale,
+            'order_beliefs_total': order_belief_matrix.total,
+        }
+        state['order_beliefs'][second_order] = order_belief_matrix.values
+        return state
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        if state['kinds'].shape[0] != len(self.agents) or np.any(state['kinds'] != self.kinds):
+            raise ValueError("State of a different agent configuration.")
+        if state['beliefs_values'].shape[-1] != self.number_of_choices:
+            raise ValueError(f"State of {state['beliefs_values'].shape[-1]} choices, not {self.number_of_choices}.")
+
+        zero_order_beliefs, nested_beliefs, order_beliefs = agent_belief_vectors(self.agents)
+        BeliefMatrix.from_state('beliefs', state).to_vectors(zero_order_beliefs)
+        BeliefMatrix.from_state('nested_beliefs', state).to_vectors(nested_beliefs)
+
+        # Other backends store order beliefs unscaled
+        values = np.asarray(state['order_beliefs'], dtype=float)[len(self.agents) - len(order_beliefs):]
+        BeliefMatrix(
+            values=values,
+            scale=state.get('order_beliefs_scale', np.ones(values.shape[0])),
+            total=state.get('order_beliefs_total', values.sum(axis=-1)),
+            best=np.argmax(values, axis=-1),
+        ).to_vectors(order_beliefs)
+
+class RegularSimulation(Simulation, SupportsCheckpoints, SupportsConvergence):
     '''
     A Simulation of Theory of Mind
-    agents playing the mod game with
-    23 choices, without signaling.
+    agents playing the mod game
+    without signaling.
+
+    Rounds are played by a backend from
+    simulations.backends, the object-per-agent
+    'python' one by default. Scores, history and
+    statistics get a leading replicate axis when
+    the backend holds several replicates.
+
+    Args:
+        agent_config: AgentsConfiguration == The Agent Population Config
+        history_window: Optional[int] == Rounds of actions kept in memory,
+            None keeps all of them (only the last SPILLED_WINDOW with a history_path)
+        history_path: Optional[str] == File the full action history is spilled to
+        seed: Optional[int] == Seed of the simulation's random stream
+        interaction_graph: Optional[InteractionGraph] == Neighbours each agent is scored against,
+            None scores every agent against all others
+        backend: str == Name of the registered backend playing the rounds
+        eps: float == Exploration probability of every decision
+        learning_speed: float == Learning speed of every belief update
+        number_of_choices: int == Number of choices in the mod game
+        backend_kwargs: Optional[Dict[str, Any]] == Other arguments of the backend
     '''
     def __init__(
         self,
-        agent_config: AgentsConfiguration = AgentsConfiguration(5,5,5)
+        agent_config: AgentsConfiguration = AgentsConfiguration(5,5,5),
+        history_window: Optional[int] = None,
+        history_path: Optional[str] = None,
+        seed: Optional[int] = None,
+        interaction_graph: Optional[InteractionGraph] = None,
+        backend: str = 'python',
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED,
+        number_of_choices: int = NUM_OF_CHOICES,
+        backend_kwargs: Optional[Dict[str, Any]] = None
     ):
-        super().__init__(agent_config)
-        self.agents: List[TheoryOfMindAgent] = create_agents(agent_config)
-        self.agent_actions = [[] for _ in self.agents]
-        self.agent_scores = [0 for _ in self.agents]
+        super().__init__(agent_config, seed)
+        with using_random_stream(self.random_stream):
+            self.backend: SimulationBackend = get_backend(backend)(
+                agent_config, number_of_choices, eps, learning_speed, **(backend_kwargs or {})
+            )
+        kinds = self.backend.kinds
+        if interaction_graph is not None:
+            interaction_graph.check_size(kinds.shape[0])
+        self.interaction_graph = interaction_graph
+        agent_shape = self.backend.batch_shape + kinds.shape
+        self.agent_actions = ActionHistory(agent_shape, history_window, history_path, number_of_choices)
+        self.agent_scores = np.zeros(agent_shape, dtype=np.int64)
+        self.statistics = ScoreStatistics(kinds, self.backend.batch_shape)
+
+    @property
+    def agents(self) -> List[TheoryOfMindAgent]:
+        ''' The agent objects of the python backend. '''
+        return self.backend.agents
 
     def simulate_round(self) -> None:
         # Have each agent decide on an action
-        actions = [agent_decide_and_save_data(self.agent_actions, agent, index) for index, agent in enumerate(self.agents)]
-        actions_copy = actions
+        with self.phase('decide'):
+            actions = self.backend.decide()
+        with self.phase('record'):
+            self.agent_actions.record(actions)
 
-        for index, action in enumerate(actions):
-            lower_choices = sum([1 for choice in actions_copy if choice == (action - 1) % 23])
-            self.agent_scores[index] += lower_choices
+        # Score each agent by the number of agents (or neighbours) that chose the action below its own
+        with self.phase('score'):
+            round_scores = self.backend.score(actions, self.interaction_graph)
+            self.agent_scores += round_scores
+            self.statistics.update(round_scores)
 
         # Update the beliefs of each agent based on the actions of all agents
-        for agent, action in zip(self.agents, actions):
-            agent.update(action)
+        with self.phase('update'):
+            self.backend.update(actions)
+
+    def level_rates(self) -> np.ndarray:
+        return self.statistics.last_means
+
+    def belief_distribution(self) -> np.ndarray:
+        return self.backend.belief_distribution()
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return {
+            **self.backend.get_state(),
+            'agent_scores': self.agent_scores,
+            **self.agent_actions.get_state(),
+            **self.statistics.get_state(),
+        }
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        if state['agent_scores'].shape != self.agent_scores.shape:
+            raise ValueError(f"Checkpoint scores of shape {state['agent_scores'].shape}, not {self.agent_scores.shape}.")
+
+        self.backend.set_state(state)
+        self.agent_scores = np.array(state['agent_scores'], dtype=np.int64)
+        self.agent_actions.set_state(state)
+        self.statistics.set_state(state)
 
     def get_results(self) -> RegularSimulationResults:
         '''
         Calculates the statistics and returns 
         them in a dict with individual results.
         '''
-        # Extract agent numbers
-        number_0 = self.agent_config.zero_order_agent_number
-        number_1 = self.agent_config.first_order_agent_number
-        number_2 = self.agent_config.second_order_agent_number
-
-        # Slice scores per ToM level
-        zero_order_scores = self.agent_scores[:number_0]
-        first_order_scores = self.agent_scores[number_0:number_0+number_1]
-        second_order_scores = self.agent_scores[number_0+number_1:]
-
-        return RegularSimulationResults(
-            zero_order_mean=get_mean(zero_order_scores),
-            zero_order_std=get_std(zero_order_scores), 
-            first_order_mean=get_mean(first_order_scores),
-            first_order_std=get_std(first_order_scores),
-            second_order_mean=get_mean(second_order_scores),
-            second_order_std=get_std(second_order_scores),
-        )
-
-
+        return self.backend.get_results(self.agent_scores)
 
+    @staticmethod
     def display_results(
-        self, 
         results: RegularSimulationResults, 
         print_individual_scores: bool = False
     ) -> None:
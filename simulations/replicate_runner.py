@@ -0,0 +1,162 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Type
+
+import numpy as np
+
+from simulations.simulation import Simulation
+from simulations.convergence import ConvergenceCriterion, ConvergenceReport
+from simulations.regular_simulation import RegularSimulation
+from simulations.vectorized_simulation import BatchedRegularSimulation
+from utilities import AgentsConfiguration, RegularSimulationResults, per_round_results
+
+def derive_seeds(master_seed: int, number_of_replicates: int) -> List[int]:
+    '''
+    Derives one independent seed per replicate
+    from a single master seed. The seed of a
+    replicate only depends on the master seed
+    and the replicate index.
+    '''
+    children = np.random.SeedSequence(master_seed).spawn(number_of_replicates)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+def run_replicate(
+        agent_config: AgentsConfiguration,
+        epochs: int,
+        seed: int,
+        simulation_class: Type[Simulation] = RegularSimulation,
+        simulation_kwargs: Optional[Dict[str, Any]] = None
+    ) -> RegularSimulationResults:
+    '''
+    Creates a simulation replicate with its
+    own seeded random stream and runs it.
+    simulation_kwargs are passed on to the
+    simulation class (e.g. eps, learning_speed).
+    '''
+    simulation = simulation_class(agent_config=agent_config, seed=seed, **(simulation_kwargs or {}))
+    simulation.run(number_of_epochs=epochs)
+    return simulation.get_results()
+
+def run_converged_replicate(
+        agent_config: AgentsConfiguration,
+        convergence: ConvergenceCriterion,
+        seed: int,
+        simulation_class: Type[Simulation] = RegularSimulation,
+        simulation_kwargs: Optional[Dict[str, Any]] = None
+    ) -> Tuple[RegularSimulationResults, ConvergenceReport]:
+    '''
+    Like run_replicate, but runs until convergence.
+    Replicates stop after different numbers of
+    epochs, so results are returned per round.
+    '''
+    simulation = simulation_class(agent_config=agent_config, seed=seed, **(simulation_kwargs or {}))
+    report = simulation.run(convergence=convergence)
+    return per_round_results(simulation.get_results(), simulation.epoch), report
+
+def iter_pool(
+        function: Callable,
+        arguments: Sequence[Tuple],
+        workers: Optional[int] = None
+    ) -> Iterator[Tuple[int, Any]]:
+    '''
+    Calls function with each tuple of arguments
+    over a process pool and yields (index, result)
+    pairs as workers finish. With a single worker
+    calls run in this process, in order.
+    '''
+    if workers == 1:
+        for index, function_arguments in enumerate(arguments):
+            yield index, function(*function_arguments)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(function, *function_arguments): index
+            for index, function_arguments in enumerate(arguments)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def iter_replicate_results(
+        agent_config: AgentsConfiguration,
+        number_of_replicates: int = 10,
+        epochs: int = 1000,
+        master_seed: int = 0,
+        workers: Optional[int] = None,
+        simulation_class: Type[Simulation] = RegularSimulation
+    ) -> Iterator[Tuple[int, RegularSimulationResults]]:
+    '''
+    Runs replicates over a process pool and yields
+    (replicate index, results) pairs as workers
+    finish. Results do not depend on the number
+    of workers or on the order of completion.
+
+    Args:
+        agent_config: AgentsConfiguration == The Agent Population Config
+        number_of_replicates: int == Number of independent replicates
+        epochs: int == Number of rounds per replicate
+        master_seed: int == Seed all replicate seeds are derived from
+        workers: Optional[int] == Pool size, defaults to the CPU count.
+            With a single worker replicates run in this process.
+        simulation_class: Type[Simulation] == Simulation to replicate
+    '''
+    seeds = derive_seeds(master_seed, number_of_replicates)
+    yield from iter_pool(
+        run_replicate, [(agent_config, epochs, seed, simulation_class) for seed in seeds], workers
+    )
+
+def iter_converged_replicates(
+        agent_config: AgentsConfiguration,
+        number_of_replicates: int = 10,
+        convergence: ConvergenceCriterion = ConvergenceCriterion(),
+        master_seed: int = 0,
+        workers: Optional[int] = None,
+        simulation_class: Type[Simulation] = RegularSimulation
+    ) -> Iterator[Tuple[int, RegularSimulationResults, ConvergenceReport]]:
+    '''
+    Like iter_replicate_results, but every replicate
+    runs until convergence. Yields (replicate index,
+    per round results, convergence report) triples.
+    '''
+    seeds = derive_seeds(master_seed, number_of_replicates)
+    for index, (results, report) in iter_pool(
+        run_converged_replicate, [(agent_config, convergence, seed, simulation_class) for seed in seeds], workers
+    ):
+        yield index, results, report
+
+def run_replicates(
+        agent_config: AgentsConfiguration,
+        number_of_replicates: int = 10,
+        epochs: int = 1000,
+        master_seed: int = 0,
+        workers: Optional[int] = None,
+        simulation_class: Type[Simulation] = RegularSimulation
+    ) -> List[RegularSimulationResults]:
+    '''
+    Runs replicates over a process pool and
+    returns their results in replicate order.
+    '''
+    results: List[Optional[RegularSimulationResults]] = [None] * number_of_replicates
+
+    for index, result in iter_replicate_results(
+        agent_config, number_of_replicates, epochs, master_seed, workers, simulation_class
+    ):
+        results[index] = result
+
+    return results
+
+def run_batched_replicates(
+        agent_config: AgentsConfiguration,
+        number_of_replicates: int = 10,
+        epochs: int = 1000,
+        seed: int = 0
+    ) -> List[RegularSimulationResults]:
+    '''
+    Runs all replicates in a single process
+    as one BatchedRegularSimulation, for many
+    replicates of small populations.
+    '''
+    simulation = BatchedRegularSimulation(
+        agent_config=agent_config, number_of_replicates=number_of_replicates, seed=seed
+    )
+    simulation.run(number_of_epochs=epochs)
+    return simulation.get_results()
@@ -0,0 +1,65 @@
+'''
+JSON form of what leaves a process: simulation
+classes by import path and the configuration and
+result dataclasses, shared by the distributed
+runner, the recorder and the sweep result cache.
+'''
+import importlib
+from dataclasses import asdict, is_dataclass
+from typing import Any, Type
+
+import numpy as np
+
+from simulations.simulation import Simulation
+from utilities import (
+    AgentsConfiguration,
+    HigherOrderConfiguration,
+    HigherOrderSimulationResults,
+    RegularSimulationResults,
+    SignalingSimulationResults
+)
+
+# Dataclasses that may be serialized, by name
+PAYLOAD_TYPES = {
+    payload_type.__name__: payload_type
+    for payload_type in (
+        AgentsConfiguration,
+        HigherOrderConfiguration,
+        RegularSimulationResults,
+        SignalingSimulationResults,
+        HigherOrderSimulationResults,
+    )
+}
+
+def simulation_path(simulation_class: Type[Simulation]) -> str:
+    return f"{simulation_class.__module__}.{simulation_class.__qualname__}"
+
+def resolve_simulation(path: str) -> Type[Simulation]:
+    ''' Imports a simulation class from its path, refusing anything else. '''
+    module_name, _, class_name = path.rpartition('.')
+    simulation_class = getattr(importlib.import_module(module_name), class_name, None)
+    if not (isinstance(simulation_class, type) and issubclass(simulation_class, Simulation)):
+        raise ValueError(f"{path} is not a Simulation.")
+    return simulation_class
+
+def encode_payload(value: Any) -> Any:
+    ''' Turns (lists of) known dataclasses into JSON values, tagged with their type. '''
+    if isinstance(value, (list, tuple)):
+        return [encode_payload(item) for item in value]
+    if is_dataclass(value):
+        return {'type': type(value).__name__, 'fields': asdict(value)}
+    return value
+
+def decode_payload(value: Any) -> Any:
+    ''' The inverse of encode_payload. '''
+    if isinstance(value, list):
+        return [decode_payload(item) for item in value]
+    if isinstance(value, dict) and value.get('type') in PAYLOAD_TYPES:
+        return PAYLOAD_TYPES[value['type']](**value['fields'])
+    return value
+
+def json_default(value: Any) -> Any:
+    ''' Converts the NumPy scalars and arrays json cannot. '''
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} cannot be serialized to JSON.")
@@ -1,82 +1,295 @@
-from typing import List
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 
-from agents.signaling_agents import (
-    ZeroOrderSignalingAgent
+import numpy as np
+
+from agents.agent import EPS, LEARNING_SPEED
+from agents.beliefs import BeliefMatrix, JointBeliefMatrix
+from agents.receiving_agents import ZeroOrderReceivingAgent
+from agents.signaling_agents import ZeroOrderSignalingAgent
+from utilities import (
+    AgentsConfiguration,
+    SignalingSimulationResults,
+    NUM_OF_CHOICES,
+    get_mean,
+    get_std,
+    get_random_stream,
+    check_epsilons,
+    make_random_choices,
+    score_actions,
+    using_random_stream
 )
-from agents.agent import SignalingAgent
-from utilities import AgentsConfiguration
-from simulations.simulation import Simulation
-        
-def create_signaling_agents(agent_config: AgentsConfiguration = AgentsConfiguration(10, 10, 10)) -> List[SignalingAgent]:
-    ''' 
-    Creates a set population of agents based on 
-    an AgentsConfiguration instance.
+from simulations.simulation import Simulation, SupportsCheckpoints, SupportsConvergence
+from simulations.action_history import ActionHistory
+from simulations.online_statistics import ScoreStatistics
+
+@dataclass
+class SignalingPopulation:
+    '''
+    Struct-of-arrays storage of the signaling game:
+    N signalers and N receivers, receiver i listening
+    to signaler i. Arrays mirror the per-agent objects
+    of agents.signaling_agents and agents.receiving_agents.
+    '''
+    signal_beliefs: JointBeliefMatrix  # (N, C, C) signal x action, per signaler
+    connected_beliefs: BeliefMatrix    # (N * C, C), row i * C + s: receiver i after signal s
+    intentions: BeliefMatrix           # (N, C) receivers' beliefs of the signaler's action
+
+    @property
+    def size(self) -> int:
+        return self.intentions.rows
+
+    @property
+    def number_of_choices(self) -> int:
+        return self.intentions.number_of_choices
+
+    def connected_rows(self, signals: np.ndarray) -> np.ndarray:
+        ''' Rows of connected_beliefs of each receiver after hearing signals. '''
+        return np.arange(self.size) * self.number_of_choices + signals
+
+def create_signaling_population(
+        number_of_pairs: int,
+        number_of_choices: int = NUM_OF_CHOICES,
+        precision: str = 'float64'
+    ) -> SignalingPopulation:
+    ''' Creates the array storage of number_of_pairs signalers and receivers, beliefs stored in precision. '''
+    random_stream = get_random_stream()
+    shape = (number_of_pairs, number_of_choices, number_of_choices)
+
+    return SignalingPopulation(
+        signal_beliefs=JointBeliefMatrix.from_values(random_stream.random_array(shape), precision),
+        connected_beliefs=BeliefMatrix.from_values(
+            random_stream.random_array(shape).reshape(-1, number_of_choices), precision
+        ),
+        intentions=BeliefMatrix.from_values(
+            random_stream.random_array((number_of_pairs, number_of_choices)), precision
+        ),
+    )
+
+def create_signaling_agents(
+        population: SignalingPopulation
+    ) -> Tuple[List[ZeroOrderSignalingAgent], List[ZeroOrderReceivingAgent]]:
+    '''
+    Creates the per-agent reference population of a
+    SignalingPopulation: signaler i and receiver i
+    start from copies of the beliefs of pair i, so
+    both engines play alike (see
+    backend_equivalence.compare_signaling_engines).
+    The objects play the 23 choices of the game.
 
     Args:
-        agent_config: AgentsConfiguration == The Agent Population Config
+        population: SignalingPopulation == The array population to mirror
     '''
-    # Extract agent numbers
-    number_0 = agent_config.zero_order_agent_number
-    #number_1 = agent_config.first_order_agent_number
-    #number_2 = agent_config.second_order_agent_number
+    if population.number_of_choices != NUM_OF_CHOICES:
+        raise ValueError(f"The signaling agents play {NUM_OF_CHOICES} choices, not {population.number_of_choices}.")
+
+    signal_beliefs = population.signal_beliefs
+    scaled_signal_beliefs = signal_beliefs.values * signal_beliefs.scale[:, np.newaxis, np.newaxis]
+    connected_beliefs = population.connected_beliefs.scaled().reshape(scaled_signal_beliefs.shape)
+
+    # Beliefs the game never reads are left empty
+    signaling_agents = [
+        ZeroOrderSignalingAgent(beliefs=beliefs, intentions=[])
+        for beliefs in scaled_signal_beliefs.tolist()
+    ]
+    receiving_agents = [
+        ZeroOrderReceivingAgent(beliefs=[], intentions=intentions, connected_beliefs=connected)
+        for intentions, connected in zip(population.intentions.scaled().tolist(), connected_beliefs.tolist())
+    ]
 
-    # Create a list of zero-order agents
-    zero_order_agents = [ZeroOrderSignalingAgent() for _ in range(number_0)]
+    return signaling_agents, receiving_agents
 
-    # Create a list of first-order agents, each with a reference to a zero-order agent
-    #first_order_agents = [FirstOrderTheoryOfMindAgent() for _ in range(number_1)]
+def send_signals(population: SignalingPopulation, eps: float = EPS) -> np.ndarray:
+    '''
+    Batched ZeroOrderSignalingAgent.signal: the signal
+    with the highest total belief, or a random one with
+    epsilon probability.
+    '''
+    explore = check_epsilons(eps, (population.size,))
+    random_signals = make_random_choices(population.number_of_choices, (population.size,))
 
-    # Create a list of second-order agents, each with a reference to a zero and first-order agent
-    #second_order_agents = [SecondOrderTheoryOfMindAgent() for _ in range(number_2)]
+    return np.where(explore, random_signals, population.signal_beliefs.best_row)
 
-    # Create a list of all agents
-    return zero_order_agents #+ first_order_agents + second_order_agents
+def receive_signals(population: SignalingPopulation, signals: np.ndarray, eps: float = EPS) -> np.ndarray:
+    '''
+    Batched ZeroOrderReceivingAgent.process_signal: each
+    receiver plays one above the action it believes its
+    signaler plays after the signal, or a random action
+    with epsilon probability.
+    '''
+    explore = check_epsilons(eps, (population.size,))
+    random_choices = make_random_choices(population.number_of_choices, (population.size,))
+    predicted = population.connected_beliefs.best[population.connected_rows(signals)]
 
+    return np.where(explore, random_choices, (predicted + 1) % population.number_of_choices)
 
-class SignalingSimulation(Simulation):
+def signalers_decide(population: SignalingPopulation, signals: np.ndarray, eps: float = EPS) -> np.ndarray:
+    '''
+    Batched ZeroOrderSignalingAgent.decide: the most
+    believed action after the sent signal, or a random
+    action with epsilon probability.
+    '''
+    explore = check_epsilons(eps, (population.size,))
+    random_choices = make_random_choices(population.number_of_choices, (population.size,))
+    best_actions = population.signal_beliefs.best_column[np.arange(population.size), signals]
+
+    return np.where(explore, random_choices, best_actions)
+
+def signaling_update(
+        population: SignalingPopulation,
+        signals: np.ndarray,
+        signaler_actions: np.ndarray,
+        receiver_actions: np.ndarray,
+        learning_speed: float = LEARNING_SPEED
+    ) -> None:
+    '''
+    Batched update of both sides: signalers whose action
+    beat their receiver's reinforce the (signal, action)
+    pair they played, and receivers learn which action
+    their signaler played after the signal.
+    '''
+    wins = np.flatnonzero(signaler_actions == (receiver_actions + 1) % population.number_of_choices)
+    population.signal_beliefs.reinforce(wins, signals[wins], signaler_actions[wins], learning_speed)
+
+    population.connected_beliefs.reinforce_rows(population.connected_rows(signals), signaler_actions, learning_speed)
+    population.intentions.reinforce(signaler_actions, learning_speed)
+
+class SignalingSimulation(Simulation, SupportsCheckpoints, SupportsConvergence):
     '''
     A Simulation of Theory of Mind
     agents playing the mod game with
     23 choices, with signaling.
+
+    Every zero-order agent of the configuration
+    is a signaler paired with a receiver. Each round
+    signalers send a signal, receivers respond to the
+    signal of their signaler, signalers act, and all
+    signalers and receivers are scored together in
+    the mod game before both sides learn. The whole
+    population is stored and advanced as NumPy arrays.
+    Score statistics treat signalers as level 0 and
+    receivers as level 1.
+
+    Args:
+        agent_config: AgentsConfiguration == The Agent Population Config
+        number_of_choices: int == Number of choices (and signals) in the mod game
+        history_window: Optional[int] == Rounds of actions kept in memory,
+            None keeps all of them (only the last SPILLED_WINDOW with a history_path)
+        history_path: Optional[str] == File the full action history is spilled to
+        seed: Optional[int] == Seed of the simulation's random stream
+        eps: float == Exploration probability of every decision
+        learning_speed: float == Learning speed of every belief update
+        precision: str == Storage precision of the beliefs, see agents.beliefs.PRECISIONS
     '''
     def __init__(
         self,
-        agent_config: AgentsConfiguration = AgentsConfiguration(5,5,5)
+        agent_config: AgentsConfiguration = AgentsConfiguration(5,5,5),
+        number_of_choices: int = NUM_OF_CHOICES,
+        history_window: Optional[int] = None,
+        history_path: Optional[str] = None,
+        seed: Optional[int] = None,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED,
+        precision: str = 'float64'
     ):
-        super().__init__(agent_config)
-        self.signaling_agents: List[SignalingAgent] = create_signaling_agents(agent_config)
-        #self.receiving_agents: 
-        self.signaling_agent_actions = [[] for _ in self.agents]
-        self.signaling_agent_scores = [0 for _ in self.agents]
+        super().__init__(agent_config, seed)
+        self.eps = eps
+        self.learning_speed = learning_speed
+        with using_random_stream(self.random_stream):
+            self.population = create_signaling_population(
+                agent_config.zero_order_agent_number, number_of_choices, precision
+            )
+
+        # Signalers' actions come first in every round, then the receivers'
+        self.agent_actions = ActionHistory(2 * self.population.size, history_window, history_path, number_of_choices)
+        self.signaling_agent_scores = np.zeros(self.population.size, dtype=np.int64)
+        self.receiving_agent_scores = np.zeros(self.population.size, dtype=np.int64)
+        self.statistics = ScoreStatistics(
+            np.repeat(np.arange(2, dtype=np.int8), self.population.size), number_of_levels=2
+        )
 
     def simulate_round(self) -> None:
-        # Have each agent decide on an action
-        actions = [agent_decide_and_save_data(self.agent_actions, agent, index) for index, agent in enumerate(self.agents)]
-        actions_copy = actions
-
-        for index, action in enumerate(actions):
-            lower_choices = sum([1 for choice in actions_copy if choice == (action - 1) % 23])
-            self.agent_scores[index] += lower_choices
-
-        # Update the beliefs of each agent based on the actions of all agents
-        for agent, action in zip(self.agents, actions):
-            agent.update(action)
-
-    def display_results(self) -> None:
-        # Extract agent numbers
-        number_0 = self.agent_config.zero_order_agent_number
-        #number_1 = self.agent_config.first_order_agent_number
-        #number_2 = self.agent_config.second_order_agent_number
-
-        # Slice scores per ToM level
-        zero_order_scores = self.signaling_agent_scores[:number_0]
-        #first_order_scores = self.agent_scores[number_0:number_0+number_1]
-        #second_order_scores = self.agent_scores[number_0+number_1:]
-
-        print("Printing scores...")
-        print(f"Zero Order Agents ({number_0}): ")
-        print(zero_order_scores)
-        #print(f"First Order Agents ({number_1}): ")
-        #print(first_order_scores)
-        #print(f"Second Order Agents ({number_2}): ")
-        #print(second_order_scores)
\ No newline at end of file
+        # Have each signaler send a signal and each receiver respond to it
+        with self.phase('signal'):
+            signals = send_signals(self.population, self.eps)
+        with self.phase('receive'):
+            receiver_actions = receive_signals(self.population, signals, self.eps)
+
+        # Have each signaler decide on an action
+        with self.phase('decide'):
+            signaler_actions = signalers_decide(self.population, signals, self.eps)
+            actions = np.concatenate([signaler_actions, receiver_actions])
+        with self.phase('record'):
+            self.agent_actions.record(actions)
+
+        # Score each agent by the number of agents that chose the action below its own
+        with self.phase('score'):
+            round_scores = score_actions(actions, self.population.number_of_choices)
+            self.signaling_agent_scores += round_scores[:self.population.size]
+            self.receiving_agent_scores += round_scores[self.population.size:]
+            self.statistics.update(round_scores)
+
+        # Update the beliefs of signalers and receivers
+        with self.phase('update'):
+            signaling_update(self.population, signals, signaler_actions, receiver_actions, self.learning_speed)
+
+    def level_rates(self) -> np.ndarray:
+        ''' Mean score of the signalers and of the receivers in the last round. '''
+        return self.statistics.last_means
+
+    def belief_distribution(self) -> np.ndarray:
+        signal_beliefs = self.population.signal_beliefs
+        return signal_beliefs.values * (signal_beliefs.scale / signal_beliefs.total)[:, np.newaxis, np.newaxis]
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return {
+            **self.population.signal_beliefs.get_state('signal_beliefs'),
+            **self.population.connected_beliefs.get_state('connected_beliefs'),
+            **self.population.intentions.get_state('intentions'),
+            'signaling_agent_scores': self.signaling_agent_scores,
+            'receiving_agent_scores': self.receiving_agent_scores,
+            **self.agent_actions.get_state(),
+            **self.statistics.get_state(),
+        }
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        if state['signal_beliefs_values'].shape != self.population.signal_beliefs.values.shape:
+            raise ValueError(
+                f"Checkpoint beliefs of shape {state['signal_beliefs_values'].shape}, "
+                f"not {self.population.signal_beliefs.values.shape}."
+            )
+        if state['signal_beliefs_values'].dtype != self.population.signal_beliefs.values.dtype:
+            raise ValueError(
+                f"Checkpoint beliefs stored as {state['signal_beliefs_values'].dtype}, "
+                f"not {self.population.signal_beliefs.values.dtype}."
+            )
+
+        self.population = SignalingPopulation(
+            signal_beliefs=JointBeliefMatrix.from_state('signal_beliefs', state),
+            connected_beliefs=BeliefMatrix.from_state('connected_beliefs', state),
+            intentions=BeliefMatrix.from_state('intentions', state),
+        )
+        self.signaling_agent_scores = state['signaling_agent_scores']
+        self.receiving_agent_scores = state['receiving_agent_scores']
+        self.agent_actions.set_state(state)
+        self.statistics.set_state(state)
+
+    def get_results(self) -> SignalingSimulationResults:
+        '''
+        Calculates the statistics and returns
+        them as a SignalingSimulationResults.
+        '''
+        return SignalingSimulationResults(
+            signaling_mean=get_mean(self.signaling_agent_scores),
+            signaling_std=get_std(self.signaling_agent_scores),
+            receiving_mean=get_mean(self.receiving_agent_scores),
+            receiving_std=get_std(self.receiving_agent_scores),
+        )
+
+    @staticmethod
+    def display_results(results: SignalingSimulationResults) -> None:
+        print("Printing statistics ...")
+        print(f"Signaling Agents Mean Score: {results.signaling_mean:.3f}")
+        print(f"Signaling Agents Std: {results.signaling_std:.3f}")
+        print(f"Receiving Agents Mean Score: {results.receiving_mean:.3f}")
+        print(f"Receiving Agents Std: {results.receiving_std:.3f}")
@@ -1,18 +1,240 @@
+import json
 from abc import ABC, abstractmethod
-from utilities import AgentsConfiguration
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import numpy as np
+from simulations.checkpoint import read_checkpoint, write_checkpoint
+from simulations.convergence import ConvergenceCriterion, ConvergenceMonitor, ConvergenceReport
+from simulations.instrumentation import (
+    NULL_PHASE,
+    Instrumentation,
+    NullPhase,
+    PhaseTimer,
+    ProfileWindow
+)
+from utilities import AgentsConfiguration, RandomStream, using_random_stream
+
+# Version of the simulation dynamics. Bump it whenever a change alters
+# the results of seeded simulations, so cached results are not reused.
+ENGINE_VERSION = 1
+
+class SupportsCheckpoints(ABC):
+    '''
+    Mixin of simulations whose full state can be
+    saved and restored, see Simulation.save_checkpoint.
+    '''
+    @abstractmethod
+    def get_state(self) -> Dict[str, np.ndarray]:
+        '''
+        Returns the state of the agents and of the
+        results gathered so far, as named arrays.
+        '''
+        pass
+
+    @abstractmethod
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        '''
+        Restores a state returned by get_state
+        into a simulation of the same configuration.
+        '''
+        pass
+
+class SupportsConvergence(ABC):
+    '''
+    Mixin of simulations that can run until
+    convergence, see Simulation.run.
+    '''
+    @abstractmethod
+    def level_rates(self) -> np.ndarray:
+        '''
+        Returns the mean score per agent of every
+        level (or kind of agent) in the last round.
+        '''
+        pass
+
+    @abstractmethod
+    def belief_distribution(self) -> np.ndarray:
+        '''
+        Returns the normalised beliefs of every agent,
+        whose drift is tracked by convergence runs.
+        '''
+        pass
 
 class Simulation(ABC):
-    ''' Abstract class to define simulations. '''
-    def __init__(self, agent_config: AgentsConfiguration) -> None:
+    '''
+    Abstract class to define simulations.
+
+    Every simulation draws from its own RandomStream,
+    seeded with `seed`. Subclasses create their agents
+    inside `with using_random_stream(self.random_stream)`
+    and run() draws every round from it, so seeded
+    simulations are reproducible independently of
+    each other.
+
+    Subclasses that also derive from
+    SupportsCheckpoints can be checkpointed: a
+    simulation restored with load_checkpoint
+    continues exactly like the one that saved it.
+
+    Rounds can be instrumented (see instrument),
+    observed every N epochs (see add_observer) and
+    profiled over a range of epochs (see profile).
+    All three are off by default and then cost next
+    to nothing.
+    '''
+    def __init__(self, agent_config: AgentsConfiguration, seed: Optional[int] = None) -> None:
         self.agent_config = agent_config
+        self.random_stream = RandomStream(seed)
+        self.epoch: int = 0
+        self.instrumentation: Optional[Instrumentation] = None
+        self.observers: List[Tuple[int, Callable[['Simulation'], None]]] = []
+        self.profile_windows: List[ProfileWindow] = []
 
-    def run(self, number_of_epochs: int = 1000):
+    def run(
+        self,
+        number_of_epochs: Optional[int] = None,
+        checkpoint_every: Optional[int] = None,
+        checkpoint_path: Optional[str] = None,
+        convergence: Optional[ConvergenceCriterion] = None
+    ) -> Optional[ConvergenceReport]:
         '''
         Runs the simulation for a specified 
-        number of epochs/rounds.
+        number of epochs/rounds (1000 by default),
+        saving a checkpoint to checkpoint_path every
+        checkpoint_every epochs if both are given.
+
+        Given a convergence criterion instead of a
+        number of epochs, the run stops once the
+        per-level score rates have converged, or after
+        convergence.max_epochs, and returns a
+        ConvergenceReport (also kept in
+        self.convergence_report). Only simulations
+        deriving from SupportsConvergence can do so.
+        Divide results by the epochs run to compare
+        them per round.
+        '''
+        if checkpoint_every and checkpoint_path is not None:
+            self.check_checkpoints()
+
+        monitor = None
+        if convergence is not None:
+            if number_of_epochs is not None:
+                raise ValueError("Pass either number_of_epochs or convergence, which runs up to its max_epochs.")
+            if not isinstance(self, SupportsConvergence):
+                raise TypeError(f"{type(self).__name__} does not support convergence runs.")
+            monitor = ConvergenceMonitor(convergence, self)
+            number_of_epochs = convergence.max_epochs
+        elif number_of_epochs is None:
+            number_of_epochs = 1000
+
+        try:
+            with using_random_stream(self.random_stream):
+                for _ in range(number_of_epochs):
+                    for window in self.profile_windows:
+                        window.before_round(self.epoch)
+
+                    self.simulate_round()
+                    self.epoch += 1
+
+                    if self.instrumentation is not None:
+                        self.instrumentation.end_round()
+                    for window in self.profile_windows:
+                        window.after_round(self.epoch)
+                    for every, observer in self.observers:
+                        if self.epoch % every == 0:
+                            observer(self)
+
+                    if checkpoint_every and checkpoint_path is not None and self.epoch % checkpoint_every == 0:
+                        self.save_checkpoint(checkpoint_path)
+
+                    if monitor is not None and monitor.after_round(self):
+                        break
+        finally:
+            # Profilers of windows the run stopped inside must not outlive it
+            for window in self.profile_windows:
+                window.finish()
+
+        if monitor is None:
+            return None
+        self.convergence_report = monitor.report
+        return monitor.report
+
+    def instrument(self) -> Instrumentation:
+        '''
+        Starts timing the phases of every round and
+        counting random draws, explorations and nested
+        model calls. Set self.instrumentation to None
+        to stop.
+        '''
+        self.instrumentation = Instrumentation(self.random_stream)
+        return self.instrumentation
+
+    def phase(self, name: str) -> Union[PhaseTimer, NullPhase]:
+        '''
+        Returns a context manager timing one phase
+        of a round (decide, record, score, update).
+        '''
+        if self.instrumentation is None:
+            return NULL_PHASE
+        return self.instrumentation.phase(name)
+
+    def add_observer(self, observer: Callable[['Simulation'], None], every: int = 1) -> None:
+        ''' Calls observer with the simulation after every `every` epochs. '''
+        self.observers.append((every, observer))
+
+    def profile(self, start: int, stop: int, kind: str = 'cprofile', path: Optional[str] = None) -> ProfileWindow:
+        '''
+        Profiles epochs [start, stop) with cProfile or
+        tracemalloc. The returned ProfileWindow holds
+        the result once epoch stop is reached, or the
+        run ends.
+        '''
+        window = ProfileWindow(start, stop, kind, path)
+        self.profile_windows.append(window)
+        return window
+
+    def check_checkpoints(self) -> None:
+        ''' Raises a TypeError unless the simulation supports checkpoints. '''
+        if not isinstance(self, SupportsCheckpoints):
+            raise TypeError(f"{type(self).__name__} does not support checkpoints.")
+
+    def save_checkpoint(self, path: str) -> None:
+        '''
+        Saves the full simulation state, including the
+        random stream and the epoch counter, to the
+        checkpoint directory at path.
         '''
-        for _ in range(number_of_epochs):
-            self.simulate_round()
+        self.check_checkpoints()
+        bit_generator_state, remaining_uniforms = self.random_stream.get_state()
+        state = self.get_state()
+        state['remaining_uniforms'] = remaining_uniforms
+
+        write_checkpoint(path, state, {
+            'simulation': type(self).__qualname__,
+            'agent_config': asdict(self.agent_config),
+            'epoch': self.epoch,
+            'bit_generator_state': bit_generator_state,
+        })
+
+    def load_checkpoint(self, path: str) -> None:
+        '''
+        Restores a checkpoint saved by a simulation of
+        the same class and agent configuration. Arrays
+        are memory-mapped copy-on-write, so any number
+        of simulations can branch off one checkpoint.
+        '''
+        self.check_checkpoints()
+        state, metadata = read_checkpoint(path)
+
+        if metadata['simulation'] != type(self).__qualname__:
+            raise ValueError(f"Checkpoint of a {metadata['simulation']}, not a {type(self).__qualname__}.")
+        agent_config = json.loads(json.dumps(asdict(self.agent_config)))
+        if metadata['agent_config'] != agent_config:
+            raise ValueError(f"Checkpoint of agents {metadata['agent_config']}, not {agent_config}.")
+
+        self.random_stream.set_state((metadata['bit_generator_state'], state.pop('remaining_uniforms')))
+        self.epoch = metadata['epoch']
+        self.set_state(state)
 
     @abstractmethod
     def simulate_round(self, **kwargs):
@@ -0,0 +1,426 @@
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from agents.agent import EPS, LEARNING_SPEED
+from agents.beliefs import BeliefMatrix
+from utilities import (
+    AgentsConfiguration,
+    RegularSimulationResults,
+    NUM_OF_CHOICES,
+    get_mean,
+    get_std,
+    get_random_stream,
+    check_epsilons,
+    count_nested_model_calls,
+    make_random_choices
+)
+from simulations.backends import SimulationBackend, register_backend
+from simulations.interaction_graph import InteractionGraph
+from simulations.regular_simulation import RegularSimulation
+
+# Agent kinds, stored in AgentPopulation.kinds
+ZERO_ORDER = 0
+FIRST_ORDER = 1
+SECOND_ORDER = 2
+
+@dataclass
+class AgentPopulation:
+    '''
+    Struct-of-arrays storage of a whole
+    population of Theory of Mind agents.
+
+    Row i of every per-agent array belongs to
+    agent i. Zero-order agents keep their own
+    beliefs in `beliefs`, first and second-order
+    agents keep the beliefs of their zero-order
+    model there. Second-order agents additionally
+    own a first-order model, whose zero-order
+    beliefs live in `nested_beliefs` (one row per
+    second-order agent, in population order).
+
+    Beliefs are lazily scaled BeliefMatrix rows
+    that keep their argmax up to date, and the
+    zero-order decisions made while deciding are
+    cached for the update of the same round.
+
+    State arrays may carry a leading replicate
+    axis (R, ...) to advance R independent
+    replicates of the same configuration at once.
+    '''
+    kinds: np.ndarray             # (N,) ToM order of each agent
+    beliefs: BeliefMatrix         # ([R,] N, C)
+    nested_beliefs: BeliefMatrix  # ([R,] N_2, C)
+    order_beliefs: np.ndarray     # ([R,] N, 2), only used by second-order agents
+    zero_order_decisions: Optional[np.ndarray] = None  # ([R,] N) cached this round
+    nested_decisions: Optional[np.ndarray] = None      # ([R,] N_2) cached this round
+
+    @property
+    def size(self) -> int:
+        return self.kinds.shape[0]
+
+    @property
+    def number_of_choices(self) -> int:
+        return self.beliefs.number_of_choices
+
+    @property
+    def batch_shape(self) -> tuple:
+        ''' Leading replicate axes, () for a single population. '''
+        return self.beliefs.values.shape[:-2]
+
+    @property
+    def second_order(self) -> slice:
+        ''' Rows of the second-order agents, which come last. '''
+        return slice(self.size - self.nested_beliefs.rows, self.size)
+
+def create_population(
+        agent_config: AgentsConfiguration = AgentsConfiguration(10, 10, 10),
+        number_of_choices: int = NUM_OF_CHOICES,
+        number_of_replicates: Optional[int] = None,
+        precision: str = 'float64'
+    ) -> AgentPopulation:
+    '''
+    Creates the array storage for a population
+    based on an AgentsConfiguration instance.
+    Agents are ordered zero, first then second-order,
+    like simulations.regular_simulation.create_agents.
+
+    Args:
+        agent_config: AgentsConfiguration == The Agent Population Config
+        number_of_choices: int == Number of choices in the mod game
+        number_of_replicates: Optional[int] == If given, stack that many
+            independent populations along a leading replicate axis
+        precision: str == Storage precision of the zero-order beliefs
+    '''
+    # Extract agent numbers
+    number_0 = agent_config.zero_order_agent_number
+    number_1 = agent_config.first_order_agent_number
+    number_2 = agent_config.second_order_agent_number
+    size = number_0 + number_1 + number_2
+
+    batch_shape = () if number_of_replicates is None else (number_of_replicates,)
+    kinds = np.repeat(
+        np.array([ZERO_ORDER, FIRST_ORDER, SECOND_ORDER], dtype=np.int8),
+        [number_0, number_1, number_2]
+    )
+
+    random_stream = get_random_stream()
+
+    return AgentPopulation(
+        kinds=kinds,
+        beliefs=BeliefMatrix.from_values(
+            random_stream.random_array(batch_shape + (size, number_of_choices)), precision
+        ),
+        nested_beliefs=BeliefMatrix.from_values(
+            random_stream.random_array(batch_shape + (number_2, number_of_choices)), precision
+        ),
+        order_beliefs=random_stream.random_array(batch_shape + (size, 2)),
+    )
+
+def population_state(population: AgentPopulation) -> Dict[str, np.ndarray]:
+    '''
+    Returns the arrays of a population between rounds,
+    when no decisions are cached.
+    '''
+    return {
+        'kinds': population.kinds,
+        **population.beliefs.get_state('beliefs'),
+        **population.nested_beliefs.get_state('nested_beliefs'),
+        'order_beliefs': population.order_beliefs,
+    }
+
+def restore_population(state: Dict[str, np.ndarray]) -> AgentPopulation:
+    ''' Rebuilds a population from the arrays of population_state. '''
+    return AgentPopulation(
+        kinds=state['kinds'],
+        beliefs=BeliefMatrix.from_state('beliefs', state),
+        nested_beliefs=BeliefMatrix.from_state('nested_beliefs', state),
+        order_beliefs=state['order_beliefs'],
+    )
+
+def zero_order_decide(best: np.ndarray, number_of_choices: int, eps: float = EPS) -> np.ndarray:
+    '''
+    Batched ZeroOrderTheoryOfMindAgent.decide: the choice
+    after the most believed one, or a random choice
+    with epsilon probability, given the argmax of
+    every row of beliefs.
+    '''
+    explore = check_epsilons(eps, best.shape)
+    random_choices = make_random_choices(number_of_choices, best.shape)
+
+    return np.where(explore, random_choices, (best + 1) % number_of_choices)
+
+def zero_order_update(
+        beliefs: BeliefMatrix,
+        actions: np.ndarray,
+        learning_speed: float = LEARNING_SPEED
+    ) -> None:
+    '''
+    Batched ZeroOrderTheoryOfMindAgent.update: rescales
+    every row to sum to (1 - learning_speed) and then
+    reinforces the chosen action, in place and in O(1)
+    per row.
+    '''
+    beliefs.reinforce(actions, learning_speed)
+
+def population_decide(population: AgentPopulation, eps: float = EPS) -> np.ndarray:
+    '''
+    Gets the decision of every agent in
+    the population as an ([R,] N) array.
+    '''
+    number_of_choices = population.number_of_choices
+    kinds = population.kinds
+    second_order = population.second_order
+
+    # Zero-order decision for every row: the agent itself for zero-order
+    # agents and the zero-order model for first and second-order agents
+    zero_order_decisions = zero_order_decide(population.beliefs.best, number_of_choices, eps)
+    population.zero_order_decisions = zero_order_decisions
+    actions = np.where(
+        kinds == ZERO_ORDER,
+        zero_order_decisions,
+        (zero_order_decisions + 1) % number_of_choices
+    )
+
+    # The zero-order decisions of first and second-order agents are those of their models
+    count_nested_model_calls(int(np.count_nonzero(np.broadcast_to(kinds != ZERO_ORDER, actions.shape))))
+    if population.nested_beliefs.rows == 0:
+        return actions
+
+    # Second-order agents pick which model to follow, with epsilon exploration
+    order_beliefs = population.order_beliefs[..., second_order, :]
+    explore = check_epsilons(eps, order_beliefs.shape[:-1])
+    random_orders = make_random_choices(2, order_beliefs.shape[:-1])
+    follow_first_order = np.where(
+        explore,
+        random_orders == 1,
+        ~(order_beliefs[..., 0] > order_beliefs[..., 1])
+    )
+
+    # First-order model decision is one above its zero-order model
+    population.nested_decisions = zero_order_decide(population.nested_beliefs.best, number_of_choices, eps)
+    count_nested_model_calls(2 * population.nested_decisions.size)
+    first_order_decisions = (population.nested_decisions + 1) % number_of_choices
+    actions[..., second_order] = np.where(
+        follow_first_order,
+        (first_order_decisions + 1) % number_of_choices,
+        actions[..., second_order]
+    )
+
+    return actions
+
+def population_update(
+        population: AgentPopulation,
+        actions: np.ndarray,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED
+    ) -> None:
+    '''
+    Updates the beliefs of every agent in
+    the population given their own actions.
+    '''
+    number_of_choices = population.number_of_choices
+    second_order = population.second_order
+    second_order_actions = actions[..., second_order]
+
+    if second_order_actions.shape[-1] > 0:
+        # Each lower level model's decision before the models learn, reused from deciding
+        zero_order_decisions = population.zero_order_decisions
+        if zero_order_decisions is None:
+            zero_order_decisions = zero_order_decide(population.beliefs.best, number_of_choices, eps)
+        nested_decisions = population.nested_decisions
+        if nested_decisions is None:
+            nested_decisions = zero_order_decide(population.nested_beliefs.best, number_of_choices, eps)
+
+        zero_order_higher_decisions = (zero_order_decisions[..., second_order] + 1) % number_of_choices
+        first_order_higher_decisions = (nested_decisions + 2) % number_of_choices
+
+    # Update the zero-order beliefs (and nested models) of every agent
+    zero_order_update(population.beliefs, actions, learning_speed)
+    zero_order_update(population.nested_beliefs, second_order_actions, learning_speed)
+    population.zero_order_decisions = None
+    population.nested_decisions = None
+
+    if second_order_actions.shape[-1] == 0:
+        return
+
+    # Update order beliefs where either model predicted the action
+    zero_order_hit = second_order_actions == zero_order_higher_decisions
+    first_order_hit = (second_order_actions == first_order_higher_decisions) & ~zero_order_hit
+    hit = zero_order_hit | first_order_hit
+
+    order_beliefs = population.order_beliefs[..., second_order, :]
+    order_beliefs[hit] *= (1.0 - learning_speed) / order_beliefs[hit].sum(axis=-1, keepdims=True)
+    order_beliefs[zero_order_hit, 0] += learning_speed
+    order_beliefs[first_order_hit, 1] += learning_speed
+
+def results_from_scores(kinds: np.ndarray, agent_scores: np.ndarray) -> RegularSimulationResults:
+    '''
+    Computes the per ToM level statistics
+    of a single population's scores.
+    '''
+    zero_order_scores = agent_scores[kinds == ZERO_ORDER]
+    first_order_scores = agent_scores[kinds == FIRST_ORDER]
+    second_order_scores = agent_scores[kinds == SECOND_ORDER]
+
+    return RegularSimulationResults(
+        zero_order_mean=get_mean(zero_order_scores),
+        zero_order_std=get_std(zero_order_scores),
+        first_order_mean=get_mean(first_order_scores),
+        first_order_std=get_std(first_order_scores),
+        second_order_mean=get_mean(second_order_scores),
+        second_order_std=get_std(second_order_scores),
+    )
+
+@register_backend
+class NumpyBackend(SimulationBackend):
+    '''
+    Array backend: the population as an
+    AgentPopulation, advanced with
+    population_decide and population_update.
+    It may hold several replicates along a
+    leading axis and store beliefs in reduced
+    precision.
+
+    Args:
+        precision: str == Storage precision of the beliefs, see agents.beliefs.PRECISIONS
+        number_of_replicates: Optional[int] == If given, advance that many
+            independent populations at once
+    '''
+    name = 'numpy'
+
+    def __init__(
+        self,
+        agent_config: AgentsConfiguration,
+        number_of_choices: int = NUM_OF_CHOICES,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED,
+        precision: str = 'float64',
+        number_of_replicates: Optional[int] = None
+    ) -> None:
+        super().__init__(agent_config, number_of_choices, eps, learning_speed)
+        self.population: AgentPopulation = create_population(
+            agent_config, number_of_choices, number_of_replicates, precision
+        )
+
+    @property
+    def batch_shape(self) -> tuple:
+        return self.population.batch_shape
+
+    def decide(self) -> np.ndarray:
+        return population_decide(self.population, self.eps)
+
+    def update(self, actions: np.ndarray) -> None:
+        population_update(self.population, actions, self.eps, self.learning_speed)
+
+    def get_results(self, agent_scores: np.ndarray) -> RegularSimulationResults:
+        return results_from_scores(self.population.kinds, agent_scores)
+
+    def belief_distribution(self) -> np.ndarray:
+        beliefs = self.population.beliefs
+        return beliefs.scaled() / beliefs.total[..., np.newaxis]
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return population_state(self.population)
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        population = restore_population(state)
+        if population.beliefs.values.shape != self.population.beliefs.values.shape:
+            raise ValueError(
+                f"State beliefs of shape {population.beliefs.values.shape}, "
+                f"not {self.population.beliefs.values.shape}."
+            )
+        if population.beliefs.precision != self.population.beliefs.precision:
+            raise ValueError(
+                f"State beliefs in {population.beliefs.precision.name}, "
+                f"not {self.population.beliefs.precision.name}."
+            )
+        self.population = population
+
+class VectorizedRegularSimulation(RegularSimulation):
+    '''
+    A Simulation of Theory of Mind
+    agents playing the mod game without
+    signaling, with the whole population
+    stored and advanced as NumPy arrays:
+    a RegularSimulation on the numpy backend.
+
+    Args:
+        agent_config: AgentsConfiguration == The Agent Population Config
+        number_of_choices: int == Number of choices in the mod game
+        history_window: Optional[int] == Rounds of actions kept in memory,
+            None keeps all of them (only the last SPILLED_WINDOW with a history_path)
+        history_path: Optional[str] == File the full action history is spilled to
+        seed: Optional[int] == Seed of the simulation's random stream
+        eps: float == Exploration probability of every decision
+        learning_speed: float == Learning speed of every belief update
+        interaction_graph: Optional[InteractionGraph] == Neighbours each agent is scored against,
+            None scores every agent against all others
+        precision: str == Storage precision of the beliefs, see agents.beliefs.PRECISIONS
+    '''
+    def __init__(
+        self,
+        agent_config: AgentsConfiguration = AgentsConfiguration(5,5,5),
+        number_of_choices: int = NUM_OF_CHOICES,
+        history_window: Optional[int] = None,
+        history_path: Optional[str] = None,
+        seed: Optional[int] = None,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED,
+        interaction_graph: Optional[InteractionGraph] = None,
+        precision: str = 'float64'
+    ):
+        super().__init__(
+            agent_config, history_window, history_path, seed, interaction_graph, 'numpy',
+            eps, learning_speed, number_of_choices, {'precision': precision}
+        )
+
+    @property
+    def population(self) -> AgentPopulation:
+        return self.backend.population
+
+    @population.setter
+    def population(self, population: AgentPopulation) -> None:
+        self.backend.population = population
+
+class BatchedRegularSimulation(VectorizedRegularSimulation):
+    '''
+    R independent replicates of the same
+    AgentsConfiguration, stored as
+    (replicates x agents x choices) arrays and
+    advanced together by the vectorized round.
+    All replicates share the interaction graph.
+    '''
+    def __init__(
+        self,
+        agent_config: AgentsConfiguration = AgentsConfiguration(5,5,5),
+        number_of_replicates: int = 10,
+        number_of_choices: int = NUM_OF_CHOICES,
+        history_window: Optional[int] = None,
+        history_path: Optional[str] = None,
+        seed: Optional[int] = None,
+        eps: float = EPS,
+        learning_speed: float = LEARNING_SPEED,
+        interaction_graph: Optional[InteractionGraph] = None,
+        precision: str = 'float64'
+    ):
+        self.number_of_replicates = number_of_replicates
+        RegularSimulation.__init__(
+            self, agent_config, history_window, history_path, seed, interaction_graph, 'numpy',
+            eps, learning_speed, number_of_choices,
+            {'precision': precision, 'number_of_replicates': number_of_replicates}
+        )
+
+    def level_rates(self) -> np.ndarray:
+        # The batch stops as a whole, so it converges on the rates pooled over replicates
+        return self.statistics.last_means.mean(axis=0)
+
+    def get_results(self) -> List[RegularSimulationResults]:
+        '''
+        Calculates the statistics of every replicate
+        and returns one RegularSimulationResults each.
+        '''
+        return [
+            results_from_scores(self.population.kinds, replicate_scores)
+            for replicate_scores in self.agent_scores
+        ]
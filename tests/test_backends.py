@@ -0,0 +1,19 @@
+import pytest
+
+from simulations.backend_equivalence import BELIEF_TOLERANCE, compare_backends
+from simulations.interaction_graph import InteractionGraph
+
+@pytest.mark.parametrize('simulation_kwargs', [
+    {},
+    {'number_of_choices': 7},
+    {'interaction_graph': InteractionGraph.ring(60, 4)},
+], ids=['default', 'seven_choices', 'ring'])
+def test_backends_match_reference_without_exploration(simulation_kwargs):
+    reports = compare_backends(eps=0.0, **simulation_kwargs)
+
+    assert reports
+    for report in reports:
+        assert report.matches
+        assert report.first_mismatch_epoch is None
+        assert report.choice_agreement == 1.0
+        assert report.max_belief_difference <= BELIEF_TOLERANCE
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from simulations.higher_order_simulation import HigherOrderSimulation
+from simulations.regular_simulation import RegularSimulation
+from simulations.signaling_simulation import SignalingSimulation
+from simulations.vectorized_simulation import BatchedRegularSimulation, VectorizedRegularSimulation
+from utilities import AgentsConfiguration, HigherOrderConfiguration
+
+SIMULATIONS = [
+    lambda seed, **kwargs: RegularSimulation(AgentsConfiguration(4, 4, 4), seed=seed, **kwargs),
+    lambda seed, **kwargs: RegularSimulation(AgentsConfiguration(4, 4, 4), seed=seed, backend='numpy', **kwargs),
+    lambda seed, **kwargs: VectorizedRegularSimulation(AgentsConfiguration(4, 4, 4), seed=seed, **kwargs),
+    lambda seed, **kwargs: BatchedRegularSimulation(AgentsConfiguration(4, 4, 4), 3, seed=seed, **kwargs),
+    lambda seed, **kwargs: HigherOrderSimulation(HigherOrderConfiguration((3, 3, 3, 3)), seed=seed, **kwargs),
+    lambda seed, **kwargs: SignalingSimulation(AgentsConfiguration(4, 0, 0), seed=seed, **kwargs),
+]
+
+@pytest.mark.parametrize('create_simulation', SIMULATIONS)
+def test_resumed_run_matches_uninterrupted_run(create_simulation, tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint')
+    simulation = create_simulation(0)
+    simulation.run(30)
+    simulation.save_checkpoint(checkpoint_path)
+    simulation.run(30)
+
+    # A differently seeded simulation takes everything from the checkpoint
+    resumed = create_simulation(1)
+    resumed.load_checkpoint(checkpoint_path)
+    resumed.run(30)
+
+    assert resumed.epoch == simulation.epoch
+    assert resumed.get_results() == simulation.get_results()
+    assert np.array_equal(resumed.agent_actions.full(), simulation.agent_actions.full())
+    assert np.array_equal(resumed.statistics.epoch_means, simulation.statistics.epoch_means)
+
+def test_resumed_run_continues_spilled_history(tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint')
+    simulation = VectorizedRegularSimulation(seed=0, history_path=str(tmp_path / 'uninterrupted.bin'))
+    simulation.run(30)
+    simulation.save_checkpoint(checkpoint_path)
+    simulation.run(30)
+
+    # The resumed run writes to its own copy of the spill file, truncated to the checkpoint
+    resumed_path = tmp_path / 'resumed.bin'
+    resumed_path.write_bytes((tmp_path / 'uninterrupted.bin').read_bytes())
+    resumed = VectorizedRegularSimulation(seed=1, history_path=str(resumed_path))
+    resumed.load_checkpoint(checkpoint_path)
+    resumed.run(30)
+
+    assert resumed.get_results() == simulation.get_results()
+    assert np.array_equal(resumed.agent_actions.full(), simulation.agent_actions.full())
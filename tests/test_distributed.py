@@ -0,0 +1,31 @@
+from simulations.distributed import decode_result, replicate_jobs, run_distributed_sweep, run_job
+from simulations.parameter_sweep import expand_grid, run_sweep
+from simulations.signaling_simulation import SignalingSimulation
+from utilities import AgentsConfiguration
+
+def test_distributed_sweep_matches_local_sweep(tmp_path):
+    cells = expand_grid([AgentsConfiguration(4, 4, 4)], epsilons=(0.0, 0.1), numbers_of_choices=(5, 23))
+
+    distributed = run_distributed_sweep(
+        cells, epochs=20, number_of_replicates=2,
+        cache_directory=str(tmp_path / 'distributed'), local_workers=2
+    )
+    local = run_sweep(
+        cells, epochs=20, number_of_replicates=2,
+        cache_directory=str(tmp_path / 'local'), workers=1
+    )
+
+    assert distributed == local
+
+def test_signaling_statistics_job():
+    job, = replicate_jobs(
+        AgentsConfiguration(3, 3, 3), number_of_replicates=1, epochs=10,
+        simulation_class=SignalingSimulation, statistics=True
+    )
+
+    levels = decode_result(run_job(job))
+    number_of_pairs = SignalingSimulation(AgentsConfiguration(3, 3, 3)).population.size
+
+    # Signalers then receivers, one score each per round
+    assert len(levels) == 2
+    assert all(level.count == 10 * number_of_pairs for level in levels)
@@ -0,0 +1,73 @@
+import numpy as np
+
+from agents.higher_order_agents import KthOrderTheoryOfMindAgent, ModelChain
+from agents.regular_agents import (
+    FirstOrderTheoryOfMindAgent,
+    SecondOrderTheoryOfMindAgent,
+    ZeroOrderTheoryOfMindAgent
+)
+from simulations.higher_order_simulation import HigherOrderSimulation
+from simulations.regular_simulation import configure_agent
+from utilities import HigherOrderConfiguration, NUM_OF_CHOICES, generate_beliefs, using_random_stream, RandomStream
+
+def play_alike(agents, number_of_rounds: int = 300, seed: int = 0) -> None:
+    ''' Feeds every agent the same actions and checks they always decide alike. '''
+    for agent in agents:
+        configure_agent(agent, 0.0, 0.1)
+
+    actions = np.random.default_rng(seed).integers(NUM_OF_CHOICES, size=number_of_rounds).tolist()
+    for round_index, action in enumerate(actions):
+        decisions = [agent.decide() for agent in agents]
+        assert decisions == [decisions[0]] * len(agents), f"Decisions differ in round {round_index}"
+        for agent in agents:
+            agent.update(action)
+
+def test_first_order_agent_matches_order_1_agent():
+    with using_random_stream(RandomStream(0)):
+        beliefs = generate_beliefs()
+
+    play_alike([
+        FirstOrderTheoryOfMindAgent(ZeroOrderTheoryOfMindAgent(beliefs=list(beliefs))),
+        KthOrderTheoryOfMindAgent(1, ModelChain(1, list(beliefs))),
+    ])
+
+def test_second_order_agent_matches_order_2_agent():
+    # The second-order agent's nested models start alike, so they stay alike like a ModelChain's
+    with using_random_stream(RandomStream(0)):
+        beliefs, order_beliefs = generate_beliefs(), generate_beliefs(2)
+
+    play_alike([
+        SecondOrderTheoryOfMindAgent(
+            zero_order_agent=ZeroOrderTheoryOfMindAgent(beliefs=list(beliefs)),
+            first_order_agent=FirstOrderTheoryOfMindAgent(ZeroOrderTheoryOfMindAgent(beliefs=list(beliefs))),
+            order_beliefs=list(order_beliefs)
+        ),
+        KthOrderTheoryOfMindAgent(2, ModelChain(2, list(beliefs)), list(order_beliefs)),
+    ])
+
+def test_agents_match_array_engine():
+    simulation = HigherOrderSimulation(
+        HigherOrderConfiguration((3, 3, 3, 3, 3, 3)), history_window=1, seed=0, eps=0.0
+    )
+    population = simulation.population
+
+    # Agents of order k take their levels' rows, which are the last ones of every level
+    def level_beliefs(level: int, row: int):
+        return population.order_beliefs[level][row - population.level_rows(level).start].tolist()
+
+    agents = []
+    for row, (order, beliefs) in enumerate(zip(population.orders.tolist(), population.beliefs.scaled().tolist())):
+        if order == 0:
+            agents.append(ZeroOrderTheoryOfMindAgent(beliefs=beliefs))
+            continue
+        model_chain = ModelChain(order, beliefs, order_beliefs=[level_beliefs(level, row) for level in range(2, order)])
+        agents.append(KthOrderTheoryOfMindAgent(order, model_chain, level_beliefs(order, row) if order >= 2 else None))
+    for agent in agents:
+        configure_agent(agent, 0.0, simulation.learning_speed)
+
+    for _ in range(300):
+        simulation.run(1)
+        actions = [agent.decide() for agent in agents]
+        assert actions == simulation.agent_actions.last_round.tolist(), f"Actions differ in epoch {simulation.epoch}"
+        for agent, action in zip(agents, actions):
+            agent.update(action)
@@ -0,0 +1,22 @@
+from simulations.parameter_sweep import expand_grid, run_sweep
+from simulations.signaling_simulation import SignalingSimulation
+from utilities import AgentsConfiguration, SignalingSimulationResults
+
+def test_cached_results_keep_their_type(tmp_path):
+    cells = expand_grid([AgentsConfiguration(4, 4, 4)], epsilons=(0.0, 0.1))
+    cache_directory = str(tmp_path / 'cache')
+
+    computed = run_sweep(
+        cells, epochs=10, number_of_replicates=2, cache_directory=cache_directory,
+        workers=1, simulation_class=SignalingSimulation
+    )
+    cached = run_sweep(
+        cells, epochs=10, number_of_replicates=2, cache_directory=cache_directory,
+        workers=1, simulation_class=SignalingSimulation
+    )
+
+    assert cached == computed
+    assert all(
+        isinstance(results, SignalingSimulationResults)
+        for replicates in cached.values() for results in replicates
+    )
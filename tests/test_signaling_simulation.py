@@ -0,0 +1,12 @@
+import pytest
+
+from simulations.backend_equivalence import BELIEF_TOLERANCE, compare_signaling_engines
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_signaling_agents_match_array_engine(seed):
+    report = compare_signaling_engines(seed=seed)
+
+    assert report.matches
+    assert report.first_mismatch_epoch is None
+    assert report.choice_agreement == 1.0
+    assert report.max_belief_difference <= BELIEF_TOLERANCE
@@ -1,7 +1,11 @@
 import numpy as np
-from dataclasses import dataclass
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from operator import length_hint
+from typing import Iterator, List, Optional, Tuple, Union
 
 NUM_OF_CHOICES = 23
+RANDOM_BLOCK_SIZE = 65536
 
 @dataclass
 class AgentsConfiguration:
@@ -14,6 +18,15 @@ class AgentsConfiguration:
     first_order_agent_number: int
     second_order_agent_number: int
 
+@dataclass
+class HigherOrderConfiguration:
+    '''
+    Utility dataclass to store the number
+    of agents of every order of Theory of
+    Mind, from order 0 up.
+    '''
+    agent_numbers: Tuple[int, ...]
+
 @dataclass
 class RegularSimulationResults:
     '''
@@ -28,37 +41,238 @@ class RegularSimulationResults:
     second_order_mean: float
     second_order_std: float 
 
-def generate_beliefs(number_of_choices: int = NUM_OF_CHOICES):
-    ''' Generates a set of random beliefs. '''
-    random_numpy_list = list(np.random.rand(number_of_choices,1))
-    new_list = []
+@dataclass
+class SignalingSimulationResults:
+    '''
+    Utility dataclass to store
+    signaling game results.
+    '''
+    signaling_mean: float
+    signaling_std: float
+    receiving_mean: float
+    receiving_std: float
+
+@dataclass
+class HigherOrderSimulationResults:
+    '''
+    Utility dataclass to store agent
+    results of every ToM order.
+    '''
+    means: List[float]
+    stds: List[float]
+
+def per_round_results(results, epochs: int):
+    '''
+    Divides the statistics of a results dataclass
+    gathered over `epochs` rounds to per round ones.
+    '''
+    def per_round(value):
+        if isinstance(value, list):
+            return [element / epochs for element in value]
+        return value / epochs
+
+    return type(results)(**{field.name: per_round(getattr(results, field.name)) for field in fields(results)})
+
+class RandomStream:
+    '''
+    Random number service built on a numpy Generator.
+
+    Scalar draws are served from a pre-drawn block of
+    uniforms that is refilled in bulk, which avoids the
+    per-call overhead of numpy's random functions.
+    Random integers are derived from the same uniforms.
+    Array draws go to the Generator directly.
+
+    The stream counts the values it serves, the
+    epsilon checks that chose to explore and the
+    decisions of nested models computed while it is
+    active, for instrumentation.
+
+    Args:
+        seed: Union[int, np.random.SeedSequence, None] == Seed of the stream,
+            None for fresh entropy
+        block_size: int == Number of uniforms drawn per refill
+    '''
+    def __init__(
+        self,
+        seed: Union[int, np.random.SeedSequence, None] = None,
+        block_size: int = RANDOM_BLOCK_SIZE
+    ) -> None:
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+        self.generator = np.random.Generator(np.random.PCG64(self.seed_sequence))
+        self.block_size = block_size
+        self.explorations: int = 0
+        self.nested_model_calls: int = 0
+        self._array_draws: int = 0
+        self._scalar_draws: int = 0
+        self._block_length: int = 0
+        self._next_uniform = iter(()).__next__
+
+    def _start_block(self, uniforms: List[float]) -> None:
+        # Count what was served from the previous block
+        self._scalar_draws += self._block_length - length_hint(self._next_uniform.__self__)
+        self._block_length = len(uniforms)
+        self._next_uniform = iter(uniforms).__next__
+
+    def _refill(self) -> None:
+        self._start_block(self.generator.random(self.block_size).tolist())
 
-    for element in random_numpy_list:
-        new_list.append(list(element))
+    @property
+    def number_of_draws(self) -> int:
+        ''' Number of random values served so far, scalar or in arrays. '''
+        return self._scalar_draws + self._block_length - length_hint(self._next_uniform.__self__) + self._array_draws
 
-    return [item for sublist in new_list for item in sublist]
+    def random(self) -> float:
+        ''' Returns one uniform float in [0.0, 1.0). '''
+        try:
+            return self._next_uniform()
+        except StopIteration:
+            self._refill()
+            return self._next_uniform()
+
+    def integers(self, high: int) -> int:
+        ''' Returns one uniform integer in [0, high). '''
+        return int(self.random() * high)
+
+    def random_array(self, shape) -> np.ndarray:
+        ''' Returns an array of uniform floats in [0.0, 1.0). '''
+        values = self.generator.random(shape)
+        self._array_draws += values.size
+        return values
+
+    def integers_array(self, high: int, shape) -> np.ndarray:
+        ''' Returns an array of uniform integers in [0, high). '''
+        values = self.generator.integers(high, size=shape)
+        self._array_draws += values.size
+        return values
+
+    def spawn(self, number_of_streams: int) -> List['RandomStream']:
+        ''' Returns independent child streams. '''
+        return [
+            RandomStream(child_sequence, self.block_size)
+            for child_sequence in self.seed_sequence.spawn(number_of_streams)
+        ]
+
+    def get_state(self) -> Tuple[dict, np.ndarray]:
+        '''
+        Returns the generator state and the uniforms
+        left in the current block. Reading the block
+        consumes the iterator, so it is rebuilt.
+        '''
+        remaining = [self._next_uniform() for _ in range(length_hint(self._next_uniform.__self__))]
+        self._scalar_draws -= len(remaining)
+        self._start_block(remaining)
+        return self.generator.bit_generator.state, np.array(remaining, dtype=np.float64)
+
+    def set_state(self, state: Tuple[dict, np.ndarray]) -> None:
+        ''' Restores a state returned by get_state. '''
+        bit_generator_state, remaining = state
+        self.generator.bit_generator.state = bit_generator_state
+        self._start_block(np.asarray(remaining).tolist())
+
+_random_stream = RandomStream()
+
+def get_random_stream() -> RandomStream:
+    ''' Returns the stream the random helpers below draw from. '''
+    return _random_stream
+
+def set_random_stream(stream: RandomStream) -> RandomStream:
+    ''' Makes the random helpers draw from stream, returns the previous one. '''
+    global _random_stream
+    previous_stream = _random_stream
+    _random_stream = stream
+    return previous_stream
+
+def seed_random(seed: Optional[int]) -> None:
+    ''' Replaces the active stream with a freshly seeded one. '''
+    set_random_stream(RandomStream(seed))
+
+@contextmanager
+def using_random_stream(stream: RandomStream) -> Iterator[RandomStream]:
+    ''' Makes the random helpers draw from stream inside a with block. '''
+    previous_stream = set_random_stream(stream)
+    try:
+        yield stream
+    finally:
+        set_random_stream(previous_stream)
+
+def generate_beliefs(number_of_choices: int = NUM_OF_CHOICES):
+    ''' Generates a set of random beliefs. '''
+    return _random_stream.random_array(number_of_choices).tolist()
 
 def generate_2d_beliefs(number_of_choices: int = NUM_OF_CHOICES):
     ''' Generates a set of random beliefs for receiving agents. '''
-    random_numpy_list = list(np.random.rand(number_of_choices,number_of_choices))
-    new_list = []
+    return _random_stream.random_array((number_of_choices, number_of_choices)).tolist()
 
-    for element in random_numpy_list:
-        new_list.append(list(element))
+def generate_agent_beliefs(number_of_agents: int, shapes: List[Tuple[int, ...]]) -> List[np.ndarray]:
+    '''
+    Draws the initial beliefs of many agents in one go.
+    Each agent draws one array per shape, in order, so
+    the values are those of drawing agent by agent with
+    generate_beliefs and generate_2d_beliefs. Returns
+    one (number_of_agents, *shape) array per shape.
+    '''
+    sizes = [int(np.prod(shape)) for shape in shapes]
+    draws = _random_stream.random_array((number_of_agents, sum(sizes)))
+    bounds = np.cumsum([0] + sizes)
 
-    return new_list
+    return [
+        draws[:, start:stop].reshape((number_of_agents,) + tuple(shape))
+        for shape, start, stop in zip(shapes, bounds[:-1], bounds[1:])
+    ]
 
 def check_epsilon(eps: float):
     ''' 
     Samples a random float between 0.0 and 
     1.0 to check against an epsilon value.
     '''
-    probability: float = np.random.random_sample()
-    return probability < eps
+    probability: float = _random_stream.random()
+    if probability < eps:
+        _random_stream.explorations += 1
+        return True
+    return False
+
+def count_nested_model_calls(number: int = 1) -> None:
+    ''' Counts decisions of nested models on the active stream, for instrumentation. '''
+    _random_stream.nested_model_calls += number
 
 def make_random_choice(number_of_choices: int = NUM_OF_CHOICES):
     ''' Makes a random choice given the number of choices. '''
-    return np.random.randint(number_of_choices)
+    return _random_stream.integers(number_of_choices)
+
+def check_epsilons(eps: float, shape) -> np.ndarray:
+    ''' Batched check_epsilon, one check per element of shape. '''
+    explore = _random_stream.random_array(shape) < eps
+    _random_stream.explorations += int(np.count_nonzero(explore))
+    return explore
+
+def make_random_choices(number_of_choices: int = NUM_OF_CHOICES, shape = ()) -> np.ndarray:
+    ''' Batched make_random_choice, one choice per element of shape. '''
+    return _random_stream.integers_array(number_of_choices, shape)
+
+def score_actions(actions, number_of_choices: int = NUM_OF_CHOICES) -> np.ndarray:
+    '''
+    Scores a round of the mod game: each agent gets a
+    point for every agent that chose the choice right
+    below its own. Builds a per-choice count once, so
+    a round costs O(N + number_of_choices). Leading
+    axes of actions are independent games (replicates).
+    '''
+    actions = np.asarray(actions)
+    games = actions.reshape(-1, actions.shape[-1])
+    number_of_games = games.shape[0]
+
+    # One histogram per game, offset so all games share a single bincount
+    offsets = np.arange(number_of_games)[:, np.newaxis] * number_of_choices
+    counts = np.bincount(
+        (games + offsets).ravel(), minlength=number_of_games * number_of_choices
+    ).reshape(number_of_games, number_of_choices)
+
+    scores = np.take_along_axis(counts, (games - 1) % number_of_choices, axis=1)
+    return scores.reshape(actions.shape)
 
 def get_mean(array_like) -> float:
     ''' Gets the mean of an array-like (list, np array, etc.)'''